@@ -0,0 +1,111 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from ..plot import core as plot
+
+"""
+Замер времени построения и размера интерактивной heatmap матрицы удержания: create_annotated_heatmap
+(аннотация на каждую ячейку, как в исходной get_int_heatmap) против одного trace с texttemplate и блоками.
+Запуск: python -m abo_tools.benchmarks.bench_heatmap --sizes 30 90 365
+"""
+
+def make_matrix(n, seed=0):
+    """
+    Функция генерации матрицы удержания n x n в процентах, будущие периоды - NaN
+    Parameters
+    ----------
+    n : int
+        Кол-во когорт\n
+    seed : int
+        Зерно генератора
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        Объект pandas df, как результат cohort_retention.
+    """
+    rs = np.random.RandomState(seed)
+    values = 100 * np.exp(-np.arange(n) / (n / 4.0)) * rs.uniform(0.8, 1.0, (n, n))
+    values[:, 0] = 100
+    values[np.arange(n)[:, None] + np.arange(n) > n - 1] = np.nan
+    index = pd.Index(pd.date_range('2020-01-01', periods=n).strftime('%Y-%m-%d'), name='cohort')
+
+    return pd.DataFrame(values, index=index, columns=range(n))
+
+def reference_figure(df, title=''):
+    """
+    Функция построения heatmap, как в исходной get_int_heatmap: trace heatmap и аннотация на каждую ячейку,
+    как в plotly.figure_factory.create_annotated_heatmap (в новых версиях plotly этой функции нет)
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Матрица значений.\n
+    title : str
+        Название графика
+
+    Returns
+    -------
+    fig : plotly.graph_objs._figure.Figure
+        Объект Figure библиотеки plotly.
+    """
+    z = df.values
+    x = df.columns.array
+    y = df.index.array
+    colorscale = [[0,'#FFFFFF'],[1, '#F1C40F']]
+    z_text = np.around(z, decimals=2)
+    if hasattr(plot.ff, 'create_annotated_heatmap'):
+        fig = plot.ff.create_annotated_heatmap(z, x, annotation_text=z_text, colorscale=colorscale,
+                                               hoverinfo='z', showscale=True)
+    else:
+        annotations = [plot.go.layout.Annotation(text=str(z_text[i][j]), x=x[j], y=y[i], xref='x1', yref='y1',
+                                                 showarrow=False)
+                       for i in range(len(y)) for j in range(len(x))]
+        fig = plot.go.Figure(plot.go.Heatmap(z=z, x=x, y=y, colorscale=colorscale, hoverinfo='z', showscale=True),
+                             plot.go.Layout(annotations=annotations))
+    fig.layout.update(plot.go.Layout(title = title))
+
+    return fig
+
+def measure(build, df):
+    """
+    Функция замера времени построения figure и размера его JSON
+    Parameters
+    ----------
+    build : callable
+        Функция построения figure по матрице.\n
+    df : pandas.DataFrame
+        Матрица значений
+
+    Returns
+    -------
+    result : tuple
+        Время построения в секундах и размер JSON в байтах.
+    """
+    start = time.perf_counter()
+    fig = build(df)
+    payload = fig.to_json()
+    return time.perf_counter() - start, len(payload)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[30, 90, 365])
+    parser.add_argument('--max-size', type=int, default=200)
+    parser.add_argument('--skip-reference-above', type=int, default=None,
+                        help='Не строить исходную heatmap для матриц больше этого размера')
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        df = make_matrix(n)
+        line = 'n={:<5}'.format(n)
+        if args.skip_reference_above is None or n <= args.skip_reference_above:
+            seconds, size = measure(reference_figure, df)
+            line += ' annotated {:8.2f}s {:10.1f} KB'.format(seconds, size / 1024.0)
+        seconds, size = measure(lambda d: plot._int_heatmap_figure(d, max_size=None), df)
+        line += '  single trace {:8.2f}s {:10.1f} KB'.format(seconds, size / 1024.0)
+        seconds, size = measure(lambda d: plot._int_heatmap_figure(d, max_size=args.max_size), df)
+        line += '  blocks {:8.2f}s {:10.1f} KB'.format(seconds, size / 1024.0)
+        print(line)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+"""
+Замер времени импорта модулей abo_tools в чистом интерпретаторе и проверка, что при импорте не загружаются
+библиотеки графиков (plotly, matplotlib, seaborn): они должны импортироваться только при построении графика.
+Запуск: python -m abo_tools.benchmarks.bench_import --repeat 5 --check
+"""
+
+MODULES = [
+    'abo_tools.reports.funnel',
+    'abo_tools.reports.flow',
+    'abo_tools.reports.stream',
+    'abo_tools.retention.core',
+    'abo_tools.retention.state',
+    'abo_tools.portrait.core',
+    'abo_tools.utils.utils_core',
+    'abo_tools.plot.core',
+]
+
+PLOTTING = ('plotly', 'matplotlib', 'seaborn')
+
+SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+loaded = sorted({{name.split('.')[0] for name in sys.modules}} & set({plotting!r}))
+print(json.dumps({{'seconds': elapsed, 'plotting': loaded}}))
+'''
+
+def measure(module, repeat=3):
+    """
+    Функция замера времени импорта модуля в отдельном процессе
+    Parameters
+    ----------
+    module : str
+        Полное имя модуля\n
+    repeat : int
+        Кол-во запусков, берется минимальное время
+
+    Returns
+    -------
+    result : dict
+        Словарь с минимальным временем импорта (seconds) и загруженными библиотеками графиков (plotting).
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    results = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', SCRIPT.format(module=module, plotting=PLOTTING)], env=env)
+        results.append(json.loads(output.decode().strip().splitlines()[-1]))
+
+    return {'seconds': min(r['seconds'] for r in results), 'plotting': results[0]['plotting']}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help='Максимальное время импорта одного модуля для --check')
+    parser.add_argument('--check', action='store_true',
+                        help='Завершиться с ошибкой, если модуль загружает библиотеки графиков или импортируется дольше --max-seconds')
+    args = parser.parse_args()
+
+    failed = []
+    for module in MODULES:
+        result = measure(module, args.repeat)
+        print('{:<32} {:8.3f}s  {}'.format(module, result['seconds'], ', '.join(result['plotting'])))
+        if result['plotting'] or (args.max_seconds is not None and result['seconds'] > args.max_seconds):
+            failed.append(module)
+
+    if args.check and failed:
+        sys.exit('Регрессия времени импорта: {}'.format(', '.join(failed)))
+
+if __name__ == '__main__':
+    main()
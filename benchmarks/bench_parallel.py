@@ -0,0 +1,41 @@
+import argparse
+import time
+from ..reports import funnel as funnel
+from ..reports import flow as flow
+from ..reports.event_log import EventLog
+from ..utils.synthetic import make_event_log
+
+"""
+Замер ускорения n_jobs для воронки и путей клиентов на синтетическом логе.
+Запуск: python -m abo_tools.benchmarks.bench_parallel --rows 10000000 --jobs 1 4 8 32
+"""
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10 ** 7)
+    parser.add_argument('--users', type=int, default=10 ** 6)
+    parser.add_argument('--events', type=int, default=30)
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 4, 8])
+    args = parser.parse_args()
+
+    log = EventLog(make_event_log(args.rows, args.users, args.events))
+    steps = ['event_{}'.format(i) for i in range(6)]
+
+    results = {}
+    for n_jobs in args.jobs:
+        start = time.perf_counter()
+        results[n_jobs] = funnel.create_funnel_df(log, steps, n_jobs=n_jobs)
+        funnel_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        flow.get_user_flow(log, 'event_0', n_steps=6, events_per_step=5, n_jobs=n_jobs)
+        flow_time = time.perf_counter() - start
+
+        print('n_jobs={:<3} funnel {:8.2f}s  flow {:8.2f}s'.format(n_jobs, funnel_time, flow_time))
+
+    # Результат не должен зависеть от кол-ва процессов
+    for n_jobs in args.jobs:
+        assert results[n_jobs].equals(results[args.jobs[0]])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,397 @@
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import types
+import tracemalloc
+import numpy as np
+import pandas as pd
+from ..reports import funnel as funnel
+from ..reports import flow as flow
+from ..reports import stream as stream
+from ..reports.event_log import EventLog
+from ..reports.funnel_state import FunnelState
+from ..reports.sample import sample_users
+from ..retention import core as retention
+from ..retention.state import RetentionState
+from ..portrait import core as portrait
+from ..utils.synthetic import make_event_log
+from . import reference as reference
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+"""
+Бенчмарк публичных функций отчетов на синтетическом логе: время, пиковая память (tracemalloc) и проверка
+результата по эталонным реализациям (benchmarks/reference.py) на небольших логах.
+Результаты сохраняются в JSON с хэшем коммита, --compare сравнивает их с результатами другого коммита.
+Запуск: python -m abo_tools.benchmarks.bench_reports --rows 100000 1000000 10000000 --compare bench_results/abc1234.json
+"""
+
+STEPS = ['event_{}'.format(i) for i in range(6)]
+SAMPLE = 0.5
+# Пакеты событий для инкрементальных состояний и бюджет памяти потокового расчета (меньше лога, чтобы были сбросы на диск)
+N_BATCHES = 10
+MEMORY_LIMIT = 2 ** 24
+
+def _frames_equal(got, expected):
+    pd.testing.assert_frame_equal(got.reset_index(drop=True), expected.reset_index(drop=True), check_dtype=False)
+
+def _check_stacking(got, expected):
+    assert list(got) == list(expected), 'разные подгруппы'
+    for entry in expected:
+        _frames_equal(got[entry], expected[entry])
+
+def _check_flow_df(got, expected):
+    # Эталон упорядочивает узлы через set, поэтому порядок узлов и их id сравниваются через подписи
+    assert dict(zip(got[0], got[1])) == dict(zip(expected[0], expected[1])), 'разные узлы'
+    for labels, _, links in (got, expected):
+        labels = np.array(labels, dtype=object)
+        assert (labels[links['source_id'].values] == links['source'].values).all(), 'неверные source_id'
+        assert (labels[links['target_id'].values] == links['target'].values).all(), 'неверные target_id'
+    columns = ['source', 'target', 'count']
+    _frames_equal(got[2][columns].sort_values(columns[:2]), expected[2][columns].sort_values(columns[:2]))
+
+def _check_same(got, expected):
+    # Эталон - расчет в памяти, поэтому индекс и типы должны совпадать
+    pd.testing.assert_frame_equal(got, expected)
+
+def _check_same_flow_df(got, expected):
+    assert list(got[0]) == list(expected[0]), 'разные узлы'
+    assert list(got[1]) == list(expected[1]), 'разные цвета'
+    _check_same(got[2], expected[2])
+
+def _check_sample_funnel(got, expected):
+    # Эталон считается по той же выборке клиентов, оценка на всех клиентов - кол-во в выборке / SAMPLE
+    _frames_equal(got[['step', 'val_sample']].rename(columns={'val_sample': 'val'}), expected)
+    assert np.allclose(got['val'], got['val_sample'] / SAMPLE), 'неверная оценка val'
+
+def _check_sample_flow_df(got, expected):
+    links = got[2].drop(columns=['count', 'count_low', 'count_high']).rename(columns={'count_sample': 'count'})
+    _check_flow_df((got[0], got[1], links), expected)
+    assert np.allclose(got[2]['count'], got[2]['count_sample'] / SAMPLE), 'неверная оценка count'
+
+def _assert_close(got, expected, relative=0.1):
+    # Допуск - 5 стандартных ошибок HyperLogLog при relative_error=0.02 плюс несколько клиентов для малых ячеек
+    got, expected = np.nan_to_num(np.asarray(got, dtype=np.float64)), np.nan_to_num(np.asarray(expected, dtype=np.float64))
+    assert got.shape == expected.shape, 'разный размер'
+    assert (np.abs(got - expected) <= relative * expected + 3).all(), 'ошибка оценки больше допуска'
+
+def _check_approx_funnel(got, expected):
+    _frames_equal(got[['step', 'val']], expected)
+    _assert_close([sketch.estimate() for sketch in got['val_sketch']], expected['val'])
+
+def _check_approx_retention(got, expected):
+    assert len(got) == len(expected), 'разное кол-во когорт'
+    _assert_close(got.values, expected.reindex(columns=got.columns).values)
+
+def _check_sketches(got, expected):
+    estimates = got.apply(lambda column: [np.nan if sketch is None else sketch.estimate() for sketch in column])
+    _check_approx_retention(estimates, expected)
+
+def _check_export(got, expected):
+    assert list(got.columns) == list(expected.columns), 'разные колонки'
+    assert list(got.index) == list(expected.index), 'разные строки'
+    assert np.allclose(got.values.astype(np.float64), expected.values.astype(np.float64), equal_nan=True)
+
+def _check_retention(got, expected):
+    assert len(got) == len(expected), 'разное кол-во когорт'
+    assert np.array_equal(np.nan_to_num(got.values), np.nan_to_num(expected.reindex(columns=got.columns).values))
+
+def _check_profile(got, expected):
+    # Порядок значений с одинаковым count не задан, поэтому строки сравниваются после сортировки по колонке и значению
+    assert not got['count'].groupby(got['column'], sort=False).diff().gt(0).any(), 'значения не отсортированы по count'
+    columns = ['column', 'value']
+    _frames_equal(got.sort_values(columns), expected.sort_values(columns))
+
+def _profile_codes(df):
+    # Коды ОС в порядке появления, как после utils.categoriсal_dict
+    return pd.DataFrame({'os': pd.factorize(df['os'])[0]})
+
+def _funnel_state(batches):
+    state = FunnelState(STEPS)
+    for batch in batches:
+        state.update(batch)
+    return state.to_funnel_df()
+
+def _retention_state(batches):
+    state = RetentionState('W')
+    for batch in batches:
+        state.update(batch)
+    return state.to_retention_df(by_percent=False)
+
+def _retention_export(df):
+    # Выгрузка удержания: пары колонок (кол-во клиентов, процент) по периодам, первая строка - служебная
+    counts = retention.cohort_retention(df, 'D', by_percent=False)
+    percent = counts.div(counts[0], axis=0) * 100
+    columns = {}
+    for offset in counts.columns:
+        columns['n{:03d}'.format(offset)] = ['клиенты'] + counts[offset].tolist()
+        columns['p{:03d}'.format(offset)] = ['%'] + percent[offset].tolist()
+
+    return pd.DataFrame(columns)
+
+def make_data(df, directory):
+    """
+    Функция подготовки данных бенчмарка, которые не должны попадать в замеры
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Синтетический лог событий\n
+    directory : str
+        Папка для файлов выгрузки
+
+    Returns
+    -------
+    data : types.SimpleNamespace
+        df - лог, log - EventLog с колонкой os, batches - лог, разбитый по времени на N_BATCHES частей,
+        export - выгрузка удержания, export_csv и export_parquet - пути к ней в CSV и Parquet.
+    """
+    bounds = np.linspace(0, len(df), N_BATCHES + 1).astype(int)
+    export = _retention_export(df)
+    export_csv = os.path.join(directory, 'retention.csv')
+    export_parquet = os.path.join(directory, 'retention.parquet')
+    export.to_csv(export_csv, index=False)
+    # Parquet требует один тип в колонке, поэтому числа сохраняются строками, как в выгрузке из Excel
+    export.astype(str).to_parquet(export_parquet, index=False)
+
+    return types.SimpleNamespace(df=df, log=EventLog(df, columns=['os']),
+                                 batches=[df.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])],
+                                 export=export, export_csv=export_csv, export_parquet=export_parquet)
+
+# Название, функция, эталон и проверка. Функции и эталоны принимают данные make_data
+CASES = [
+    ('EventLog', lambda d: EventLog(d.df, columns=['os']), None, None),
+    ('create_funnel_df', lambda d: funnel.create_funnel_df(d.df, STEPS),
+     lambda d: reference.create_funnel_df(d.df, STEPS), _frames_equal),
+    ('create_funnel_df[EventLog]', lambda d: funnel.create_funnel_df(d.log, STEPS),
+     lambda d: reference.create_funnel_df(d.df, STEPS), _frames_equal),
+    ('create_funnel_df[n_jobs=2]', lambda d: funnel.create_funnel_df(d.df, STEPS, n_jobs=2),
+     lambda d: funnel.create_funnel_df(d.df, STEPS), _check_same),
+    ('create_funnel_df[sample]', lambda d: funnel.create_funnel_df(d.df, STEPS, sample=SAMPLE),
+     lambda d: reference.create_funnel_df(sample_users(d.df, SAMPLE), STEPS), _check_sample_funnel),
+    ('create_funnel_df[approx]', lambda d: funnel.create_funnel_df(d.df, STEPS, approx=True),
+     lambda d: reference.create_funnel_df(d.df, STEPS), _check_approx_funnel),
+    ('stream_funnel_df', lambda d: stream.stream_funnel_df(d.df, STEPS, memory_limit=MEMORY_LIMIT),
+     lambda d: funnel.create_funnel_df(d.df, STEPS), _check_same),
+    ('FunnelState.update', lambda d: _funnel_state(d.batches),
+     lambda d: funnel.create_funnel_df(d.df, STEPS), _check_same),
+    ('stacking_funnel', lambda d: funnel.stacking_funnel(d.df, STEPS, 'os'),
+     lambda d: reference.stacking_funnel(d.df, STEPS, 'os'), _check_stacking),
+    ('get_user_flow', lambda d: flow.get_user_flow(d.df, STEPS[0], 5, 5),
+     lambda d: reference.get_user_flow(d.df, STEPS[0], 5, 5), _frames_equal),
+    ('stream_user_flow', lambda d: stream.stream_user_flow(d.df, STEPS[0], 5, 5, memory_limit=MEMORY_LIMIT),
+     lambda d: flow.get_user_flow(d.df, STEPS[0], 5, 5), _check_same),
+    ('get_flow_df', lambda d: flow.get_flow_df(d.df, STEPS[0], 5, 5),
+     lambda d: reference.get_flow_df(d.df, STEPS[0], 5, 5), _check_flow_df),
+    ('get_flow_df[EventLog]', lambda d: flow.get_flow_df(d.log, STEPS[0], 5, 5),
+     lambda d: reference.get_flow_df(d.df, STEPS[0], 5, 5), _check_flow_df),
+    ('get_flow_df[n_jobs=2]', lambda d: flow.get_flow_df(d.df, STEPS[0], 5, 5, n_jobs=2),
+     lambda d: flow.get_flow_df(d.df, STEPS[0], 5, 5), _check_same_flow_df),
+    ('get_flow_df[sample]', lambda d: flow.get_flow_df(d.df, STEPS[0], 5, 5, sample=SAMPLE),
+     lambda d: reference.get_flow_df(sample_users(d.df, SAMPLE), STEPS[0], 5, 5), _check_sample_flow_df),
+    ('cohort_retention', lambda d: retention.cohort_retention(d.df, 'W', by_percent=False),
+     lambda d: reference.cohort_retention(d.df, 'W'), _check_retention),
+    ('cohort_retention[approx]', lambda d: retention.cohort_retention(d.df, 'W', by_percent=False, approx=True),
+     lambda d: reference.cohort_retention(d.df, 'W'), _check_approx_retention),
+    ('cohort_sketches', lambda d: retention.cohort_sketches(d.df, 'W'),
+     lambda d: reference.cohort_retention(d.df, 'W'), _check_sketches),
+    ('RetentionState.update', lambda d: _retention_state(d.batches),
+     lambda d: retention.cohort_retention(d.df, 'W', by_percent=False), _check_same),
+    ('rete_prepare', lambda d: retention.rete_prepare(d.export),
+     lambda d: reference.rete_prepare(d.export), _check_export),
+    ('rete_read[csv]', lambda d: retention.rete_read(d.export_csv),
+     lambda d: reference.rete_prepare(pd.read_csv(d.export_csv)), _check_export),
+    ('rete_read[parquet]', lambda d: retention.rete_read(d.export_parquet),
+     lambda d: reference.rete_prepare(pd.read_parquet(d.export_parquet)), _check_export),
+    ('profile', lambda d: portrait.profile(d.df, ['event', 'os']),
+     lambda d: reference.profile(d.df, ['event', 'os']), _check_profile),
+    ('bool_profile', lambda d: portrait.bool_profile(d.df, 'os', d.df['os'].unique(), use_cat_dict=True),
+     lambda d: reference.bool_profile(_profile_codes(d.df), 'os', d.df['os'].unique()), _frames_equal),
+]
+
+def git_commit():
+    """
+    Функция, возвращающая короткий хэш текущего коммита
+    Returns
+    -------
+    commit : str
+        Хэш коммита с суффиксом '-dirty', если есть незакоммиченные изменения, или None вне git.
+    """
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=cwd,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=cwd,
+                                        stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return commit + ('-dirty' if dirty else '')
+
+def measure(func, repeat=3, memory=True):
+    """
+    Функция замера времени и пиковой памяти
+    Parameters
+    ----------
+    func : callable
+        Функция без аргументов\n
+    repeat : int
+        Кол-во замеров времени, в результат идет лучший\n
+    memory : bool
+        Замерить пиковую память отдельным запуском под tracemalloc
+
+    Returns
+    -------
+    result
+        Результат последнего запуска func.\n
+    seconds : float
+        Лучшее время.\n
+    peak_mb : float
+        Пиковый объем памяти, выделенной во время запуска, в МБ. None, если memory=False.
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+
+    peak_mb = None
+    if memory:
+        del result
+        gc.collect()
+        tracemalloc.start()
+        try:
+            result = func()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+
+    return result, min(times), peak_mb
+
+def run(rows, cases=None, repeat=3, memory=True, check_rows=10 ** 5, seed=0):
+    """
+    Функция запуска бенчмарка
+    Parameters
+    ----------
+    rows : list
+        Размеры логов\n
+    cases : list
+        Подстроки названий функций из CASES. None - все функции\n
+    repeat : int
+        Кол-во замеров времени\n
+    memory : bool
+        Замерять пиковую память\n
+    check_rows : int
+        Максимальный размер лога для проверки по эталону\n
+    seed : int
+        Зерно генератора лога
+
+    Returns
+    -------
+    results : list
+        Список словарей с ключами name, rows, seconds, peak_mb, check ('ok', 'skipped' или текст ошибки).
+    """
+    selected = [case for case in CASES if cases is None or any(c in case[0] for c in cases)]
+    results = []
+    for n_rows in rows:
+        df = make_event_log(n_rows, segments={'os': {'ios': 0.4, 'android': 0.5, 'web': 0.1}}, seed=seed)
+        directory = tempfile.mkdtemp(prefix='abo_bench_')
+        try:
+            data = make_data(df, directory)
+            for name, func, ref, check in selected:
+                result, seconds, peak_mb = measure(lambda: func(data), repeat, memory)
+
+                status = 'skipped'
+                if ref is not None and n_rows <= check_rows:
+                    try:
+                        check(result, ref(data))
+                        status = 'ok'
+                    except AssertionError as e:
+                        status = 'fail: {}'.format(str(e).splitlines()[0] if str(e) else 'разные результаты')
+                    except Exception as e:
+                        # Ошибка проверки или эталона (например, разные типы результатов) не должна прерывать бенчмарк
+                        status = 'fail: {}: {}'.format(type(e).__name__, str(e).splitlines()[0] if str(e) else '')
+
+                results.append({'name': name, 'rows': n_rows, 'seconds': seconds, 'peak_mb': peak_mb, 'check': status})
+                print('{:<28} {:>11,} rows {:9.3f}s {:>10} MB  {}'.format(
+                    name, n_rows, seconds, '-' if peak_mb is None else '{:.1f}'.format(peak_mb), status))
+                del result
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return results
+
+def compare(results, baseline):
+    """
+    Функция сравнения с результатами другого коммита
+    Parameters
+    ----------
+    results : list
+        Результаты run\n
+    baseline : dict
+        Содержимое JSON файла результатов
+
+    Returns
+    -------
+    compare_df : pandas.DataFrame
+        Объект pandas df с временем и памятью обоих запусков и их отношением (new / base).
+    """
+    new = pd.DataFrame(results).set_index(['name', 'rows'])
+    base = pd.DataFrame(baseline['results']).set_index(['name', 'rows'])
+    compare_df = new[['seconds', 'peak_mb']].join(base[['seconds', 'peak_mb']], rsuffix='_base', how='inner')
+    compare_df['time_ratio'] = compare_df['seconds'] / compare_df['seconds_base']
+    compare_df['memory_ratio'] = compare_df['peak_mb'] / compare_df['peak_mb_base']
+
+    return compare_df
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[10 ** 5, 10 ** 6])
+    parser.add_argument('--cases', nargs='+', default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true')
+    parser.add_argument('--check-rows', type=int, default=10 ** 5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='JSON файл результатов, по умолчанию bench_results/<коммит>.json')
+    parser.add_argument('--compare', default=None, help='JSON файл результатов другого коммита')
+    args = parser.parse_args()
+
+    results = run(args.rows, args.cases, args.repeat, not args.no_memory, args.check_rows, args.seed)
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource is not None else None,
+        'results': results,
+    }
+
+    output = args.output or os.path.join('bench_results', '{}.json'.format(commit or 'local'))
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Результаты сохранены в {}'.format(output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(results, json.load(f)).round(3).to_string())
+
+    failed = [r for r in results if r['check'].startswith('fail')]
+    if failed:
+        raise SystemExit('Результаты отличаются от эталона: {}'.format(', '.join(r['name'] for r in failed)))
+
+if __name__ == '__main__':
+    main()
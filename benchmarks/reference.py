@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+
+"""
+Эталонные реализации отчетов для проверки результатов бенчмарков.
+Воронка, пути клиентов, профили колонок и подготовка выгрузки удержания - исходный код функций abo_tools до
+оптимизаций (с заменой replace(inplace=True) и set_axis(inplace=True), которые не работают в новых pandas),
+удержание когорт - прямой расчет через groupby.
+Эталоны медленные, поэтому проверка запускается только на небольших логах.
+"""
+
+def create_funnel_df(df, steps):
+    """Эталон reports.funnel.create_funnel_df: последовательные merge соседних шагов."""
+    df = df[df['event'].isin(steps)]
+
+    values = []
+    dfs = {}
+    for i, step in enumerate(steps):
+        if i == 0:
+            dfs[step] = df[df['event'] == step].sort_values(['id', 'event_dt'], ascending=True).drop_duplicates(subset=['id', 'event'], keep='first')
+        else:
+            dfs[step] = df[df['event'] == step]
+            merged = pd.merge(dfs[steps[i - 1]], dfs[step], on='id', how='left')
+            merged = merged[merged['event_dt_y'] >= merged['event_dt_x']].sort_values('event_dt_y', ascending=True)
+            merged = merged.drop_duplicates(subset=['id', 'event_x', 'event_y'], keep='first')
+            merged = merged[['id', 'event_y', 'event_dt_y']].rename({'event_y': 'event', 'event_dt_y':'event_dt'}, axis=1)
+            dfs[step] = merged
+        values.append(len(dfs[step]))
+
+    return pd.DataFrame({'step':steps, 'val':values})
+
+def stacking_funnel(df, steps, col):
+    """Эталон reports.funnel.stacking_funnel: отдельная воронка по клиентам каждой подгруппы."""
+    dict_ = {}
+    ids = dict(df.groupby([col])['id'].apply(set))
+    for entry in df[col].dropna().unique():
+        ids_list = ids[entry]
+        temp_df = df[df['id'].isin(ids_list)].copy()
+        if len(temp_df[temp_df['event'] == steps[0]]) > 0:
+            dict_[entry] = create_funnel_df(temp_df, steps)
+    return dict_
+
+def get_start_step(x, start_step, n_steps):
+    start_step_index = x.index(start_step)
+
+    return x[start_step_index: start_step_index + n_steps]
+
+def get_user_flow(df, start_step, n_steps=5, events_per_step=5):
+    """Эталон reports.flow.get_user_flow: списки событий клиентов и apply(pd.Series)."""
+    events = df.sort_values(['id', 'event_dt'])
+    valid_ids = events[events['event'] == start_step]['id'].unique()
+
+    flow = events[(events['id'].isin(valid_ids))] \
+        .groupby('id') \
+        .event.agg(list) \
+        .to_frame()['event'] \
+        .apply(lambda x: get_start_step(x, start_step=start_step, n_steps=n_steps)) \
+        .to_frame() \
+        ['event'].apply(pd.Series)
+
+    flow = flow.fillna('End')
+    for i, col in enumerate(flow.columns):
+        flow[col] = '{}: '.format(i + 1) + flow[col].astype(str)
+
+    for col in flow.columns:
+        all_events = flow[col].value_counts().index.tolist()
+        all_events = [e for e in all_events if e != (str(col + 1) + ': End')]
+        top_events = all_events[:events_per_step]
+        to_replace = list(set(all_events) - set(top_events))
+        flow[col] = flow[col].replace(to_replace, [str(col + 1) + ': Other'] * len(to_replace))
+
+    flow = flow.groupby(list(range(n_steps))) \
+        .size() \
+        .to_frame() \
+        .rename({0: 'count'}, axis=1) \
+        .reset_index()
+
+    return flow
+
+def get_flow_df(df, start_step, n_steps=5, events_per_step=5):
+    """Эталон reports.flow.get_flow_df: пары source-target через concat и groupby по шагам."""
+    flow = get_user_flow(df, start_step, n_steps, events_per_step)
+
+    label_list = []
+    cat_cols = flow.columns[:-1].values.tolist()
+    for cat_col in cat_cols:
+        label_list_temp = list(set(flow[cat_col].values))
+        label_list = label_list + label_list_temp
+
+    colors_list = ['blue' if i.find('Other') < 0 else 'grey' for i in label_list]
+
+    for i in range(len(cat_cols) - 1):
+        if i == 0:
+            source_target_df = flow[[cat_cols[i], cat_cols[i + 1], 'count']]
+            source_target_df.columns = ['source', 'target', 'count']
+        else:
+            temp_df = flow[[cat_cols[i], cat_cols[i + 1], 'count']]
+            temp_df.columns = ['source', 'target', 'count']
+            source_target_df = pd.concat([source_target_df, temp_df])
+        source_target_df = source_target_df.groupby(['source', 'target']).agg({'count': 'sum'}).reset_index()
+
+    source_target_df['source_id'] = source_target_df['source'].apply(lambda x: label_list.index(x))
+    source_target_df['target_id'] = source_target_df['target'].apply(lambda x: label_list.index(x))
+
+    source_target_df = source_target_df[(~source_target_df['source'].str.contains('End')) &
+                                        (~source_target_df['target'].str.contains('End'))]
+
+    return label_list, colors_list, source_target_df
+
+def cohort_retention(df, period='M'):
+    """Эталон retention.core.cohort_retention(by_percent=False): кол-во уникальных клиентов по (когорта, период)."""
+    df = df.dropna(subset=['id', 'event_dt']).copy()
+    df['period'] = df['event_dt'].dt.to_period({'D': 'D', 'W': 'W-SUN', 'M': 'M'}[period])
+    df['cohort'] = df.groupby('id')['period'].transform('min')
+    df['offset'] = (df['period'] - df['cohort']).apply(lambda x: x.n)
+
+    return df.groupby(['cohort', 'offset'])['id'].nunique().unstack()
+
+def rete_prepare(df, by_percent=True, slice_num=7):
+    """Эталон retention.core.rete_prepare: удаление четных колонок пар и служебной строки."""
+    df = df.copy()
+    m = df.columns.tolist()
+    del(m[1::2])
+    df.drop(m, axis=1, inplace=True)
+    if not by_percent:
+        df.drop(df.columns[[0]], axis='columns', inplace=True)
+    df.drop(df.index[[0]], inplace=True)
+
+    return df.set_axis([element[0:slice_num] for element in df.columns], axis=1)
+
+def profile(df, columns):
+    """Эталон portrait.core.profile(dropna=True): маска на каждое значение колонки, как в исходном bool_type."""
+    frames = []
+    for col in columns:
+        values = df[col].dropna().unique()
+        counts = [df[df[col] == value][col].count() for value in values]
+        total = df[col].count()
+        frames.append(pd.DataFrame({'column': col, 'value': list(values), 'count': counts,
+                                    'percent': np.array(counts) / total * 100}))
+
+    return pd.concat(frames, ignore_index=True)
+
+def bool_profile(df, col, label):
+    """Эталон portrait.core.bool_profile: две маски на каждый код, как в исходном bool_type."""
+    counts = [df[df[col] == i][col].count() for i in range(len(label))]
+    total = df[col].count()
+
+    return pd.DataFrame({'label': list(label), 'count': counts, 'percent': np.array(counts) / total * 100})
@@ -0,0 +1,281 @@
+import numpy as np
+import pandas as pd
+
+"""
+Агрегаты для графиков: гистограммы, KDE и кол-ва значений считаются на NumPy, а в графики передаются только
+агрегаты, поэтому размер графика не зависит от кол-ва строк.
+"""
+
+def is_continuous(values):
+    """
+    Функция проверки, что для значений можно построить гистограмму: числа, логические значения, даты,
+    интервалы времени и категории pandas с числовыми категориями
+    Parameters
+    ----------
+    values : pandas.Series
+        Значения
+
+    Returns
+    -------
+    continuous : bool
+        False для строк и остальных категорий - для них считается кол-во значений (count_values).
+    """
+    dtype = values.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        dtype = dtype.categories.dtype
+    return pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_datetime64_any_dtype(dtype) \
+        or pd.api.types.is_timedelta64_dtype(dtype)
+
+def _finite(values):
+    """
+    Функция, возвращающая значения без пропусков и бесконечностей в виде чисел
+    Даты переводятся в наносекунды, чтобы корзины считались так же, как для чисел, а интервалы времени - в секунды
+    Parameters
+    ----------
+    values : array-like
+        Значения
+
+    Returns
+    -------
+    values : numpy.ndarray
+        Массив float64.\n
+    unit : pandas.DatetimeTZDtype, numpy.dtype, str или None
+        Тип дат для обратного перевода (_restore), 'seconds' - интервалы времени, None - числа.
+    """
+    values = pd.Series(values) if not isinstance(values, pd.Series) else values
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype(values.cat.categories.dtype)
+    if pd.api.types.is_timedelta64_dtype(values.dtype):
+        return values.dropna().dt.total_seconds().values.astype(np.float64), 'seconds'
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return pd.DatetimeIndex(values.dropna()).as_unit('ns').asi8.astype(np.float64), values.dtype
+
+    values = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    return values[np.isfinite(values)], None
+
+def _restore(numbers, unit):
+    """
+    Функция обратного перевода чисел (границ корзин, точек кривой) в даты
+    Parameters
+    ----------
+    numbers : numpy.ndarray
+        Числа.\n
+    unit : pandas.DatetimeTZDtype, numpy.dtype, str или None
+        Тип из _finite
+
+    Returns
+    -------
+    values : numpy.ndarray или pandas.DatetimeIndex
+        Даты для дат, для остальных значений - числа (интервалы времени - в секундах).
+    """
+    if unit is None or unit == 'seconds':
+        return numbers
+    values = pd.DatetimeIndex(np.round(numbers).astype(np.int64).view('datetime64[ns]'))
+    tz = getattr(unit, 'tz', None)
+
+    return values.tz_localize('UTC').tz_convert(tz) if tz is not None else values
+
+def _step(step, unit):
+    # Шаг для дат и интервалов времени задается как pandas.Timedelta или строка, например '1h'
+    if unit is None or isinstance(step, (int, float, np.number)):
+        return step
+    return pd.Timedelta(step).total_seconds() if unit == 'seconds' else float(pd.Timedelta(step).value)
+
+def value_range(values, clip=None):
+    """
+    Функция расчета диапазона значений
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Значения без пропусков.\n
+    clip : tuple
+        Квантили (нижний, верхний) для обрезки диапазона, например (0.001, 0.999). None - от минимума до максимума
+
+    Returns
+    -------
+    value_range : tuple
+        Границы диапазона (low, high).
+    """
+    if not len(values):
+        return 0.0, 1.0
+    if clip is None:
+        low, high = values.min(), values.max()
+    else:
+        low, high = np.quantile(values, clip)
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+
+    return float(low), float(high)
+
+def histogram(values, bins=50, clip=None, bin_size=None, density=False):
+    """
+    Функция расчета гистограммы
+    Parameters
+    ----------
+    values : array-like
+        Значения. Пропуски не учитываются.\n
+    bins : int
+        Кол-во корзин одинаковой ширины\n
+    clip : tuple
+        Квантили (нижний, верхний) для обрезки диапазона. Значения за пределами диапазона не учитываются\n
+    bin_size : float
+        Ширина корзины вместо кол-ва корзин. Для дат - pandas.Timedelta или строка, например '1D'\n
+    density : bool
+        True - плотность (площадь гистограммы равна 1, для дат - на наносекунду), False - кол-во значений
+
+    Returns
+    -------
+    counts : numpy.ndarray
+        Кол-во значений или плотность в каждой корзине.\n
+    edges : numpy.ndarray
+        Границы корзин, на одну больше, чем counts. Для дат - DatetimeIndex, для интервалов времени - секунды.
+    """
+    values, unit = _finite(values)
+    low, high = value_range(values, clip)
+    if bin_size is not None:
+        bin_size = _step(bin_size, unit)
+        bins = max(int(np.ceil((high - low) / bin_size)), 1)
+        high = low + bins * bin_size
+
+    counts, edges = np.histogram(values, bins=bins, range=(low, high), density=density)
+    return counts, _restore(edges, unit)
+
+def kde(values, n_points=256, clip=None, bandwidth=None, grid_size=1024):
+    """
+    Функция расчета гауссовского KDE по сетке корзин
+    Значения один раз раскладываются в grid_size корзин, а ядро применяется к корзинам сверткой,
+    поэтому время расчета почти не зависит от кол-ва значений.
+    Parameters
+    ----------
+    values : array-like
+        Значения. Пропуски не учитываются.\n
+    n_points : int
+        Кол-во точек кривой\n
+    clip : tuple
+        Квантили (нижний, верхний) для обрезки диапазона\n
+    bandwidth : float
+        Ширина ядра. None - правило Скотта: std * n^(-1/5). Для дат - pandas.Timedelta или строка\n
+    grid_size : int
+        Кол-во корзин сетки
+
+    Returns
+    -------
+    x : numpy.ndarray
+        Точки кривой. Для дат - DatetimeIndex, для интервалов времени - секунды.\n
+    density : numpy.ndarray
+        Плотность в точках кривой.
+    """
+    values, unit = _finite(values)
+    low, high = value_range(values, clip)
+    if bandwidth is not None:
+        bandwidth = _step(bandwidth, unit)
+    if bandwidth is None:
+        bandwidth = values.std() * len(values) ** (-0.2) if len(values) > 1 else 0.0
+    if not bandwidth:
+        bandwidth = (high - low) / grid_size
+
+    # Кривую продолжаем на 3 ширины ядра за пределы диапазона, как seaborn
+    low, high = low - 3 * bandwidth, high + 3 * bandwidth
+    counts, edges = np.histogram(values, bins=grid_size, range=(low, high))
+    step = edges[1] - edges[0]
+    centers = edges[:-1] + step / 2
+
+    half = int(np.ceil(4 * bandwidth / step))
+    offsets = np.arange(-half, half + 1) * step
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (bandwidth * np.sqrt(2 * np.pi))
+    density = np.convolve(counts, kernel)[half:half + grid_size] / max(counts.sum(), 1)
+
+    x = np.linspace(low, high, n_points)
+    return _restore(x, unit), np.interp(x, centers, density)
+
+def category_order(values):
+    """
+    Функция порядка категорий, как в seaborn: категории pandas - в их порядке, числа - по возрастанию,
+    остальные значения - в порядке появления
+    Parameters
+    ----------
+    values : pandas.Series
+        Значения
+
+    Returns
+    -------
+    order : list
+        Список категорий без пропусков.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return list(values.cat.categories)
+    order = pd.unique(values.dropna())
+    if pd.api.types.is_numeric_dtype(values):
+        order = np.sort(order)
+
+    return list(order)
+
+def count_values(df, column, hue=None):
+    """
+    Функция расчета кол-ва строк для каждого значения колонки и подгруппы
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Объект pandas df.\n
+    column : str
+        Колонка со значениями\n
+    hue : str
+        Колонка с подгруппами. None - без подгрупп
+
+    Returns
+    -------
+    counts_df : pandas.DataFrame
+        Объект pandas df с колонками column, hue (если задана) и count. Строки без значения или подгруппы не учитываются.
+    """
+    keys = [column] if hue is None else [column, hue]
+    counts = df.groupby(keys, sort=False, observed=True).size()
+
+    return counts.rename('count').reset_index()
+
+def block_mean(values, block):
+    """
+    Функция усреднения матрицы по блокам block x block
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Матрица, пропуски не учитываются.\n
+    block : int
+        Размер блока
+
+    Returns
+    -------
+    means : numpy.ndarray
+        Матрица средних значений блоков. Блок без значений - NaN.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n_rows, n_cols = -(-values.shape[0] // block), -(-values.shape[1] // block)
+    padded = np.full((n_rows * block, n_cols * block), np.nan)
+    padded[:values.shape[0], :values.shape[1]] = values
+    padded = padded.reshape(n_rows, block, n_cols, block)
+
+    valid = ~np.isnan(padded)
+    counts = valid.sum(axis=(1, 3))
+    sums = np.where(valid, padded, 0).sum(axis=(1, 3))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+def block_labels(labels, block):
+    """
+    Функция подписей блоков
+    Parameters
+    ----------
+    labels : array-like
+        Подписи строк или колонок.\n
+    block : int
+        Размер блока
+
+    Returns
+    -------
+    labels : list
+        Подписи блоков вида 'первый..последний'.
+    """
+    labels = list(labels)
+    if block == 1:
+        return labels
+
+    return ['{}..{}'.format(labels[i], labels[min(i + block, len(labels)) - 1]) for i in range(0, len(labels), block)]
@@ -1,21 +1,55 @@
+import importlib
 import numpy as np
 import pandas as pd
-import plotly.offline as py
-import plotly.graph_objs as go
-import plotly.figure_factory as ff
-import matplotlib.pyplot as plt # библиотека для построения простых графиков
-import seaborn as sns # еще одна библиотека для построения более сложных графиков
 from ..reports import funnel as funnel
 from ..reports import flow as flow
+from ..reports.sample import check_fraction
+from . import aggregate as aggregate
 
-def dist_plot(dataframe, column, title=None, kde_color = 'blue', hist_color = 'blue', **kwargs): # ГРАФИК РАСПРЕДЕЛЕНИЯ
+class _LazyModule(object):
+    """
+    Модуль, который импортируется при первом обращении к его атрибуту
+
+    Библиотеки графиков импортируются долго, а matplotlib.pyplot при импорте выбирает backend, поэтому
+    import abo_tools.plot их не загружает: они импортируются при первом построении графика.
+
+    Parameters
+    ----------
+    name : str
+        Полное имя модуля
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+py = _LazyModule('plotly.offline')
+go = _LazyModule('plotly.graph_objs')
+ff = _LazyModule('plotly.figure_factory')
+plt = _LazyModule('matplotlib.pyplot') # библиотека для построения простых графиков
+sns = _LazyModule('seaborn') # еще одна библиотека для построения более сложных графиков
+
+def dist_plot(dataframe, column, title=None, kde_color = 'blue', hist_color = 'blue', bins=50, clip=None, **kwargs): # ГРАФИК РАСПРЕДЕЛЕНИЯ
+    # Гистограмма и KDE считаются на NumPy, в matplotlib передаются только корзины и точки кривой
     plt.figure(figsize=(16,6)) #figure size
     sns.set_style('whitegrid') #background style
-    ax = sns.distplot(
-        dataframe[column], # var
-        kde_kws={'color': '{}'.format(kde_color), 'label': 'Line'}, #kde style
-        hist_kws={'color':'{}'.format(hist_color),'label':'Histogram'} #hist style
-    )
+    ax = plt.gca()
+    if not aggregate.is_continuous(dataframe[column]):
+        # Для строк и категорий - доля каждого значения без кривой
+        counts_df = aggregate.count_values(dataframe, column)
+        ax.bar(counts_df[column].astype(str), counts_df['count'] / counts_df['count'].sum(),
+               color='{}'.format(hist_color), alpha=0.4, label='Histogram') #hist style
+    else:
+        density, edges = aggregate.histogram(dataframe[column], bins=bins, clip=clip, density=True)
+        x, kde = aggregate.kde(dataframe[column], clip=clip)
+        # Столбцы вместо hist: для дат ширина корзины - интервал времени
+        ax.bar(edges[:-1], density, width=np.diff(edges), align='edge', color='{}'.format(hist_color), alpha=0.4,
+               label='Histogram') #hist style
+        ax.plot(x, kde, color='{}'.format(kde_color), label='Line') #kde style
     if title is None:
         plt.title('Distplot of {}'.format(column))
     else:
@@ -25,12 +59,17 @@ def dist_plot(dataframe, column, title=None, kde_color = 'blue', hist_color = 'b
     plt.show()
 
 def count_plot(dataframe, column, title=None, hue_var=None, palette = 'Set3', xtick=None,legend=None, **kwargs): # ГРАФИК КОЛ-ВА ЗНАЧЕНИЙ
+    # Кол-во значений считается одним groupby, в seaborn передается по одной строке на столбец
+    counts_df = aggregate.count_values(dataframe, column, hue_var)
+    order = aggregate.category_order(dataframe[column])
+
     plt.figure(figsize=(16,6)) #figure size
     sns.set_style('whitegrid') #background style
     if hue_var is None: #if hue is set
-        ax = sns.countplot(x = dataframe[column], palette='{}'.format(palette))
+        ax = sns.barplot(x=column, y='count', data=counts_df, order=order, palette='{}'.format(palette))
     else:
-        ax = sns.countplot(x = dataframe[column], palette='{}'.format(palette), hue = dataframe[hue_var])
+        ax = sns.barplot(x=column, y='count', hue=hue_var, data=counts_df, order=order,
+                         hue_order=aggregate.category_order(dataframe[hue_var]), palette='{}'.format(palette))
     
     if title is None:
         plt.title('Countplot of {}'.format(column))
@@ -46,15 +85,34 @@ def count_plot(dataframe, column, title=None, hue_var=None, palette = 'Set3', xt
     plt.show()
 
 def inter_hist_plot(dataframe, x_column = None, y_column = None, xbins_size = None, title = None,
-                    x_title = None, y_title = None, **kwargs):
-    trace0 = go.Histogram(
-        x = dataframe[x_column],
-        xbins = {'size': xbins_size}
-    )
+                    x_title = None, y_title = None, bins=50, clip=None, **kwargs):
+    # В график передаются только корзины: размер figure не зависит от кол-ва строк
+    if not aggregate.is_continuous(dataframe[x_column]):
+        # Строки и категории: кол-во строк каждого значения в порядке появления, как в go.Histogram
+        counts_df = aggregate.count_values(dataframe, x_column)
+        trace0 = go.Bar(x = counts_df[x_column], y = counts_df['count'])
+    else:
+        counts, edges = aggregate.histogram(dataframe[x_column], bins=bins, clip=clip, bin_size=xbins_size)
+        widths = edges[1:] - edges[:-1]
+        centers = edges[:-1] + widths / 2
+        hover = '%{customdata[0]:.4g} - %{customdata[1]:.4g}: %{y}<extra></extra>'
+        if not isinstance(edges, np.ndarray):
+            # Даты: plotly задает ширину столбца в миллисекундах, границы в подсказке - строками
+            widths = np.asarray(widths / pd.Timedelta(milliseconds=1))
+            edges = edges.astype(str)
+            hover = '%{customdata[0]} - %{customdata[1]}: %{y}<extra></extra>'
+        trace0 = go.Bar(
+            x = centers,
+            y = counts,
+            width = widths,
+            customdata = np.column_stack([edges[:-1], edges[1:]]),
+            hovertemplate = hover
+        )
     layout = go.Layout(
         title = title,
         xaxis = {'title': '{}'.format(x_column)},
-        yaxis = {'title': '{}'.format('Count')}
+        yaxis = {'title': '{}'.format('Count')},
+        bargap = 0
     )
 
     data = [trace0]
@@ -62,43 +120,115 @@ def inter_hist_plot(dataframe, x_column = None, y_column = None, xbins_size = No
     fig = go.Figure(data = data, layout = layout)
     py.iplot(fig, show_link = False)
 
-def get_int_heatmap(df, title=''):
-    z = df.values
-    x = df.columns.array
-    y = df.index.array
+def _heatmap_blocks(df, max_size=None, block=None):
+    """
+    Функция подготовки матрицы для heatmap с усреднением по блокам для больших матриц
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Матрица, например результат retention.core.cohort_retention.\n
+    max_size : int
+        Максимальное кол-во строк и колонок графика. Если матрица больше, она усредняется по блокам\n
+    block : int
+        Размер блока вместо max_size. None - по max_size
+
+    Returns
+    -------
+    values : numpy.ndarray
+        Значения ячеек.\n
+    x : list
+        Подписи колонок.\n
+    y : list
+        Подписи строк.
+    """
+    if block is None:
+        block = -(-max(df.shape) // max_size) if max_size and max(df.shape) > max_size else 1
+    if block == 1:
+        return df.values.astype(np.float64), list(df.columns), list(df.index)
+
+    return aggregate.block_mean(df.values, block), aggregate.block_labels(df.columns, block), \
+        aggregate.block_labels(df.index, block)
+
+def _int_heatmap_figure(df, title='', max_size=200, block=None, text_max_cells=2500):
+    """
+    Функция построения интерактивной heatmap одним trace
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Матрица значений.\n
+    title : str
+        Название графика\n
+    max_size : int
+        Максимальное кол-во строк и колонок графика, большие матрицы усредняются по блокам\n
+    block : int
+        Размер блока вместо max_size\n
+    text_max_cells : int
+        Максимальное кол-во ячеек, в которых выводятся значения. Значения всех ячеек доступны при наведении
+
+    Returns
+    -------
+    fig : plotly.graph_objs._figure.Figure
+        Объект Figure библиотеки plotly.
+    """
+    z, x, y = _heatmap_blocks(df, max_size, block)
     colorscale = [[0,'#FFFFFF'],[1, '#F1C40F']]
-    z_text = np.around(z, decimals=2)
-    fig = ff.create_annotated_heatmap(
-        z,
-        x,
-        annotation_text=z_text,
-        colorscale=colorscale, 
-        hoverinfo='z',
+    trace = dict(
+        z=z,
+        x=[str(v) for v in x],
+        y=[str(v) for v in y],
+        colorscale=colorscale,
         showscale=True,
+        hoverongaps=False,
+        hovertemplate='%{y}, %{x}: %{z:.2f}<extra></extra>',
     )
+    # Значения выводятся одним texttemplate на весь trace, а не отдельной аннотацией на каждую ячейку
+    if z.size <= text_max_cells:
+        trace['texttemplate'] = '%{z:.2f}'
+    try:
+        heatmap = go.Heatmap(**trace)
+    except ValueError:
+        # texttemplate у heatmap есть только в plotly >= 5.5, в старых версиях значения доступны при наведении
+        trace.pop('texttemplate', None)
+        heatmap = go.Heatmap(**trace)
 
-    fig.layout.update(
-        go.Layout(
-            title = title,
-        )
+    dtick = 1 if max(z.shape) <= 50 else None
+    layout = go.Layout(
+        title = title,
+        xaxis = dict(ticks='', dtick=dtick, side='top', type='category'),
+        yaxis = dict(ticks='', dtick=dtick, ticksuffix='  ', type='category'),
     )
 
+    return go.Figure(data=[heatmap], layout=layout)
+
+def get_int_heatmap(df, title='', max_size=200, block=None, text_max_cells=2500):
+    fig = _int_heatmap_figure(df, title, max_size, block, text_max_cells)
     py.iplot(fig, show_link=False)
 
-def get_static_heatmap(df, title='', cbar_title='', **kwargs):
+def get_static_heatmap(df, title='', cbar_title='', vmin=None, vmax=None, annot=None, max_size=100, block=None, **kwargs):
+    # Большие матрицы усредняются по блокам, границы цветовой шкалы по умолчанию - по данным
+    values, x, y = _heatmap_blocks(df, max_size, block)
+    frame = pd.DataFrame(values, index=y, columns=x)
+    has_values = np.isfinite(values).any()
+    if vmin is None and has_values:
+        vmin = np.nanmin(values)
+    if vmax is None and has_values:
+        vmax = np.nanmax(values)
+    if annot is None:
+        annot = values.size <= 900
+
     plt.figure(figsize=(16,6))
     sns.set_style('whitegrid')
     sns.set(font_scale=1.0)
     plt.title('Heatmap of {}'.format(title))
     ax = sns.heatmap(
-        df, 
-        annot=True, 
-        vmin=35, 
-        vmax=100, 
+        frame, 
+        annot=annot, 
+        vmin=vmin, 
+        vmax=vmax, 
         fmt=".0f", 
         cbar_kws={'label': cbar_title},
     )
-    ax.set_ylim(12.0, 0.0)
+    ax.set_ylim(len(frame), 0)
     plt.show()
 
 def pie_plot(df, column, labels=None, clr=None):
@@ -106,10 +236,10 @@ def pie_plot(df, column, labels=None, clr=None):
     if len(colors) > 2:
         colors = clr
         
-    if labels is None:
-        labels = df[column].unique()
-
+    # Кол-во значений считается один раз, подписи по умолчанию - в порядке долей
     explode = df[column].value_counts()
+    if labels is None:
+        labels = explode.index
     
     const = 0.05
     l = []
@@ -146,7 +276,7 @@ def bar_plot(x, y, title=None, palette = 'Set3', xtick=None,legend=None, **kwarg
         ax.legend(handles, legend)
     plt.show()
 
-def funnel_plot(df, steps, col=None):
+def funnel_plot(df, steps, col=None, sample=None, cache=None):
     """
     Функция для построения воронки с помощью plotly
     Parameters
@@ -157,21 +287,30 @@ def funnel_plot(df, steps, col=None):
         Список исследуемых событий. Список необходимо формировать в порядке воронки, от стартового события, до завершающего.
     col : str
         Фича, по которой будет разделение воронки. Например - OS, воронка будет разделена на iOS и Android.
+    sample : float
+        Доля клиентов для быстрого расчета, например 0.05. Значения пересчитываются на всех клиентов,
+        95% доверительный интервал показывается при наведении. None - все клиенты
+    cache : ResultCache
+        Кэш расчета воронки, как в create_funnel_df
     
     Returns
     -------
     fig : plotly.graph_objs._figure.Figure
         В качестве вывода будет объект Figure библиотеки plotly
     """
+    if sample is not None:
+        check_fraction(sample)
     data = []
 
     if col:
-        dict_ = funnel.stacking_funnel(df, steps, col)
+        dict_ = funnel.stacking_funnel(df, steps, col, sample=sample, cache=cache)
         title = 'Воронка заявки в разрезе {}'.format(col)
     else:
-        funnel_df = funnel.create_funnel_df(df, steps)
+        funnel_df = funnel.create_funnel_df(df, steps, sample=sample, cache=cache)
         dict_ = {'Total': funnel_df}
         title = 'Воронка заявки'
+    if sample is not None:
+        title = '{} (выборка {:g}% клиентов)'.format(title, sample * 100)
 
     for t in dict_.keys():
         trace = go.Funnel(
@@ -180,6 +319,9 @@ def funnel_plot(df, steps, col=None):
             x=dict_[t].val.values,
             textinfo='value+percent previous'
         )
+        if sample is not None:
+            trace.customdata = dict_[t][['val_low', 'val_high']].values
+            trace.hovertemplate = '%{y}: ~%{x}<br>95% ДИ: %{customdata[0]} - %{customdata[1]}<extra>' + str(t) + '</extra>'
         data.append(trace)
     
     layout = go.Layout(margin={"l": 180, "r": 0, "t": 30, "b": 0, "pad": 0},
@@ -197,7 +339,7 @@ def funnel_plot(df, steps, col=None):
     fig = go.Figure(data, layout)
     return fig
 
-def user_flow_plot(df, start_step, n_steps=5, events_per_step=5, title='User Flow'):
+def user_flow_plot(df, start_step, n_steps=5, events_per_step=5, title='User Flow', sample=None, cache=None):
     """
     Функция для посроения графика путей клиентов по событиям
     Parameters
@@ -211,15 +353,22 @@ def user_flow_plot(df, start_step, n_steps=5, events_per_step=5, title='User Flo
     events_per_step : int
         Кол-во событий, показываемых на каждом из шагов. Минимально - должно быть не менее 5 событий\n
     title : str
-        Название диаграммы    
+        Название диаграммы\n
+    sample : float
+        Доля клиентов для быстрого расчета. Значения пересчитываются на всех клиентов,
+        95% доверительный интервал показывается при наведении. None - все клиенты\n
+    cache : ResultCache
+        Кэш расчета путей, как в get_flow_df
     
     Returns
     -------
     fig : plotly.graph_objs._figure.Figure
         В качестве вывода будет объект Figure библиотеки plotly
     """
+    if sample is not None:
+        check_fraction(sample)
     # transform raw events dataframe into  source:target pairs including node ids and count of each combination
-    label_list, colors_list, source_target_df = flow.get_flow_df(df, start_step, n_steps, events_per_step)
+    label_list, colors_list, source_target_df = flow.get_flow_df(df, start_step, n_steps, events_per_step, sample=sample, cache=cache)
 
     # creating the sankey diagram
     data = dict(
@@ -242,6 +391,11 @@ def user_flow_plot(df, start_step, n_steps=5, events_per_step=5, title='User Flo
                 bgcolor='#C2C4C7')
         )
     )
+    if sample is not None:
+        data['link']['customdata'] = source_target_df[['count_low', 'count_high']].values.tolist()
+        data['link']['hovertemplate'] = '%{source.label} → %{target.label}: ~%{value}' \
+                                        '<br>95% ДИ: %{customdata[0]} - %{customdata[1]}<extra></extra>'
+        title = '{} (выборка {:g}% клиентов)'.format(title, sample * 100)
 
     # set window width
     if n_steps < 5:
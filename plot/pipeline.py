@@ -0,0 +1,276 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from . import aggregate as aggregate
+from . import core as core
+from .. import reports as reports
+from ..reports.parallel import get_n_jobs
+from ..utils.fingerprint import frame_fingerprint, code_fingerprint, package_fingerprint
+
+"""
+Пакетная отрисовка отчетов в файлы.
+Список графиков задается декларативно, графики рисуются в пуле процессов в статические HTML/PNG файлы, а готовые
+файлы хранятся в кэше по отпечатку данных, параметров и кода: если они не изменились, график не
+перерисовывается. Папка с результатом передается в send_email как есть: send_email(recipients, subj, [directory], html).
+"""
+
+# Графики plotly: функция возвращает фигуру, формат по умолчанию - html
+PLOTLY = {
+    'funnel_plot': core.funnel_plot,
+    'user_flow_plot': core.user_flow_plot,
+    'get_int_heatmap': core._int_heatmap_figure,
+}
+
+# Графики matplotlib: функция рисует текущую фигуру, формат по умолчанию - png
+MATPLOTLIB = {
+    'get_static_heatmap': core.get_static_heatmap,
+    'dist_plot': core.dist_plot,
+    'count_plot': core.count_plot,
+    'pie_plot': core.pie_plot,
+}
+
+class PlotJob(object):
+    """
+    Описание одного графика отчета
+
+    Parameters
+    ----------
+    name : str
+        Имя файла без расширения\n
+    plot : str или callable
+        Название функции из abo_tools.plot (funnel_plot, user_flow_plot, get_int_heatmap, get_static_heatmap,
+        dist_plot, count_plot, pie_plot) или функция df, **params -> фигура plotly или matplotlib.
+        Функция входит в отпечаток графика своим кодом, поэтому после ее изменения график перерисовывается.
+        Для отрисовки в процессах функция должна быть объявлена на уровне модуля\n
+    data : pandas.DataFrame или EventLog
+        Данные графика, передаются первым аргументом\n
+    params : dict
+        Остальные аргументы функции\n
+    fmt : str
+        Формат файла: 'html' или 'png'. None - html для plotly, png для matplotlib. Для функции формат
+        определяется по фигуре при отрисовке. png для plotly требует пакет kaleido
+    """
+    def __init__(self, name, plot, data=None, params=None, fmt=None):
+        self.name = name
+        self.plot = plot
+        self.data = data
+        self.params = dict(params or {})
+        if fmt is None and not callable(plot):
+            fmt = 'png' if plot in MATPLOTLIB else 'html'
+        if fmt not in ('html', 'png', None):
+            raise ValueError('Неизвестный формат {}'.format(fmt))
+        self.fmt = fmt
+
+    @property
+    def filename(self):
+        """Имя файла графика. None, если формат определяется при отрисовке."""
+        return '{}.{}'.format(self.name, self.fmt) if self.fmt is not None else None
+
+    def fingerprint(self, data_fingerprint=None):
+        """
+        Функция расчета отпечатка графика
+        Parameters
+        ----------
+        data_fingerprint : str
+            Готовый отпечаток данных. None - считается по data
+
+        Returns
+        -------
+        fingerprint : str
+            Отпечаток данных, функции, параметров и формата.
+        """
+        if data_fingerprint is None:
+            data_fingerprint = frame_fingerprint(self.data)
+        plot = PLOTLY.get(self.plot, MATPLOTLIB.get(self.plot, self.plot)) if isinstance(self.plot, str) else self.plot
+        if isinstance(plot, str):
+            raise ValueError('Неизвестный график {}'.format(plot))
+
+        # Код графиков и отчетов входит в отпечаток: после изменения функции графика или расчета отчета,
+        # который она вызывает, график перерисовывается
+        return frame_fingerprint(None, data_fingerprint, code_fingerprint(plot),
+                                 package_fingerprint(core, aggregate, reports),
+                                 sorted(self.params.items()), self.fmt)
+
+def _as_job(job):
+    return job if isinstance(job, PlotJob) else PlotJob(**job)
+
+def _figure(plot, data, params):
+    """
+    Функция построения фигуры
+    Returns
+    -------
+    fig : plotly.graph_objs.Figure, dict или matplotlib.figure.Figure
+        Фигура графика.
+    """
+    if plot in PLOTLY:
+        return PLOTLY[plot](data, **params)
+    if plot not in MATPLOTLIB and not callable(plot):
+        raise ValueError('Неизвестный график {}'.format(plot))
+
+    # Функции matplotlib вызывают plt.show(), который в Jupyter закрывает фигуру: на время вызова он отключается
+    func = MATPLOTLIB.get(plot, plot)
+    pyplot = core.plt
+    show = pyplot.show
+    pyplot._module.show = lambda *args, **kwargs: None
+    try:
+        fig = func(data, **params)
+    finally:
+        pyplot._module.show = show
+
+    return fig if fig is not None else pyplot.gcf()
+
+def _render(plot, data, params, fmt, base, include_plotlyjs):
+    """
+    Функция отрисовки графика в файл base.fmt. Файл сначала пишется во временный, поэтому прерванная отрисовка
+    не оставляет в кэше неполных файлов
+
+    Returns
+    -------
+    seconds : float
+        Время отрисовки.\n
+    fmt : str
+        Формат файла. Если fmt не задан - png для фигуры matplotlib, html для plotly.
+    """
+    start = time.perf_counter()
+    fig = _figure(plot, data, params)
+    if fmt is None:
+        fmt = 'png' if hasattr(fig, 'savefig') else 'html'
+    path = '{}.{}'.format(base, fmt)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        if hasattr(fig, 'savefig'):
+            fig.savefig(tmp, format=fmt, bbox_inches='tight')
+            core.plt.close(fig)
+        else:
+            import plotly.io as pio
+            fig = core.go.Figure(fig)
+            if fmt == 'html':
+                pio.write_html(fig, tmp, include_plotlyjs=include_plotlyjs, full_html=True)
+            else:
+                pio.write_image(fig, tmp, format=fmt)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    return time.perf_counter() - start, fmt
+
+def _cached_format(cache_dir, fingerprint, fmt):
+    # Формат файла графика в кэше или None, если графика в кэше нет
+    for f in ((fmt,) if fmt is not None else ('png', 'html')):
+        if os.path.exists(os.path.join(cache_dir, '{}.{}'.format(fingerprint, f))):
+            return f
+    return None
+
+def _manifest_path(cache_dir, directory):
+    # Список файлов, которые render_report записал в папку отчета, хранится в кэше, а не в папке отчета,
+    # чтобы не попасть во вложения send_email
+    key = hashlib.sha1(os.path.abspath(directory).encode()).hexdigest()
+    return os.path.join(cache_dir, 'manifest_{}.json'.format(key))
+
+def _publish(cached, path):
+    # Файл отчета - жесткая ссылка на файл кэша, если это невозможно - копия
+    if os.path.exists(path):
+        os.remove(path)
+    try:
+        os.link(cached, path)
+    except OSError:
+        shutil.copyfile(cached, path)
+
+def render_report(jobs, directory, cache_dir=None, n_jobs=1, include_plotlyjs='cdn', clean=True):
+    """
+    Функция отрисовки списка графиков в папку
+    Parameters
+    ----------
+    jobs : list
+        Список PlotJob или словарей с аргументами PlotJob, например
+        {'name': 'funnel', 'plot': 'funnel_plot', 'data': df, 'params': {'steps': steps}}\n
+    directory : str
+        Папка отчета. Если в ней нет других файлов, ее можно передать в send_email как есть\n
+    cache_dir : str
+        Папка кэша, файлы в ней называются по отпечатку графика. None - папка .report_cache рядом с папкой отчета\n
+    n_jobs : int
+        Кол-во процессов отрисовки. Отрицательное значение - все ядра, кроме (|n_jobs| - 1)\n
+    include_plotlyjs : bool или str
+        Как подключать plotly.js в html: 'cdn' - ссылкой (файл ~10 КБ, нужен интернет), True - внутрь файла (~3.5 МБ)\n
+    clean : bool
+        True - удалить из папки отчета графики предыдущих запусков render_report, которых нет в списке графиков.
+        Остальные файлы папки не удаляются
+
+    Returns
+    -------
+    report_df : pandas.DataFrame
+        Объект pandas df с колонками name, path, fingerprint, cached (файл взят из кэша) и seconds (время отрисовки).
+    """
+    jobs = [_as_job(job) for job in jobs]
+    # Формат графиков-функций известен только после отрисовки, поэтому их имя не должно совпадать с именами
+    # других графиков в любом формате
+    names = [job.filename for job in jobs if job.fmt is not None]
+    unresolved = [job.name for job in jobs if job.fmt is None]
+    if len(set(names)) != len(names) or len(set(unresolved)) != len(unresolved) \
+            or set(unresolved) & {job.name for job in jobs if job.fmt is not None}:
+        raise ValueError('Имена файлов графиков должны быть уникальны')
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(directory)), '.report_cache')
+    os.makedirs(directory, exist_ok=True)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Отпечаток одних и тех же данных считается один раз
+    data_fingerprints = {}
+    fingerprints = []
+    for job in jobs:
+        if id(job.data) not in data_fingerprints:
+            data_fingerprints[id(job.data)] = frame_fingerprint(job.data)
+        fingerprints.append(job.fingerprint(data_fingerprints[id(job.data)]))
+
+    formats = [_cached_format(cache_dir, fp, job.fmt) for job, fp in zip(jobs, fingerprints)]
+    cached = [fmt is not None for fmt in formats]
+    todo = [i for i in range(len(jobs)) if not cached[i]]
+    seconds = [0.0] * len(jobs)
+
+    # Одинаковые графики в списке рисуются один раз
+    unique = {}
+    for i in todo:
+        unique.setdefault(fingerprints[i], i)
+
+    def args(i):
+        job = jobs[i]
+        return job.plot, job.data, job.params, job.fmt, os.path.join(cache_dir, fingerprints[i]), include_plotlyjs
+
+    n_jobs = min(get_n_jobs(n_jobs), max(len(unique), 1))
+    if n_jobs == 1:
+        for i in unique.values():
+            seconds[i], formats[i] = _render(*args(i))
+    else:
+        with ProcessPoolExecutor(n_jobs) as executor:
+            futures = {i: executor.submit(_render, *args(i)) for i in unique.values()}
+            for i, future in futures.items():
+                seconds[i], formats[i] = future.result()
+    for i in todo:
+        formats[i] = formats[unique[fingerprints[i]]]
+
+    rows = []
+    files = []
+    for job, fp, fmt, from_cache, sec in zip(jobs, fingerprints, formats, cached, seconds):
+        files.append('{}.{}'.format(job.name, fmt))
+        path = os.path.join(directory, files[-1])
+        _publish(os.path.join(cache_dir, '{}.{}'.format(fp, fmt)), path)
+        rows.append({'name': job.name, 'path': path, 'fingerprint': fp, 'cached': from_cache, 'seconds': sec})
+
+    # Удаляются только файлы, которые записал предыдущий запуск в эту папку
+    manifest = _manifest_path(cache_dir, directory)
+    if clean and os.path.exists(manifest):
+        with open(manifest) as f:
+            previous = json.load(f)
+        for file in set(previous) - set(files):
+            path = os.path.join(directory, file)
+            if os.path.isfile(path):
+                os.remove(path)
+    with open(manifest, 'w') as f:
+        json.dump(files, f)
+
+    return pd.DataFrame(rows, columns=['name', 'path', 'fingerprint', 'cached', 'seconds'])
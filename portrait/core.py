@@ -1,31 +1,94 @@
 import numpy as np
 import pandas as pd
-import plotly.offline as py
-import plotly.graph_objs as go
-import plotly.figure_factory as ff
-import matplotlib.pyplot as plt
-import seaborn as sns
 from ..utils import utils_core as utils
-from ..plot import core as plot
 
-def bool_type(df, col, label=None, use_drop=False, use_cat_dict=False, use_outlier=False, use_nan_dict=False, *args, **kwargs):
+def profile(df, columns=None, dropna=True, top=None):
+    """
+    Функция расчета распределения значений для нескольких колонок за один проход по каждой колонке
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Объект pandas df. Не изменяется.\n
+    columns : list
+        Список колонок. None - все колонки\n
+    dropna : bool
+        True - пропуски не считаются и не входят в знаменатель процента, False - пропуски выводятся отдельным значением\n
+    top : int
+        Кол-во самых частых значений каждой колонки. None - все значения
+
+    Returns
+    -------
+    profile_df : pandas.DataFrame
+        Объект pandas df с колонками column, value, count, percent. Значения каждой колонки отсортированы по убыванию count.
+    """
+    frames = []
+    for col in (df.columns if columns is None else columns):
+        # value_counts - один проход по колонке, для категорий - подсчет по кодам
+        counts = df[col].value_counts(dropna=dropna)
+        total = counts.sum()
+        if top is not None:
+            counts = counts.iloc[:top]
+        frames.append(pd.DataFrame({'column': col, 'value': counts.index.astype(object), 'count': counts.values,
+                                    'percent': counts.values / total * 100 if total else np.zeros(len(counts))}))
+
+    if not frames:
+        return pd.DataFrame(columns=['column', 'value', 'count', 'percent'])
+
+    return pd.concat(frames, ignore_index=True)
+
+def bool_profile(df, col, label=None, use_drop=False, use_cat_dict=False, use_outlier=False, use_nan_dict=False):
+    """
+    Функция расчета доли каждого кода колонки, результат bool_type в виде pandas df
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Объект pandas df. Не изменяется: преобразования применяются к копии колонки.\n
+    col : str
+        Название колонки с кодами 0, 1, ... (или значениями, которые переводятся в коды через use_cat_dict, use_nan_dict)\n
+    label : list
+        Названия кодов: label[i] - название кода i. None - уникальные значения колонки\n
+    use_drop : bool
+        Не учитывать строки с пропусками в col\n
+    use_cat_dict : bool
+        Перевести значения в коды через utils.categoriсal_dict\n
+    use_outlier : bool
+        Убрать выбросы через utils.remove_outlier\n
+    use_nan_dict : bool
+        Перевести значения в 0 (пропуск) и 1 (заполнено) через utils.nan_flag
+
+    Returns
+    -------
+    profile_df : pandas.DataFrame
+        Объект pandas df с колонками label, count, percent. percent - доля от заполненных значений col.
+    """
+    # Копируется только одна колонка, исходный df не меняется
+    frame = df[[col]].copy()
     if use_drop:
-        df.dropna(subset=[col], inplace=True)
+        frame = frame.dropna(subset=[col])
 
     if use_cat_dict:
-        utils.categoriсal_dict(df, col)
+        utils.categoriсal_dict(frame, col)
 
-    if label is not None:
-        label = label
-    else:
-        label = df[col].unique()
+    if label is None:
+        label = frame[col].unique()
 
     if use_outlier:
-        utils.remove_outlier(df, col)
+        utils.remove_outlier(frame, col)
 
     if use_nan_dict:
-        df[col] = df[col].map(utils.nan_dict)
+        utils.nan_flag(frame, col)
+
+    values = frame[col]
+    if values.dtype == bool:
+        values = values.astype(np.int8)
+    # Один подсчет всех значений вместо двух масок на каждый код
+    counts = values.value_counts().reindex(range(len(label)), fill_value=0).values
+    total = values.count()
+
+    return pd.DataFrame({'label': list(label), 'count': counts, 'percent': counts / total * 100 if total else np.nan})
+
+def bool_type(df, col, label=None, use_drop=False, use_cat_dict=False, use_outlier=False, use_nan_dict=False, *args, **kwargs):
+    profile_df = bool_profile(df, col, label, use_drop, use_cat_dict, use_outlier, use_nan_dict)
 
-    for i in range(len(label)):
-        print('{name} - {count}, {percent: .2f}%'.format(name=label[i], count=df[df[col] == i][col].count(),
-            percent=(df[df[col] == i][col].count()/df[col].count())*100))
\ No newline at end of file
+    for name, count, percent in profile_df.itertuples(index=False):
+        print('{name} - {count}, {percent: .2f}%'.format(name=name, count=count, percent=percent))
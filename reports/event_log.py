@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+
+def _code_dtype(n):
+    """
+    Функция выбора наименьшего целочисленного типа для кодов от -1 до n
+    Parameters
+    ----------
+    n : int
+        Максимальный код
+
+    Returns
+    -------
+    dtype : numpy.dtype
+        Тип int16, int32 или int64.
+    """
+    for dtype in (np.int16, np.int32):
+        if n < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+class EventLog(object):
+    """
+    Компактный лог событий, отсортированный один раз по (id, event_dt)
+
+    id, event и event_dt хранятся целочисленными кодами. Клиенты без id получают последний код (len(ids)),
+    события без названия - код -1, события без времени - код len(times) и оказываются в конце пути клиента,
+    как при df.sort_values(['id', 'event_dt']).
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Объект pandas df с колонками id, event, event_dt.\n
+    columns : list
+        Дополнительные колонки (например, OS), которые нужно сохранить кодами. Используются в stacking_funnel
+
+    Attributes
+    ----------
+    users : numpy.ndarray
+        Коды клиентов, отсортированные по возрастанию. Порядок кодов совпадает с порядком id.\n
+    events : numpy.ndarray
+        Коды событий, позиция в names.\n
+    ts : numpy.ndarray
+        Коды времени события - плотный ранг, позиция в times.\n
+    ids : pandas.Index
+        Уникальные id клиентов по возрастанию.\n
+    names : pandas.Index
+        Уникальные названия событий.\n
+    times : numpy.ndarray
+        Уникальные значения event_dt по возрастанию.\n
+    offsets : numpy.ndarray
+        Границы блока событий каждого клиента: события клиента u - строки offsets[u]:offsets[u + 1].\n
+    columns : dict
+        Коды дополнительных колонок и их уникальные значения в порядке появления в df.
+    """
+    def __init__(self, df, columns=None):
+        users, self.ids = pd.factorize(df['id'], sort=True)
+        # Клиенты без id объединяются в одного клиента с последним кодом
+        users[users < 0] = len(self.ids)
+
+        events, self.names = pd.factorize(df['event'])
+        self.names = pd.Index(self.names)
+
+        event_dt = df['event_dt']
+        valid = event_dt.notna().values
+        self.times, ts_valid = np.unique(event_dt.values[valid], return_inverse=True)
+        ts = np.full(len(df), len(self.times), dtype=_code_dtype(len(self.times)))
+        ts[valid] = ts_valid.ravel()
+
+        # Единственная сортировка лога, она стабильна - одновременные события сохраняют исходный порядок
+        order = np.lexsort((ts, users))
+        self.users = users[order].astype(_code_dtype(len(self.ids) + 1))
+        self.events = events[order].astype(_code_dtype(len(self.names)))
+        self.ts = ts[order]
+
+        self.columns = {}
+        for col in columns or []:
+            codes, uniques = pd.factorize(df[col])
+            self.columns[col] = (codes[order].astype(_code_dtype(len(uniques))), uniques)
+
+        self.offsets = np.searchsorted(self.users, np.arange(len(self.ids) + 2))
+
+    def __len__(self):
+        return len(self.users)
+
+    @property
+    def n_users(self):
+        """Кол-во клиентов, включая клиента без id."""
+        return len(self.offsets) - 1
+
+    @property
+    def valid(self):
+        """Маска событий с заполненным event_dt."""
+        return self.ts < len(self.times)
+
+    def select(self, events):
+        """
+        Функция фильтрации лога по списку событий. Коды клиентов, событий и времени не меняются
+        Parameters
+        ----------
+        events : list
+            Список событий, которые нужно оставить
+
+        Returns
+        -------
+        log : EventLog
+            Новый объект EventLog.
+        """
+        codes = self.names.get_indexer(pd.Index(list(events)).unique())
+
+        return self.take(np.isin(self.events, codes[codes >= 0]))
+
+    def take(self, mask):
+        """
+        Функция фильтрации строк лога по маске. Коды клиентов, событий и времени не меняются
+        Parameters
+        ----------
+        mask : numpy.ndarray
+            Булева маска строк лога
+
+        Returns
+        -------
+        log : EventLog
+            Новый объект EventLog.
+        """
+        log = object.__new__(EventLog)
+        log.ids, log.names, log.times = self.ids, self.names, self.times
+        log.users, log.events, log.ts = self.users[mask], self.events[mask], self.ts[mask]
+        log.columns = {col: (codes[mask], uniques) for col, (codes, uniques) in self.columns.items()}
+        log.offsets = np.searchsorted(log.users, np.arange(len(log.ids) + 2))
+
+        return log
+
+    def to_frame(self):
+        """
+        Функция обратного преобразования лога в pandas df
+        Returns
+        -------
+        df : pandas.DataFrame
+            Объект pandas df с колонками id, event, event_dt, отсортированный по (id, event_dt).
+        """
+        def decode(codes, uniques):
+            return pd.Series(uniques).reindex(codes).values
+
+        df = pd.DataFrame({
+            'id': decode(self.users, self.ids),
+            'event': decode(self.events, self.names),
+            'event_dt': decode(self.ts, self.times),
+        })
+        for col, (codes, uniques) in self.columns.items():
+            df[col] = decode(codes, uniques)
+
+        return df
+
+    def memory_usage(self):
+        """
+        Функция подсчета памяти, занимаемой кодами лога
+        Returns
+        -------
+        nbytes : int
+            Кол-во байт.
+        """
+        arrays = [self.users, self.events, self.ts, self.offsets] + [codes for codes, _ in self.columns.values()]
+        return sum(a.nbytes for a in arrays)
+
+def as_event_log(data, columns=None):
+    """
+    Функция, возвращающая EventLog для pandas df или сам EventLog
+    Parameters
+    ----------
+    data : pandas.DataFrame или EventLog
+        Лог событий.\n
+    columns : list
+        Дополнительные колонки, которые нужно сохранить при преобразовании pandas df
+
+    Returns
+    -------
+    log : EventLog
+        Объект EventLog.
+    """
+    if isinstance(data, EventLog):
+        return data
+
+    return EventLog(data, columns)
@@ -1,5 +1,13 @@
 import pandas as pd
 import numpy as np
+from .event_log import as_event_log
+from . import parallel as parallel
+from .sample import check_fraction, sample_users, scale_counts
+from ..utils import instrument
+
+# Служебные коды узлов: конец пути и объединенные редкие события
+END = -1
+OTHER = -2
 
 def get_start_step(x, start_step, n_steps):
     """
@@ -22,76 +30,404 @@ def get_start_step(x, start_step, n_steps):
 
     return x[start_step_index: start_step_index + n_steps]
 
-def get_user_flow(df, start_step, n_steps=5, events_per_step=5):
+@instrument.traced('get_user_flow')
+def get_user_flow(df, start_step, n_steps=5, events_per_step=5, n_jobs=1):
     """
     Функция возвращающая уникальную последовательность событий для каждого из клиентов
     Parameters
     ----------
-    df : pandas.DataFrame
-        Объект pandas df.\n
+    df : pandas.DataFrame или EventLog
+        Объект pandas df или EventLog.\n
     start_step : str
         Название события, с которого начинается путь клиента\n
     n_steps : int
         Кол-во возвращаемых событий\n
     events_per_step : int
-        Кол-во событий, показываемых на каждом из шагов. Минимально - должно быть не менее 5 событий
+        Кол-во событий, показываемых на каждом из шагов. Минимально - должно быть не менее 5 событий\n
+    n_jobs : int
+        Кол-во процессов. -1 - все ядра. Результат не зависит от кол-ва процессов
     
     Returns
     -------
     flow : pandas.DataFrame
         Объект pandas df.\n
     """
-    events = df.sort_values(['id', 'event_dt'])
-    # find the users that have performed the starting_step
-    valid_ids = events[events['event'] == start_step]['id'].unique()
+    flow, labels = _coded_flow(df, start_step, n_steps, events_per_step, n_jobs)
+
+    # labels are materialized only for the counted journeys
+    with instrument.span('flow.labels', rows_in=len(flow)) as span:
+        flow = _label_paths(flow, labels)
+        span.rows_out = len(flow)
+
+    return flow
+
+def _coded_flow(df, start_step, n_steps, events_per_step, n_jobs=1):
+    """
+    Функция подсчета путей клиентов в рангах узлов
+    Parameters
+    ----------
+    df : pandas.DataFrame или EventLog
+        Объект pandas df или EventLog.\n
+    start_step : str
+        Название события, с которого начинается путь клиента\n
+    n_steps : int
+        Кол-во возвращаемых событий\n
+    events_per_step : int
+        Кол-во событий, показываемых на каждом из шагов\n
+    n_jobs : int
+        Кол-во процессов
+
+    Returns
+    -------
+    flow : pandas.DataFrame
+        Объект pandas df с рангами узлов в колонках шагов и колонкой count.\n
+    labels : list
+        Для каждого шага - отсортированный массив подписей узлов.
+    """
+    n_jobs = parallel.get_n_jobs(n_jobs)
+    # plan out the journey per user, with each step in a separate column of event codes
+    with instrument.span('flow.paths', rows_in=instrument.rows(df), n_jobs=n_jobs) as span:
+        if n_jobs > 1:
+            paths, names, weights, first = _parallel_paths(df, start_step, n_steps, n_jobs)
+        else:
+            paths, names = _user_paths(df, start_step, n_steps)
+            weights = first = None
+        span.rows_out = len(paths)
+
+    # replace events not in the top "events_per_step" most frequent list with the "Other" code
+    with instrument.span('flow.replace_rare', rows_in=len(paths)) as span:
+        paths = _replace_rare(paths, events_per_step, weights, first)
+        span.rows_out = len(paths)
+
+    # count the number of identical journeys up the max step defined
+    with instrument.span('flow.count', rows_in=len(paths)) as span:
+        ranks, labels = _rank_labels(paths, names)
+        flow = _count_paths(ranks, weights)
+        span.rows_out = len(flow)
+
+    return flow, labels
+
+def _encode_special(paths, names):
+    """
+    Функция замены кодов событий "End" и "Other" на служебные коды END и OTHER
+    Parameters
+    ----------
+    paths : numpy.ndarray
+        Матрица кодов событий (клиент x шаг), END - нет события.\n
+    names : numpy.ndarray
+        Названия событий, позиция соответствует коду
+
+    Returns
+    -------
+    paths : numpy.ndarray
+        Матрица кодов событий.
+    """
+    names = np.asarray(names, dtype=object)
+    lookup = np.arange(len(names))
+    lookup[names == 'End'] = END
+    lookup[names == 'Other'] = OTHER
+
+    return np.where(paths >= 0, lookup[np.maximum(paths, 0)] if len(names) else paths, paths)
+
+def _user_paths(df, start_step, n_steps):
+    """
+    Функция, возвращающая путь каждого клиента от start_step в виде матрицы кодов событий
+    Parameters
+    ----------
+    df : pandas.DataFrame или EventLog
+        Объект pandas df или EventLog.\n
+    start_step : str
+        Название события, с которого начинается путь клиента\n
+    n_steps : int
+        Кол-во возвращаемых событий
+
+    Returns
+    -------
+    paths : numpy.ndarray
+        Матрица кодов событий (клиент x шаг). Клиенты упорядочены по id, END - нет события.\n
+    names : numpy.ndarray
+        Названия событий, позиция соответствует коду.
+    """
+    log = as_event_log(df)
+    # users without id are not part of any journey
+    n_events = log.offsets[len(log.ids)]
+    start_code = log.names.get_indexer([start_step])[0]
+    paths, _ = _path_codes(log.users[:n_events], log.events[:n_events], log.offsets, start_code, n_steps)
+    names = np.asarray(log.names, dtype=object)
+
+    return _encode_special(paths, names), names
+
+def _path_codes(users, events, offsets, start_code, n_steps, start=0):
+    """
+    Функция, возвращающая путь каждого клиента в виде кодов событий для непрерывного диапазона строк EventLog
+    Parameters
+    ----------
+    users, events : numpy.ndarray
+        Коды клиентов и событий строк диапазона.\n
+    offsets : numpy.ndarray
+        Границы блоков событий клиентов всего лога (EventLog.offsets).\n
+    start_code : int
+        Код события start_step, -1 - события нет в логе\n
+    n_steps : int
+        Кол-во возвращаемых событий\n
+    start : int
+        Номер первой строки диапазона в логе
+
+    Returns
+    -------
+    paths : numpy.ndarray
+        Матрица кодов событий (клиент x шаг), END - нет события.\n
+    path_users : numpy.ndarray
+        Код клиента каждой строки матрицы.
+    """
+    event = np.asarray(events, dtype=np.int64)
+
+    # find the first start_step of each user with a cumulative count of start_step within the user
+    is_start = (event == start_code) & (start_code >= 0)
+    n_starts = np.concatenate([[0], np.cumsum(is_start)])
+    first_start = np.flatnonzero(is_start & (n_starts[1:] - n_starts[offsets[users] - start] == 1))
+    path_users = users[first_start]
+    first_end = offsets[path_users + 1] - start
 
     # plan out the journey per user, with each step in a separate column
-    flow = events[(events['id'].isin(valid_ids))] \
-        .groupby('id') \
-        .event.agg(list) \
-        .to_frame()['event'] \
-        .apply(lambda x: get_start_step(x, start_step=start_step, n_steps=n_steps)) \
-        .to_frame() \
-        ['event'].apply(pd.Series)
-
-    # fill NaNs with "End" to denote no further step by user; this will be filtered out later
-    flow = flow.fillna('End')
-
-    # add the step number as prefix to each step
-    for i, col in enumerate(flow.columns):
-        flow[col] = '{}: '.format(i + 1) + flow[col].astype(str)
-
-    # replace events not in the top "events_per_step" most frequent list with the name "Other"
+    positions = first_start[:, None] + np.arange(n_steps)
+    in_path = positions < first_end[:, None]
+    paths = np.where(in_path, event[np.minimum(positions, len(event) - 1)], END)
+
+    return paths, path_users
+
+def _shard_paths(spec, start, stop, start_code, n_steps):
+    """
+    Функция подсчета путей клиентов одного шарда, выполняется в отдельном процессе
+    Parameters
+    ----------
+    spec : dict
+        Пути к массивам EventLog (см. parallel.map_shards).\n
+    start, stop : int
+        Диапазон строк шарда.\n
+    start_code : int
+        Код события start_step\n
+    n_steps : int
+        Кол-во возвращаемых событий
+
+    Returns
+    -------
+    flow : pandas.DataFrame
+        Объект pandas df: уникальные пути в кодах событий, их кол-во (count) и наименьший код клиента (first).
+    """
+    arrays = parallel.load_arrays(spec)
+    paths, path_users = _path_codes(np.asarray(arrays['users'][start:stop]), np.asarray(arrays['events'][start:stop]),
+                                    arrays['offsets'], start_code, n_steps, start)
+    flow = pd.DataFrame(paths)
+    flow['first'] = path_users
+
+    return flow.groupby(list(range(n_steps))).agg(count=('first', 'size'), first=('first', 'min')).reset_index()
+
+def _parallel_paths(df, start_step, n_steps, n_jobs):
+    """
+    Функция параллельного расчета путей клиентов по шардам клиентов
+    Parameters
+    ----------
+    df : pandas.DataFrame или EventLog
+        Объект pandas df или EventLog.\n
+    start_step : str
+        Название события, с которого начинается путь клиента\n
+    n_steps : int
+        Кол-во возвращаемых событий\n
+    n_jobs : int
+        Кол-во процессов
+
+    Returns
+    -------
+    paths : numpy.ndarray
+        Матрица кодов уникальных путей (путь x шаг).\n
+    names : numpy.ndarray
+        Названия событий, позиция соответствует коду.\n
+    weights : numpy.ndarray
+        Кол-во клиентов на каждый путь.\n
+    first : numpy.ndarray
+        Наименьший код клиента каждого пути - порядок первого появления пути как в последовательном расчете.
+    """
+    log = as_event_log(df)
+    n_events = log.offsets[len(log.ids)]
+    start_code = log.names.get_indexer([start_step])[0]
+    arrays = {'users': log.users, 'events': log.events, 'offsets': log.offsets}
+    parts = parallel.map_shards(_shard_paths, arrays, parallel.user_shards(log.offsets, n_jobs * 4, stop=n_events),
+                                n_jobs, start_code, n_steps)
+
+    # users are never split between shards, so the partial counts are simply added up
+    steps = list(range(n_steps))
+    flow = pd.concat(parts + [pd.DataFrame(columns=steps + ['count', 'first'], dtype=np.int64)], ignore_index=True)
+    flow = flow.groupby(steps).agg({'count': 'sum', 'first': 'min'}).reset_index()
+    names = np.asarray(log.names, dtype=object)
+
+    return _encode_special(flow[steps].values.astype(np.int64), names), names, \
+        flow['count'].values.astype(np.int64), flow['first'].values.astype(np.int64)
+
+def _replace_rare(paths, events_per_step, weights=None, first=None):
+    """
+    Функция замены редких событий каждого шага на код OTHER
+    Parameters
+    ----------
+    paths : numpy.ndarray
+        Матрица кодов событий (путь x шаг).\n
+    events_per_step : int
+        Кол-во событий, показываемых на каждом из шагов\n
+    weights : numpy.ndarray
+        Кол-во клиентов на каждый путь. Если не задано - каждый путь считается одним клиентом\n
+    first : numpy.ndarray
+        Порядок первого появления каждого пути. Если не задан - порядок строк paths
+
+    Returns
+    -------
+    paths : numpy.ndarray
+        Матрица кодов событий.
+    """
+    paths = paths.copy()
+    order = np.arange(len(paths)) if first is None else np.argsort(first, kind='mergesort')
     # this is done to avoid having too many nodes in the sankey diagram
-    for col in flow.columns:
-        all_events = flow[col].value_counts().index.tolist()
-        all_events = [e for e in all_events if e != (str(col + 1) + ': End')]
-        top_events = all_events[:events_per_step]
-        to_replace = list(set(all_events) - set(top_events))
-        flow[col].replace(to_replace, [str(col + 1) + ': Other'] * len(to_replace), inplace=True)
+    for col in range(paths.shape[1]):
+        # shift codes so that END and OTHER become valid bincount positions
+        shifted = paths[:, col] - OTHER
+        counts = np.bincount(shifted, weights=weights, minlength=END - OTHER + 1)
+        present, first_row = np.unique(shifted[order], return_index=True)
+        present_counts = counts[present]
 
-    # count the number of identical journeys up the max step defined
-    flow = flow.groupby(list(range(n_steps))) \
-        .size() \
-        .to_frame() \
-        .rename({0: 'count'}, axis=1) \
-        .reset_index()
+        # most frequent events first, ties are resolved by the first appearance as in value_counts
+        candidates = present != END - OTHER
+        top = np.lexsort((first_row[candidates], -present_counts[candidates]))
+        keep = np.zeros(len(counts), dtype=bool)
+        keep[present[candidates][top][:events_per_step]] = True
+        keep[END - OTHER] = True
+
+        paths[~keep[shifted], col] = OTHER
+
+    return paths
+
+def _rank_labels(paths, names):
+    """
+    Функция перекодирования кодов событий в ранги подписей узлов внутри шага
+    Parameters
+    ----------
+    paths : numpy.ndarray
+        Матрица кодов событий (путь x шаг).\n
+    names : numpy.ndarray
+        Названия событий, позиция соответствует коду
+
+    Returns
+    -------
+    ranks : numpy.ndarray
+        Матрица рангов: порядок рангов совпадает с порядком подписей узлов как строк.\n
+    labels : list
+        Для каждого шага - отсортированный массив подписей узлов вида "1: event".
+    """
+    ranks = np.empty_like(paths)
+    labels = []
+    for col in range(paths.shape[1]):
+        present, inverse = np.unique(paths[:, col], return_inverse=True)
+        col_labels = np.array(['{}: '.format(col + 1) + ('End' if c == END else 'Other' if c == OTHER else str(names[c]))
+                               for c in present], dtype=object)
+        order = np.argsort(col_labels, kind='mergesort')
+        rank = np.empty(len(order), dtype=paths.dtype)
+        rank[order] = np.arange(len(order))
+        ranks[:, col] = rank[inverse.ravel()]
+        labels.append(col_labels[order])
+
+    return ranks, labels
+
+def _count_paths(paths, weights=None):
+    """
+    Функция подсчета кол-ва одинаковых путей
+    Parameters
+    ----------
+    paths : numpy.ndarray
+        Матрица кодов (путь x шаг).\n
+    weights : numpy.ndarray
+        Кол-во клиентов на каждый путь. Если не задано - каждый путь считается одним клиентом
+
+    Returns
+    -------
+    flow : pandas.DataFrame
+        Объект pandas df с колонками шагов 0..n_steps-1 и колонкой count, отсортированный по шагам.
+    """
+    flow = pd.DataFrame(paths)
+    steps = list(flow.columns)
+    if weights is None:
+        flow = flow.groupby(steps) \
+            .size() \
+            .to_frame() \
+            .rename({0: 'count'}, axis=1) \
+            .reset_index()
+    else:
+        flow['count'] = weights
+        flow = flow.groupby(steps)['count'] \
+            .sum() \
+            .to_frame('count') \
+            .reset_index()
 
     return flow
 
-def get_flow_df(df, start_step, n_steps=5, events_per_step=5):
+def _label_paths(flow, labels):
+    """
+    Функция замены рангов узлов в колонках шагов на подписи узлов
+    Parameters
+    ----------
+    flow : pandas.DataFrame
+        Объект pandas df с рангами узлов в колонках шагов и колонкой count.\n
+    labels : list
+        Для каждого шага - отсортированный массив подписей узлов
+
+    Returns
+    -------
+    flow : pandas.DataFrame
+        Объект pandas df.
+    """
+    for col, col_labels in enumerate(labels):
+        flow[col] = col_labels[flow[col].values]
+
+    return flow
+
+def _decode_paths(paths, names):
+    """
+    Функция замены кодов событий на названия событий, END и OTHER заменяются на "End" и "Other"
+    Parameters
+    ----------
+    paths : numpy.ndarray
+        Матрица кодов событий (путь x шаг).\n
+    names : numpy.ndarray
+        Названия событий, позиция соответствует коду
+
+    Returns
+    -------
+    paths : numpy.ndarray
+        Матрица названий событий.
+    """
+    lookup = np.append(np.asarray(names, dtype=object), ['Other', 'End'])
+    return lookup[np.where(paths >= 0, paths, len(names) + paths - OTHER)]
+
+@instrument.traced('get_flow_df')
+def get_flow_df(df, start_step, n_steps=5, events_per_step=5, n_jobs=1, sample=None, cache=None):
     """
     Функция для генерация датафрейма для дальнейшей визуализации
     Parameters
     ----------
-    df : pandas.DataFrame
-        Объект pandas df.\n
+    df : pandas.DataFrame или EventLog
+        Объект pandas df или EventLog.\n
     start_step : str
         Название события, с которого начинается путь клиента\n
     n_steps : int
         Кол-во возвращаемых событий\n
     events_per_step : int
-        Кол-во событий, показываемых на каждом из шагов. Минимально - должно быть не менее 5 событий
+        Кол-во событий, показываемых на каждом из шагов. Минимально - должно быть не менее 5 событий\n
+    n_jobs : int
+        Кол-во процессов. -1 - все ядра. Результат не зависит от кол-ва процессов\n
+    sample : float
+        Доля клиентов для быстрого расчета. Клиенты выбираются по хэшу id (sample_users), count пересчитывается
+        на всех клиентов, count_low и count_high - границы 95% доверительного интервала. Самые частые события
+        шагов выбираются по выборке. None - все клиенты\n
+    cache : ResultCache
+        Кэш результатов (abo_tools.utils.cache.ResultCache): повторный вызов с теми же данными и аргументами
+        возвращает сохраненный результат. None - без кэша
     
     Returns
     -------
@@ -102,37 +438,80 @@ def get_flow_df(df, start_step, n_steps=5, events_per_step=5):
     source_target_df : pandas.DataFrame
         Объект pandas df.
     """
-    # generate the user user flow dataframe
-    flow = get_user_flow(df, start_step, n_steps, events_per_step)
+    if sample is not None:
+        check_fraction(sample)
+    if cache is not None:
+        return cache.call(get_flow_df, df, start_step, n_steps=n_steps, events_per_step=events_per_step,
+                          n_jobs=n_jobs, sample=sample)
+    if sample is not None:
+        with instrument.span('sample_users', rows_in=instrument.rows(df), fraction=sample) as span:
+            df = sample_users(df, sample)
+            span.rows_out = instrument.rows(df)
+
+    # generate the user flow on integer codes
+    flow, labels = _coded_flow(df, start_step, n_steps, events_per_step, n_jobs)
+    with instrument.span('flow.links', rows_in=len(flow)) as span:
+        label_list, colors_list, source_target_df = _flow_links(flow, labels)
+        span.rows_out = len(source_target_df)
+    if sample is not None:
+        source_target_df = scale_counts(source_target_df, 'count', sample)
+
+    return label_list, colors_list, source_target_df
 
-    # create the nodes labels list
-    label_list = []
-    cat_cols = flow.columns[:-1].values.tolist()
-    for cat_col in cat_cols:
-        label_list_temp = list(set(flow[cat_col].values))
-        label_list = label_list + label_list_temp
+def _flow_links(flow, labels):
+    """
+    Функция преобразования посчитанных путей в пары source-target для диаграммы Санкей
+    Parameters
+    ----------
+    flow : pandas.DataFrame
+        Объект pandas df с рангами узлов в колонках шагов и колонкой count.\n
+    labels : list
+        Для каждого шага - отсортированный массив подписей узлов
+
+    Returns
+    -------
+    label_list : list
+        Список значений\n
+    colors_list : list
+        Список цветов\n
+    source_target_df : pandas.DataFrame
+        Объект pandas df.
+    """
+    # create the nodes labels list, node id of a step rank is its offset in the list
+    offsets = np.cumsum([0] + [len(l) for l in labels])
+    label_list = [label for col_labels in labels for label in col_labels]
+    label_array = np.array(label_list, dtype=object)
 
     # create a list of colours for the nodes
     # assign 'blue' to any node and 'grey' to "Other" nodes
     colors_list = ['blue' if i.find('Other') < 0 else 'grey' for i in label_list]
 
-    # transform flow df into a source-target pair
-    for i in range(len(cat_cols) - 1):
-        if i == 0:
-            source_target_df = flow[[cat_cols[i], cat_cols[i + 1], 'count']]
-            source_target_df.columns = ['source', 'target', 'count']
-        else:
-            temp_df = flow[[cat_cols[i], cat_cols[i + 1], 'count']]
-            temp_df.columns = ['source', 'target', 'count']
-            source_target_df = pd.concat([source_target_df, temp_df])
-        source_target_df = source_target_df.groupby(['source', 'target']).agg({'count': 'sum'}).reset_index()
+    # transform flow into source-target pairs aggregated on int node ids
+    n_nodes = max(len(label_list), 1)
+    counts = flow['count'].values
+    keys = np.concatenate([(flow[i].values + offsets[i]) * n_nodes + flow[i + 1].values + offsets[i + 1]
+                           for i in range(len(labels) - 1)] + [np.empty(0, dtype=np.int64)])
+    pair_keys, inverse = np.unique(keys, return_inverse=True)
+    pair_counts = np.bincount(inverse.ravel(), weights=np.tile(counts, len(labels) - 1) if len(labels) > 1 else None,
+                              minlength=len(pair_keys)).astype(np.int64)
+    source_id = pair_keys // n_nodes
+    target_id = pair_keys % n_nodes
+
+    # order the pairs by source and target labels
+    node_rank = np.empty(len(label_list), dtype=np.int64)
+    node_rank[np.argsort(label_array, kind='mergesort')] = np.arange(len(label_list))
+    order = np.lexsort((node_rank[target_id], node_rank[source_id]))
+    source_id, target_id, pair_counts = source_id[order], target_id[order], pair_counts[order]
 
-    # add index for source-target pair
-    source_target_df['source_id'] = source_target_df['source'].apply(lambda x: label_list.index(x))
-    source_target_df['target_id'] = source_target_df['target'].apply(lambda x: label_list.index(x))
+    # labels are materialized only for the aggregated pairs
+    source_target_df = pd.DataFrame({'source': label_array[source_id],
+                                     'target': label_array[target_id],
+                                     'count': pair_counts,
+                                     'source_id': source_id,
+                                     'target_id': target_id})
 
     # filter out the end step
-    source_target_df = source_target_df[(~source_target_df['source'].str.contains('End')) &
-                                        (~source_target_df['target'].str.contains('End'))]
+    is_end = np.array(['End' in label for label in label_list], dtype=bool)
+    source_target_df = source_target_df[~is_end[source_id] & ~is_end[target_id]]
 
-    return label_list, colors_list, source_target_df
\ No newline at end of file
+    return label_list, colors_list, source_target_df
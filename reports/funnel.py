@@ -1,81 +1,443 @@
 import pandas as pd
 import numpy as np
-def create_funnel_df(df, steps):
+from .event_log import EventLog
+from . import parallel as parallel
+from .sample import check_fraction, sample_users, scale_counts
+from ..utils import instrument
+from .sketch import QuantileSketch, HyperLogLog, hash_values, _hll_precision, _hll_registers
+
+def _encode_log(df, steps):
     """
-    Function used to create a pandas DataFrame that can be used for generating funnel plot
+    Функция кодирования лога событий в целочисленные массивы, отсортированные по (id, event_dt)
     Parameters
     ---------
-    df : pandas.DataFrame
-        Объект pandas df.\n
+    df : pandas.DataFrame или EventLog
+        Объект pandas df или EventLog.\n
     steps : list
-        Список исследуемых событий. Список необходимо формировать в порядке воронки, от стартового события, до завершающего.
-    
+        Список исследуемых событий.
+
     Returns
     -------
-    funnel_df : pandas.DataFrame
-        В качестве вывода будет объект pandas df с посчитанным кол-вом клиентов на каждом из этапов воронки (исследуемых событий).
+    users : numpy.ndarray
+        Коды клиентов (int64), отсортированные по возрастанию.\n
+    ranks : numpy.ndarray
+        Ранг времени события (int64) внутри всего лога. Пустое время получает ранг больше любого другого.\n
+    events : numpy.ndarray
+        Код события - позиция события в списке уникальных steps.\n
+    valid : numpy.ndarray
+        Маска строк с заполненным event_dt.\n
+    uniq_ids : pandas.Index
+        Уникальные id клиентов, позиция id соответствует коду клиента.\n
+    times : numpy.ndarray
+        Уникальные значения event_dt, позиция соответствует рангу.
     """
+    if isinstance(df, EventLog):
+        log = df.select(steps)
+    else:
+        # Кодируем только нужные для нас события
+        log = EventLog(df[df['event'].isin(steps)])
 
-    # Фильтруем датафрейм только нужными для нас атрибутами и проверяем, что события из фрейма соответствуют событиям из steps
-    #df = df[['id', 'event', 'event_dt']]
+    events = pd.Index(list(dict.fromkeys(steps))).get_indexer(log.names)[log.events]
 
-    df = df[df['event'].isin(steps)]
+    return log.users.astype(np.int64), log.ts.astype(np.int64), events.astype(np.int64), log.valid, log.ids, log.times
 
-    values = [] # Список значений для каждого события 
+def _match_steps(users, ranks, events, valid, step_codes, times=None, window=None, sketches=None):
+    """
+    Функция поиска самого раннего прохождения каждого шага воронки за один проход по отсортированному логу
+    Parameters
+    ---------
+    users, ranks, events, valid, times : numpy.ndarray
+        Массивы, полученные из _encode_log. times нужны только для window и sketches.\n
+    step_codes : list
+        Коды событий воронки в порядке шагов.\n
+    window : numpy.timedelta64 или число
+        Максимальное время от стартового шага до каждого следующего шага. None - без ограничения.\n
+    sketches : list
+        Скетчи QuantileSketch для каждого шага, в которые добавляется время перехода с предыдущего шага (в секундах).
 
-    dfs = {} # Словарь для датафрейма каждого события
+    Returns
+    -------
+    reached : list
+        Для каждого шага - позиции строк лога, на которых клиенты прошли шаг (по одной строке на клиента).
+    """
+    # Составной ключ (клиент, время) монотонен в отсортированном логе, поэтому поиск следующего шага - это searchsorted
+    keys = users * (ranks.max(initial=0) + 1) + ranks
 
-    # Для каждого из событий создаем отдельный датафрейм
-    for i, step in enumerate(steps):
+    reached = []
+    for i, code in enumerate(step_codes):
+        pos = np.flatnonzero(events == code)
         if i == 0:
-            # Фильтурем и дедублицируем наш датафрейм и соответствующее событие
-            dfs[step] = df[df['event'] == step].sort_values(['id', 'event_dt'], ascending=True).drop_duplicates(subset=['id', 'event'], keep='first')
+            # Первое по времени стартовое событие каждого клиента
+            first = np.ones(len(pos), dtype=bool)
+            first[1:] = users[pos][1:] != users[pos][:-1]
+            pos = pos[first]
+            start = pos
+        else:
+            # Для каждого клиента ищем первое событие шага, которое произошло не раньше предыдущего шага
+            pos = pos[valid[pos]]
+            prev, start = prev[valid[prev]], start[valid[prev]]
+            idx = np.searchsorted(keys[pos], keys[prev], side='left')
+            found = idx < len(pos)
+            idx = idx[found]
+            hit = users[pos[idx]] == users[prev[found]]
+            pos, prev, start = pos[idx[hit]], prev[found][hit], start[found][hit]
+
+            # Самое раннее событие шага вне окна означает, что и все более поздние вне окна
+            if window is not None:
+                in_window = times[ranks[pos]] - times[ranks[start]] <= window
+                pos, prev, start = pos[in_window], prev[in_window], start[in_window]
+
+            if sketches is not None:
+                sketches[i].add(_seconds(times[ranks[pos]] - times[ranks[prev]]))
+        reached.append(pos)
+        prev = pos
+
+    return reached
+
+def _seconds(delta):
+    """
+    Функция перевода разницы времени в секунды
+    Parameters
+    ---------
+    delta : numpy.ndarray
+        Разница времени (timedelta64) или чисел
+
+    Returns
+    -------
+    seconds : numpy.ndarray
+        Массив float.
+    """
+    if np.issubdtype(delta.dtype, np.timedelta64):
+        return delta / np.timedelta64(1, 's')
+
+    return delta.astype(np.float64)
+
+def _window(window, times):
+    """
+    Функция приведения окна конверсии к типу разницы event_dt
+    Parameters
+    ---------
+    window : str, pandas.Timedelta или число
+        Окно конверсии, например '24h'.\n
+    times : numpy.ndarray
+        Уникальные значения event_dt
+
+    Returns
+    -------
+    window : numpy.timedelta64 или число
+        Окно конверсии.
+    """
+    if window is None or not np.issubdtype(times.dtype, np.datetime64):
+        return window
+
+    return pd.Timedelta(window).to_timedelta64()
+
+def _shard_depth(spec, start, stop, step_codes, window=None, accuracy=None):
+    """
+    Функция расчета глубины воронки клиентов одного шарда, выполняется в отдельном процессе
+    Parameters
+    ---------
+    spec : dict
+        Пути к массивам закодированного лога (см. parallel.map_shards).\n
+    start, stop : int
+        Диапазон строк шарда.\n
+    step_codes : list
+        Коды событий воронки в порядке шагов.\n
+    window : numpy.timedelta64 или число
+        Окно конверсии.\n
+    accuracy : float
+        Точность скетчей времени перехода. None - время перехода не считается.
+
+    Returns
+    -------
+    first_user : int
+        Код первого клиента шарда.\n
+    depth : numpy.ndarray
+        Кол-во пройденных шагов для клиентов first_user, first_user + 1, ...\n
+    sketches : list
+        Скетчи времени перехода на каждый шаг или None.
+    """
+    arrays = parallel.load_arrays(spec)
+    users, ranks, events, valid = [np.asarray(arrays[key][start:stop]) for key in ('users', 'ranks', 'events', 'valid')]
+    sketches = None if accuracy is None else [QuantileSketch(accuracy) for _ in step_codes]
+    reached = _match_steps(users, ranks, events, valid, step_codes, arrays.get('times'), window, sketches)
+
+    depth = np.zeros(users[-1] - users[0] + 1, dtype=np.min_scalar_type(len(step_codes)))
+    for pos in reached:
+        depth[users[pos] - users[0]] += 1
+
+    return users[0], depth, sketches
+
+def _funnel_depth(df, steps, n_jobs=1, window=None, sketches=None):
+    """
+    Функция, возвращающая для каждого клиента кол-во пройденных шагов воронки
+    Parameters
+    ---------
+    df : pandas.DataFrame или EventLog
+        Объект pandas df или EventLog.\n
+    steps : list
+        Список исследуемых событий.\n
+    n_jobs : int
+        Кол-во процессов. Клиенты делятся на шарды, каждый шард считается в отдельном процессе\n
+    window : str, pandas.Timedelta или число
+        Окно конверсии от стартового шага.\n
+    sketches : list
+        Скетчи QuantileSketch для каждого шага, в которые добавляется время перехода с предыдущего шага.
 
+    Returns
+    -------
+    uniq_ids : pandas.Index
+        Уникальные id клиентов, совершивших хотя бы одно событие из steps.\n
+    depth : numpy.ndarray
+        Кол-во пройденных шагов. Позиция соответствует uniq_ids, последний элемент - клиенты без id.
+    """
+    with instrument.span('funnel.encode', rows_in=instrument.rows(df)) as span:
+        users, ranks, events, valid, uniq_ids, times = _encode_log(df, steps)
+        span.rows_out = len(users)
+    step_codes = pd.Index(list(dict.fromkeys(steps))).get_indexer(steps)
+    window = _window(window, times)
+    n_jobs = parallel.get_n_jobs(n_jobs)
+
+    depth = np.zeros(len(uniq_ids) + 1, dtype=np.int64)
+    with instrument.span('funnel.match', rows_in=len(users), n_jobs=n_jobs) as span:
+        if n_jobs == 1:
+            reached = _match_steps(users, ranks, events, valid, step_codes, times, window, sketches)
+            # Каждый клиент проходит шаг не более одного раза, поэтому глубина - это сумма по шагам
+            for pos in reached:
+                depth[users[pos]] += 1
         else:
-            # Фильтруем одно событие
-            dfs[step] = df[df['event'] == step]
-            
-            # Мерджим предыдущее событие и текущее таким образом вычисляем, сколько клиентов перешло на следующий шаг
-            merged = pd.merge(dfs[steps[i - 1]], dfs[step], on='id', how='left')
-            # Удостоверяемся, что следующее событие действительное следующее, делаем мы это проверкой на то, что следующее событие по времени больше предыдущего
-            merged = merged[merged['event_dt_y'] >= merged['event_dt_x']].sort_values('event_dt_y', ascending=True)
-            # Удаляем дубликаты
-            merged = merged.drop_duplicates(subset=['id', 'event_x', 'event_y'], keep='first')
-            # Переименовываем события для следующего мерджа
-            merged = merged[['id', 'event_y', 'event_dt_y']].rename({'event_y': 'event', 'event_dt_y':'event_dt'}, axis=1)
-
-            dfs[step] = merged
-        # Вычисляем кол-во клиентов
-        values.append(len(dfs[step]))
+            offsets = np.searchsorted(users, np.arange(len(uniq_ids) + 2))
+            arrays = {'users': users, 'ranks': ranks, 'events': events, 'valid': valid}
+            if window is not None or sketches is not None:
+                arrays['times'] = times
+            accuracy = None if sketches is None else sketches[0].relative_accuracy
+            results = parallel.map_shards(_shard_depth, arrays, parallel.user_shards(offsets, n_jobs * 4), n_jobs,
+                                          step_codes, window, accuracy)
+            for first_user, part, part_sketches in results:
+                depth[first_user:first_user + len(part)] = part
+                # Скетчи шардов объединяются без потери точности
+                for sketch, part_sketch in zip(sketches or [], part_sketches or []):
+                    sketch.merge(part_sketch)
+        span.rows_out = len(uniq_ids)
+
+    return uniq_ids, depth
+
+def _user_hashes(uniq_ids):
+    """
+    Функция хэширования id клиентов для HyperLogLog
+    Parameters
+    ----------
+    uniq_ids : pandas.Index
+        Уникальные id клиентов
+
+    Returns
+    -------
+    hashes : numpy.ndarray
+        Хэши uint64. Позиция соответствует uniq_ids, последний элемент - хэш клиента без id.
+    """
+    return np.append(hash_values(uniq_ids), hash_values(np.array([np.nan])))
+
+def _step_registers(depth, hashes, n_groups, groups, n_steps, precision):
+    """
+    Функция расчета регистров HyperLogLog клиентов, дошедших до каждого шага
+    Parameters
+    ----------
+    depth : numpy.ndarray
+        Кол-во пройденных шагов каждого значения.\n
+    hashes : numpy.ndarray
+        Хэши клиентов.\n
+    n_groups : int
+        Кол-во групп (подгрупп воронки)\n
+    groups : numpy.ndarray
+        Номер группы каждого значения\n
+    n_steps : int
+        Кол-во шагов воронки\n
+    precision : int
+        Точность HyperLogLog
+
+    Returns
+    -------
+    registers : numpy.ndarray
+        Регистры формы (n_groups, n_steps, 2^precision).
+    """
+    # Регистры считаются по группам глубины, до шага i дошли клиенты с глубиной больше i -
+    # это накопленный с конца максимум регистров
+    reached = depth > 0
+    registers = _hll_registers(hashes[reached], groups[reached] * (n_steps + 1) + depth[reached],
+                               n_groups * (n_steps + 1), precision).reshape(n_groups, n_steps + 1, -1)
+
+    return np.maximum.accumulate(registers[:, ::-1], axis=1)[:, ::-1][:, 1:]
+
+def _step_sketches(registers):
+    """
+    Функция перевода регистров шагов в скетчи
+    Parameters
+    ----------
+    registers : numpy.ndarray
+        Регистры формы (n_steps, 2^precision)
+
+    Returns
+    -------
+    sketches : list
+        Скетчи HyperLogLog для каждого шага.
+    """
+    return [HyperLogLog.from_registers(row) for row in registers]
+
+@instrument.traced('create_funnel_df')
+def create_funnel_df(df, steps, n_jobs=1, window=None, time_stats=False, approx=False, sample=None, cache=None):
+    """
+    Function used to create a pandas DataFrame that can be used for generating funnel plot
+    Parameters
+    ---------
+    df : pandas.DataFrame или EventLog
+        Объект pandas df или EventLog.\n
+    steps : list
+        Список исследуемых событий. Список необходимо формировать в порядке воронки, от стартового события, до завершающего.\n
+    n_jobs : int
+        Кол-во процессов. -1 - все ядра. Результат не зависит от кол-ва процессов\n
+    window : str, pandas.Timedelta или число
+        Окно конверсии: шаг засчитывается, только если он пройден не позже window от стартового шага, например '24h'.
+        Для event_dt, которая не является датой, - число в единицах event_dt. None - без ограничения\n
+    time_stats : bool или float
+        Добавить время перехода с предыдущего шага: медиану (ttc_median), 90-й перцентиль (ttc_p90) и скетч
+        QuantileSketch (ttc_sketch, гистограмма - ttc_sketch.histogram(), значения в секундах). Квантили приближенные
+        с относительной ошибкой 1% или с ошибкой, заданной числом вместо True\n
+    approx : bool или float
+        Добавить скетч HyperLogLog клиентов шага (val_sketch), который можно объединить со скетчами других расчетов
+        (merge) и сохранить (to_bytes). Относительная стандартная ошибка скетча - около 2% или не больше числа,
+        заданного вместо True. val остается точным: для поиска шагов лог все равно кодируется по клиентам, а точный
+        подсчет дошедших клиентов по их глубине воронки дешевле скетчей, поэтому approx не уменьшает память и время
+        расчета, а немного увеличивает их на построение скетчей\n
+    sample : float
+        Доля клиентов для быстрого расчета, например 0.05. Клиенты выбираются по хэшу id (sample_users), поэтому
+        выборка одинакова при любых шагах и подгруппах. val пересчитывается на всех клиентов, val_low и val_high -
+        границы 95% доверительного интервала, val_sample - кол-во клиентов в выборке. None - все клиенты\n
+    cache : ResultCache
+        Кэш результатов (abo_tools.utils.cache.ResultCache): повторный вызов с теми же данными и аргументами
+        возвращает сохраненный результат. None - без кэша
+    
+    Returns
+    -------
+    funnel_df : pandas.DataFrame
+        В качестве вывода будет объект pandas df с посчитанным кол-вом клиентов на каждом из этапов воронки (исследуемых событий).
+    """
+    if sample is not None:
+        check_fraction(sample)
+    if cache is not None:
+        return cache.call(create_funnel_df, df, steps, n_jobs=n_jobs, window=window, time_stats=time_stats,
+                          approx=approx, sample=sample)
+    if sample is not None:
+        with instrument.span('sample_users', rows_in=instrument.rows(df), fraction=sample) as span:
+            df = sample_users(df, sample)
+            span.rows_out = instrument.rows(df)
+    accuracy = 0.01 if time_stats is True else time_stats
+    sketches = [QuantileSketch(accuracy) for _ in steps] if time_stats else None
+
+    # Сортируем лог один раз по (id, event_dt) и для каждого шага находим самое раннее прохождение,
+    # не раньше предыдущего шага. Кол-во клиентов на шаге - это кол-во клиентов с глубиной воронки больше шага
+    uniq_ids, depth = _funnel_depth(df, steps, n_jobs, window, sketches)
+    values = np.bincount(depth, minlength=len(steps) + 1)[::-1].cumsum()[::-1][1:]
 
     funnel_df = pd.DataFrame({'step':steps, 'val':values})
+    if approx:
+        precision = _hll_precision(0.02 if approx is True else approx)
+        registers = _step_registers(depth, _user_hashes(uniq_ids), 1, np.zeros(len(depth), dtype=np.int64),
+                                    len(steps), precision)
+        funnel_df['val_sketch'] = _step_sketches(registers[0])
+
+    if time_stats:
+        # Для event_dt в виде даты квантили возвращаются как Timedelta
+        times = df.times if isinstance(df, EventLog) else df['event_dt'].values
+        convert = (lambda x: pd.to_timedelta(x, unit='s')) if np.issubdtype(times.dtype, np.datetime64) else (lambda x: x)
+        sketches[0] = None
+        funnel_df['ttc_median'] = convert([np.nan] + [sketch.quantile(0.5) for sketch in sketches[1:]])
+        funnel_df['ttc_p90'] = convert([np.nan] + [sketch.quantile(0.9) for sketch in sketches[1:]])
+        funnel_df['ttc_sketch'] = sketches
+    if sample is not None:
+        funnel_df = scale_counts(funnel_df, 'val', sample)
 
     return funnel_df
 
-def stacking_funnel(df, steps, col):
+@instrument.traced('stacking_funnel')
+def stacking_funnel(df, steps, col, n_jobs=1, approx=False, sample=None, cache=None):
     """
     Функция разделения воронки на подгруппы, например, воронка в разрезе ОС
     Parameters
     ---------
-    df : pandas.DataFrame
-        Объект pandas df.\n
+    df : pandas.DataFrame или EventLog
+        Объект pandas df или EventLog.\n
     steps : list
         Список исследуемых событий. Список необходимо формировать в порядке воронки, от стартового события, до завершающего.\n
     col : str
         Фича, по которой будет разделение воронки. Например - OS, воронка будет разделена на iOS и Android.
+        Для EventLog колонка должна быть сохранена при его создании (columns=[col]).\n
+    n_jobs : int
+        Кол-во процессов. -1 - все ядра. Результат не зависит от кол-ва процессов\n
+    approx : bool или float
+        Добавить скетчи HyperLogLog клиентов шагов (val_sketch), как в create_funnel_df. val остается точным,
+        скетчи строятся по уникальным парам (подгруппа, клиент), размер скетча - 2^p байт на шаг подгруппы.
+        Как и в create_funnel_df, память и время расчета не уменьшаются\n
+    sample : float
+        Доля клиентов для быстрого расчета, как в create_funnel_df\n
+    cache : ResultCache
+        Кэш результатов, как в create_funnel_df
     
     Returns
     -------
     dict_ : dict
         В качестве вывода будет объект dict, содержащий застаканные датафреймы
     """
+    if sample is not None:
+        check_fraction(sample)
+    if cache is not None:
+        return cache.call(stacking_funnel, df, steps, col, n_jobs=n_jobs, approx=approx, sample=sample)
+    if sample is not None:
+        with instrument.span('sample_users', rows_in=instrument.rows(df), fraction=sample) as span:
+            df = sample_users(df, sample)
+            span.rows_out = instrument.rows(df)
+
+    # Воронка каждого клиента не зависит от подгруппы, поэтому глубину воронки считаем один раз на весь лог
+    uniq_ids, depth = _funnel_depth(df, steps, n_jobs)
+
+    # Коды подгрупп и клиентов для каждой строки лога, порядок подгрупп совпадает с df[col].dropna().unique()
+    if isinstance(df, EventLog):
+        segments, entries = df.columns[col]
+        user_codes = df.users.astype(np.int64)
+    else:
+        segments, entries = pd.factorize(df[col])
+        user_codes = uniq_ids.get_indexer(df['id'])
+        user_codes[df['id'].isna().values] = len(uniq_ids)
+        # Клиентам без событий из steps соответствует нулевая глубина
+        user_codes[user_codes < 0] = len(uniq_ids) + 1
+    depth = np.append(depth, 0)
+
+    n = len(steps)
+    has_segment = segments >= 0
+    with instrument.span('funnel.segments', rows_in=len(user_codes), segments=len(entries)) as span:
+        # Уникальные пары (подгруппа, клиент)
+        pairs = pd.unique(segments[has_segment].astype(np.int64) * len(depth) + user_codes[has_segment])
+        pair_segment = pairs // len(depth)
+        pair_depth = depth[pairs % len(depth)]
+
+        # Один сгруппированный подсчет: кол-во клиентов каждой подгруппы на каждой глубине
+        counts = np.bincount(pair_segment * (n + 1) + pair_depth, minlength=len(entries) * (n + 1)).reshape(len(entries), n + 1)
+        # До шага i дошли клиенты с глубиной больше i
+        values = counts[:, ::-1].cumsum(axis=1)[:, ::-1][:, 1:]
+
+        if approx:
+            # Скетчи строятся по тем же парам, что и точные значения
+            hashes = np.append(_user_hashes(uniq_ids), np.uint64(0))
+            registers = _step_registers(pair_depth, hashes[pairs % len(depth)], len(entries), pair_segment, n,
+                                        _hll_precision(0.02 if approx is True else approx))
+        span.rows_out = len(entries)
+
     dict_ = {}
-    # Получаем все ИД клиентов, разделенные по col в виде словаря
-    ids = dict(df.groupby([col])['id'].apply(set))
-    # Создаем отдельный датафрейм для каждого из параметров разделения (сol) и для каждого из них получаем параметры построения воронки и записываем в словарь
-    for entry in df[col].dropna().unique():
-        ids_list = ids[entry]
-        temp_df = df[df['id'].isin(ids_list)].copy()
-        if len(temp_df[temp_df['event'] == steps[0]]) > 0:
-            dict_[entry] = create_funnel_df(temp_df, steps)
-    return dict_
\ No newline at end of file
+    for i, (entry, val) in enumerate(zip(entries, values)):
+        # Подгруппы без стартового события пропускаем
+        if n > 0 and val[0] > 0:
+            dict_[entry] = pd.DataFrame({'step':steps, 'val':val})
+            if approx:
+                dict_[entry]['val_sketch'] = _step_sketches(registers[i])
+            if sample is not None:
+                dict_[entry] = scale_counts(dict_[entry], 'val', sample)
+    return dict_
@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+from .event_log import EventLog
+
+class FunnelState(object):
+    """
+    Накопленное состояние воронки: для каждого клиента - кол-во пройденных шагов и время последнего пройденного шага
+
+    Новые события (например, за день) добавляются через update, поэтому ежедневный расчет зависит от объема новых
+    событий, а не от всей истории. Правила сопоставления шагов те же, что и в create_funnel_df: стартовое событие -
+    первое по времени, следующий шаг - самое раннее событие не раньше предыдущего шага. Результат совпадает с расчетом
+    create_funnel_df по всей истории, если события приходят в хронологическом порядке: события нового дня, которые
+    произошли раньше последнего пройденного шага клиента, не учитываются. event_dt должна быть датой/временем,
+    клиенты без id не учитываются.
+
+    Parameters
+    ----------
+    steps : list
+        Список исследуемых событий. Список необходимо формировать в порядке воронки, от стартового события, до завершающего.
+
+    Attributes
+    ----------
+    ids : pandas.Index
+        id клиентов, прошедших хотя бы стартовый шаг.\n
+    depth : numpy.ndarray
+        Кол-во пройденных шагов.\n
+    last_dt : numpy.ndarray
+        Время последнего пройденного шага.
+    """
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.ids = pd.Index([], name='id')
+        self.depth = np.zeros(0, dtype=np.int16)
+        self.last_dt = np.zeros(0, dtype='datetime64[ns]')
+
+    def update(self, df):
+        """
+        Функция добавления новых событий в состояние воронки
+        Parameters
+        ----------
+        df : pandas.DataFrame или EventLog
+            Новые события с колонками id, event, event_dt
+
+        Returns
+        -------
+        funnel_df : pandas.DataFrame
+            Объект pandas df с обновленным кол-вом клиентов на каждом из этапов воронки.
+        """
+        steps = self.steps
+        log = df.select(steps) if isinstance(df, EventLog) else EventLog(df[df['event'].isin(steps)])
+        # Клиенты без id в состояние не попадают
+        n_rows = log.offsets[len(log.ids)]
+        users = log.users[:n_rows].astype(np.int64)
+        step_index = pd.Index(list(dict.fromkeys(steps)))
+        events = step_index.get_indexer(log.names)[log.events[:n_rows]]
+        step_codes = step_index.get_indexer(steps)
+
+        # Клиенты состояния, у которых есть новые события
+        state_users = log.ids.get_indexer(self.ids)
+        active = np.flatnonzero(state_users >= 0)
+        state_users = state_users[active]
+        state_pos = np.full(len(log.ids), -1, dtype=np.int64)
+        state_pos[state_users] = active
+
+        # Время новых событий и состояния переводим в один плотный ранг
+        log_times = np.asarray(log.times, dtype='datetime64[ns]')
+        last_dt = self.last_dt[active]
+        last_valid = ~np.isnat(last_dt)
+        times = np.unique(np.concatenate([log_times, last_dt[last_valid]]))
+        event_rank = np.append(np.searchsorted(times, log_times), len(times))[log.ts[:n_rows]]
+        state_rank = np.searchsorted(times, last_dt)
+        valid = event_rank < len(times)
+        keys = users * (len(times) + 1) + event_rank
+
+        new_depth = np.zeros(len(log.ids), dtype=np.int64)
+        new_rank = np.zeros(len(log.ids), dtype=np.int64)
+        prev_users = prev_rank = np.zeros(0, dtype=np.int64)
+        for i, code in enumerate(step_codes):
+            pos = np.flatnonzero(events == code)
+            if i == 0:
+                # Стартовый шаг ищем только у новых клиентов - первое по времени стартовое событие
+                pos = pos[state_pos[users[pos]] < 0]
+                first = np.ones(len(pos), dtype=bool)
+                first[1:] = users[pos][1:] != users[pos][:-1]
+                pos = pos[first]
+            else:
+                # Продолжаем воронку клиентов, прошедших шаг i - 1 в этом или в предыдущих расчетах
+                from_state = (self.depth[active] == i) & last_valid
+                q_users = np.concatenate([prev_users, state_users[from_state]])
+                q_rank = np.concatenate([prev_rank, state_rank[from_state]])
+                pos = pos[valid[pos]]
+                idx = np.searchsorted(keys[pos], q_users * (len(times) + 1) + q_rank, side='left')
+                found = idx < len(pos)
+                hit = users[pos[idx[found]]] == q_users[found]
+                pos = pos[idx[found][hit]]
+
+            new_depth[users[pos]] = i + 1
+            new_rank[users[pos]] = event_rank[pos]
+            keep = valid[pos]
+            prev_users, prev_rank = users[pos][keep], event_rank[pos][keep]
+
+        # Обновляем клиентов состояния и добавляем новых
+        matched = np.flatnonzero(new_depth)
+        matched_dt = np.append(times, np.datetime64('NaT', 'ns'))[new_rank[matched]]
+        old = state_pos[matched] >= 0
+
+        depth = self.depth.copy()
+        depth[state_pos[matched[old]]] = new_depth[matched[old]]
+        last_dt = self.last_dt.copy()
+        last_dt[state_pos[matched[old]]] = matched_dt[old]
+
+        self.ids = self.ids.append(log.ids[matched[~old]]).rename('id')
+        self.depth = np.concatenate([depth, new_depth[matched[~old]].astype(depth.dtype)])
+        self.last_dt = np.concatenate([last_dt, matched_dt[~old]])
+
+        return self.to_funnel_df()
+
+    def to_funnel_df(self):
+        """
+        Функция расчета воронки по состоянию
+        Returns
+        -------
+        funnel_df : pandas.DataFrame
+            Объект pandas df с посчитанным кол-вом клиентов на каждом из этапов воронки, как в create_funnel_df.
+        """
+        values = np.bincount(self.depth, minlength=len(self.steps) + 1)[::-1].cumsum()[::-1][1:]
+
+        return pd.DataFrame({'step':self.steps, 'val':values})
+
+    def save(self, path):
+        """
+        Функция сохранения состояния в сжатый файл .npz
+        Parameters
+        ----------
+        path : str
+            Путь к файлу. id клиентов с типом object сохраняются строками
+        """
+        ids = np.asarray(self.ids)
+        if ids.dtype == object:
+            ids = ids.astype(str)
+        np.savez_compressed(path, ids=ids, depth=self.depth, last_dt=self.last_dt, steps=np.asarray(self.steps, dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Функция загрузки состояния, сохраненного через save
+        Parameters
+        ----------
+        path : str
+            Путь к файлу
+
+        Returns
+        -------
+        state : FunnelState
+            Объект FunnelState.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            state = cls(data['steps'].tolist())
+            state.ids = pd.Index(data['ids'], name='id')
+            state.depth = data['depth']
+            state.last_dt = data['last_dt']
+
+        return state
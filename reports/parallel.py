@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+"""
+Параллельный расчет отчетов по шардам клиентов.
+Массивы закодированного лога один раз записываются в memory-mapped файлы, процессы читают их без копирования,
+а каждый шард - это непрерывный диапазон строк, в котором события клиента не делятся между шардами.
+"""
+
+def get_n_jobs(n_jobs):
+    """
+    Функция, возвращающая кол-во процессов
+    Parameters
+    ----------
+    n_jobs : int
+        Кол-во процессов. Отрицательное значение - все ядра, кроме (|n_jobs| - 1)
+
+    Returns
+    -------
+    n_jobs : int
+        Кол-во процессов, не меньше 1.
+    """
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        n_jobs = (os.cpu_count() or 1) + 1 + n_jobs
+
+    return max(int(n_jobs), 1)
+
+def user_shards(offsets, n_shards, start=0, stop=None):
+    """
+    Функция разбиения строк лога на шарды по границам клиентов
+    Parameters
+    ----------
+    offsets : numpy.ndarray
+        Границы блоков событий клиентов (EventLog.offsets).\n
+    n_shards : int
+        Желаемое кол-во шардов\n
+    start, stop : int
+        Диапазон строк, который нужно разбить
+
+    Returns
+    -------
+    bounds : list
+        Список пар (начало, конец) строк шардов примерно одинакового размера.
+    """
+    if stop is None:
+        stop = offsets[-1]
+    # Цели делим равномерно по строкам и сдвигаем к ближайшей границе клиента
+    targets = np.linspace(start, stop, n_shards + 1)
+    edges = np.unique(np.concatenate([[start], offsets[np.searchsorted(offsets, targets[1:-1])], [stop]]))
+    edges = edges[(edges >= start) & (edges <= stop)]
+
+    return [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:]) if b > a]
+
+def load_arrays(spec):
+    """
+    Функция открытия массивов, записанных в map_shards
+    Parameters
+    ----------
+    spec : dict
+        Словарь имя массива -> путь к .npy файлу
+
+    Returns
+    -------
+    arrays : dict
+        Словарь имя массива -> numpy.memmap только для чтения.
+    """
+    return {key: np.load(path, mmap_mode='r') for key, path in spec.items()}
+
+def map_shards(func, arrays, bounds, n_jobs, *args):
+    """
+    Функция параллельного применения func к шардам лога
+    Parameters
+    ----------
+    func : callable
+        Функция уровня модуля вида func(spec, start, stop, *args). Массивы открываются в ней через load_arrays(spec).\n
+    arrays : dict
+        Словарь имя массива -> numpy.ndarray.\n
+    bounds : list
+        Список пар (начало, конец) строк шардов.\n
+    n_jobs : int
+        Кол-во процессов\n
+    args
+        Дополнительные аргументы func
+
+    Returns
+    -------
+    results : list
+        Результаты func в порядке шардов.
+    """
+    directory = tempfile.mkdtemp(prefix='abo_tools_')
+    try:
+        spec = {}
+        for key, array in arrays.items():
+            spec[key] = os.path.join(directory, '{}.npy'.format(key))
+            np.save(spec[key], np.ascontiguousarray(array))
+
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            futures = [pool.submit(func, spec, start, stop, *args) for start, stop in bounds]
+            return [future.result() for future in futures]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
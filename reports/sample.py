@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+from .event_log import EventLog
+from .sketch import hash_values
+
+"""
+Детерминированные выборки клиентов для быстрых исследовательских отчетов.
+Клиент попадает в выборку по хэшу id, поэтому при любом вызове (другие шаги, подгруппы, период) выборка одна и та же.
+"""
+
+SAMPLE_SALT = 0x5EED
+
+def check_fraction(fraction):
+    """
+    Функция проверки доли клиентов в выборке
+    Parameters
+    ----------
+    fraction : float
+        Доля клиентов в выборке. Допустимы значения 0 < fraction <= 1
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError('Доля клиентов в выборке должна быть больше 0 и не больше 1, получено {}'.format(fraction))
+
+def _keep_ids(ids, fraction):
+    """
+    Функция выбора клиентов по хэшу id
+    Parameters
+    ----------
+    ids : array-like
+        id клиентов.\n
+    fraction : float
+        Доля клиентов в выборке
+
+    Returns
+    -------
+    keep : numpy.ndarray
+        Маска клиентов, попавших в выборку.
+    """
+    # Клиент попадает в выборку, если его хэш меньше доли от диапазона uint64
+    return hash_values(ids, SAMPLE_SALT) < np.uint64(fraction * (2 ** 64 - 1))
+
+def sample_users(df, fraction):
+    """
+    Функция выборки доли клиентов со всеми их событиями
+    Parameters
+    ----------
+    df : pandas.DataFrame или EventLog
+        Лог событий с колонкой id.\n
+    fraction : float
+        Доля клиентов, 0 < fraction <= 1. Выборка зависит только от id: один и тот же id с тем же типом
+        (например, 5 и 5.0 - разные типы) всегда либо в выборке, либо нет
+
+    Returns
+    -------
+    sample : pandas.DataFrame или EventLog
+        События клиентов выборки того же типа, что и df.
+    """
+    check_fraction(fraction)
+    if fraction == 1:
+        return df
+
+    if isinstance(df, EventLog):
+        # Последний код - клиент без id
+        keep = np.append(_keep_ids(df.ids, fraction), _keep_ids(np.array([np.nan]), fraction))
+        return df.take(keep[df.users])
+
+    # Хэшируем только уникальные id
+    codes, uniques = pd.factorize(df['id'])
+    keep = np.append(_keep_ids(uniques, fraction), _keep_ids(np.array([np.nan]), fraction))
+
+    return df[keep[codes]]
+
+def scale_counts(frame, column, fraction, z=1.96):
+    """
+    Функция пересчета кол-ва клиентов в выборке на всех клиентов с доверительным интервалом
+    Parameters
+    ----------
+    frame : pandas.DataFrame
+        Объект pandas df с кол-вом клиентов выборки в колонке column.\n
+    column : str
+        Название колонки с кол-вом клиентов\n
+    fraction : float
+        Доля клиентов в выборке, 0 < fraction <= 1\n
+    z : float
+        Квантиль нормального распределения, 1.96 - 95% интервал
+
+    Returns
+    -------
+    frame : pandas.DataFrame
+        Новый объект pandas df: column - оценка кол-ва всех клиентов, {column}_low и {column}_high - границы интервала,
+        {column}_sample - кол-во клиентов в выборке.
+    """
+    check_fraction(fraction)
+    frame = frame.copy()
+    sample = frame[column].values.astype(np.float64)
+
+    # Каждый клиент попадает в выборку независимо с вероятностью fraction: кол-во в выборке k ~ Bin(N, fraction).
+    # Интервал для N - все N, для которых |k - N * fraction| <= z * sqrt(N * fraction * (1 - fraction)), как в интервале
+    # Уилсона. В отличие от интервала Вальда он не сжимается в точку при k = 0 и не занижает верхнюю границу при малых k
+    estimate = sample / fraction
+    q = z ** 2 * (1 - fraction)
+    center = (2 * sample + q) / (2 * fraction)
+    error = np.sqrt(q * (4 * sample + q)) / (2 * fraction)
+    position = frame.columns.get_loc(column)
+    frame[column] = np.round(estimate).astype(np.int64)
+    frame.insert(position + 1, column + '_low', np.round(np.maximum(center - error, sample)).astype(np.int64))
+    frame.insert(position + 2, column + '_high', np.round(center + error).astype(np.int64))
+    frame.insert(position + 3, column + '_sample', sample.astype(np.int64))
+
+    return frame
@@ -0,0 +1,417 @@
+import numpy as np
+import pandas as pd
+
+"""
+Скетчи - компактные объединяемые структуры для приближенных метрик по логам любого размера.
+"""
+
+class QuantileSketch(object):
+    """
+    Скетч квантилей неотрицательных значений с логарифмическими корзинами (как DDSketch)
+
+    Значение x попадает в корзину k = ceil(log(x) / log(gamma)), gamma = (1 + a) / (1 - a). Квантиль возвращается
+    с относительной ошибкой не больше a, а память зависит только от диапазона значений (например, от секунды до года
+    при a = 0.01 - около 1000 корзин), а не от их кол-ва. Скетчи с одинаковой точностью можно объединять.
+
+    Parameters
+    ----------
+    relative_accuracy : float
+        Относительная точность квантилей a
+    """
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.zero_count = 0
+
+    @property
+    def count(self):
+        """Кол-во добавленных значений."""
+        return int(self.counts.sum()) + self.zero_count
+
+    def _grow(self, low, high):
+        # Расширяем массив корзин, чтобы он покрывал ключи от low до high
+        if not len(self.counts):
+            self.offset = low
+            self.counts = np.zeros(high - low + 1, dtype=np.int64)
+            return
+        new_offset = min(self.offset, low)
+        new_end = max(self.offset + len(self.counts) - 1, high)
+        if new_offset < self.offset or new_end > self.offset + len(self.counts) - 1:
+            counts = np.zeros(new_end - new_offset + 1, dtype=np.int64)
+            counts[self.offset - new_offset:self.offset - new_offset + len(self.counts)] = self.counts
+            self.offset, self.counts = new_offset, counts
+
+    def add(self, values):
+        """
+        Функция добавления значений в скетч
+        Parameters
+        ----------
+        values : array-like
+            Неотрицательные значения. Пропуски игнорируются
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        positive = values > 0
+        self.zero_count += int((~positive).sum())
+        if not positive.any():
+            return
+
+        keys = np.ceil(np.log(values[positive]) / np.log(self.gamma)).astype(np.int64)
+        self._grow(keys.min(), keys.max())
+        self.counts += np.bincount(keys - self.offset, minlength=len(self.counts))
+
+    def merge(self, other):
+        """
+        Функция объединения с другим скетчем той же точности
+        Parameters
+        ----------
+        other : QuantileSketch
+            Скетч, который нужно добавить
+
+        Returns
+        -------
+        self : QuantileSketch
+            Объединенный скетч.
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Нельзя объединить скетчи с разной точностью')
+        self.zero_count += other.zero_count
+        if len(other.counts):
+            self._grow(other.offset, other.offset + len(other.counts) - 1)
+            start = other.offset - self.offset
+            self.counts[start:start + len(other.counts)] += other.counts
+
+        return self
+
+    def quantile(self, q):
+        """
+        Функция расчета квантиля
+        Parameters
+        ----------
+        q : float
+            Уровень квантиля от 0 до 1
+
+        Returns
+        -------
+        value : float
+            Приближенное значение квантиля, NaN для пустого скетча.
+        """
+        count = self.count
+        if count == 0:
+            return np.nan
+
+        rank = q * (count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        bucket = np.searchsorted(np.cumsum(self.counts), rank - self.zero_count, side='right')
+        key = self.offset + bucket
+
+        # Середина корзины (gamma^(k-1), gamma^k] с точки зрения относительной ошибки
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def histogram(self):
+        """
+        Функция, возвращающая гистограмму значений скетча
+        Returns
+        -------
+        hist : pandas.DataFrame
+            Объект pandas df с колонками bin_start, bin_end, count. Нулевые значения - в корзине [0, 0].
+        """
+        keys = self.offset + np.flatnonzero(self.counts)
+        hist = pd.DataFrame({
+            'bin_start': self.gamma ** (keys - 1.0),
+            'bin_end': self.gamma ** keys.astype(np.float64),
+            'count': self.counts[keys - self.offset],
+        })
+        if self.zero_count:
+            hist = pd.concat([pd.DataFrame({'bin_start': [0.0], 'bin_end': [0.0], 'count': [self.zero_count]}), hist],
+                             ignore_index=True)
+
+        return hist
+
+def hash_values(values, salt=None):
+    """
+    Функция 64-битного хэширования значений для HyperLogLog, шардирования и выборок клиентов
+    Parameters
+    ----------
+    values : array-like
+        Значения, например id клиентов. Хэш зависит от типа: 5 и '5' - разные значения\n
+    salt : int
+        Соль. Хэши с разной солью независимы, None - без соли
+
+    Returns
+    -------
+    hashes : numpy.ndarray
+        Хэши uint64.
+    """
+    h = pd.util.hash_array(np.asarray(values))
+    if salt is None:
+        return h
+
+    # Перемешиваем биты хэша с солью (splitmix64): pd.util.hash_array не использует hash_key для чисел
+    h = h ^ np.uint64((salt * 0x9E3779B97F4A7C15) % 2 ** 64)
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+def _hll_precision(relative_error):
+    # Стандартная ошибка HyperLogLog - 1.04 / sqrt(2^p)
+    return int(min(max(np.ceil(2 * np.log2(1.04 / relative_error)), 4), 18))
+
+def _hll_index_rank(hashes, precision):
+    """
+    Функция расчета номера регистра и ранга каждого хэша
+    Parameters
+    ----------
+    hashes : numpy.ndarray
+        Хэши uint64 значений.\n
+    precision : int
+        Кол-во бит хэша для номера регистра
+
+    Returns
+    -------
+    index : numpy.ndarray
+        Номер регистра от 0 до 2^precision - 1.\n
+    rank : numpy.ndarray
+        Ранг uint8 - позиция первой единицы в оставшихся битах хэша.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+
+    # Ранг считается бинарным поиском по сдвигам
+    rest = hashes << np.uint64(precision)
+    rank = np.ones(len(hashes), dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        zero = rest < np.uint64(1 << (64 - shift))
+        rank[zero] += shift
+        rest[zero] <<= np.uint64(shift)
+
+    return index, np.minimum(rank, 64 - precision + 1).astype(np.uint8)
+
+def _hll_registers(hashes, groups, n_groups, precision):
+    """
+    Функция заполнения регистров HyperLogLog для нескольких групп за один проход
+    Parameters
+    ----------
+    hashes : numpy.ndarray
+        Хэши uint64 значений.\n
+    groups : numpy.ndarray
+        Номер группы каждого значения от 0 до n_groups - 1.\n
+    n_groups : int
+        Кол-во групп\n
+    precision : int
+        Кол-во бит хэша для номера регистра
+
+    Returns
+    -------
+    registers : numpy.ndarray
+        Регистры uint8 формы (n_groups, 2^precision). Повторные значения не меняют регистры.
+    """
+    index, rank = _hll_index_rank(hashes, precision)
+    registers = np.zeros((n_groups, 1 << precision), dtype=np.uint8)
+    np.maximum.at(registers.reshape(-1), np.asarray(groups, dtype=np.int64) * (1 << precision) + index, rank)
+
+    return registers
+
+def _hll_correct(inverse_sum, zeros, m):
+    # Оценка по сумме 2^-регистр и кол-ву пустых регистров. Для небольшого кол-ва значений точнее
+    # линейный подсчет по пустым регистрам
+    alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+    estimate = alpha * m * m / inverse_sum
+    small = (estimate <= 2.5 * m) & (zeros > 0)
+
+    return np.where(small, m * np.log(m / np.maximum(zeros, 1)), estimate)
+
+def _hll_estimate(registers):
+    """
+    Функция оценки кол-ва уникальных значений по регистрам HyperLogLog
+    Parameters
+    ----------
+    registers : numpy.ndarray
+        Регистры формы (..., 2^precision)
+
+    Returns
+    -------
+    estimate : numpy.ndarray
+        Оценка кол-ва уникальных значений для каждого набора регистров.
+    """
+    m = registers.shape[-1]
+    flat = registers.reshape(-1, m)
+
+    # Оценка зависит только от гистограммы значений регистров (не больше 64 корзин), гистограммы считаются
+    # блоками строк, чтобы не создавать float64 копию всех регистров
+    hist = np.zeros((len(flat), 64), dtype=np.int64)
+    chunk = max(2 ** 22 // m, 1)
+    for start in range(0, len(flat), chunk):
+        block = flat[start:start + chunk]
+        cells = np.arange(len(block), dtype=np.int64)[:, None] * 64 + block
+        hist[start:start + len(block)] = np.bincount(cells.ravel(), minlength=len(block) * 64).reshape(-1, 64)
+    estimate = _hll_correct(hist @ np.exp2(-np.arange(64.0)), hist[:, 0], m)
+
+    return estimate.reshape(registers.shape[:-1])
+
+def _hll_group_estimate(hashes, groups, n_groups, precision):
+    """
+    Функция оценки кол-ва уникальных значений в нескольких группах без заполнения регистров
+    Хранятся только непустые регистры групп, поэтому память зависит от кол-ва значений, а не от n_groups * 2^p
+    Parameters
+    ----------
+    hashes : numpy.ndarray
+        Хэши uint64 значений.\n
+    groups : numpy.ndarray
+        Номер группы каждого значения от 0 до n_groups - 1.\n
+    n_groups : int
+        Кол-во групп\n
+    precision : int
+        Кол-во бит хэша для номера регистра
+
+    Returns
+    -------
+    estimate : numpy.ndarray
+        Оценка кол-ва уникальных значений в каждой группе, совпадает с оценкой по регистрам _hll_registers.
+    """
+    m = 1 << precision
+    index, rank = _hll_index_rank(hashes, precision)
+
+    # Ранг не больше 61 и помещается в 6 младших бит ключа (группа, регистр, ранг).
+    # После сортировки последний ключ каждого регистра - его максимальный ранг
+    keys = np.asarray(groups, dtype=np.int64) * m
+    keys += index
+    keys *= 64
+    keys += rank
+    keys.sort()
+    registers = keys >> 6
+    last = np.ones(len(keys), dtype=bool)
+    last[:-1] = registers[1:] != registers[:-1]
+    keys, registers = keys[last], registers[last]
+
+    group = registers // m
+    zeros = m - np.bincount(group, minlength=n_groups)
+    inverse_sum = zeros + np.bincount(group, weights=np.exp2(-(keys & 63).astype(np.float64)), minlength=n_groups)
+
+    return _hll_correct(inverse_sum, zeros, m)
+
+class HyperLogLog(object):
+    """
+    Скетч HyperLogLog для приближенного подсчета уникальных значений (например, клиентов)
+
+    Память - 2^p байт (p от 4 до 18) и не зависит от кол-ва значений. Относительная стандартная ошибка оценки -
+    1.04 / sqrt(2^p): при relative_error=0.02 p = 12, 4 КБ, при 0.01 - p = 14, 16 КБ. Скетчи с одинаковой точностью
+    объединяются поэлементным максимумом регистров, результат равен скетчу объединения значений, поэтому частичные
+    результаты (например, по дням или по шардам клиентов) можно объединять без повторного расчета.
+
+    Parameters
+    ----------
+    relative_error : float
+        Желаемая относительная стандартная ошибка оценки
+    """
+    def __init__(self, relative_error=0.02):
+        self.precision = _hll_precision(relative_error)
+        self.registers = np.zeros(1 << self.precision, dtype=np.uint8)
+
+    @property
+    def relative_error(self):
+        """Относительная стандартная ошибка оценки."""
+        return 1.04 / np.sqrt(len(self.registers))
+
+    def add(self, values):
+        """
+        Функция добавления значений в скетч
+        Parameters
+        ----------
+        values : array-like
+            Значения, например id клиентов
+        """
+        self.add_hashes(hash_values(values))
+
+    def add_hashes(self, hashes):
+        """
+        Функция добавления значений, уже захэшированных через hash_values
+        Parameters
+        ----------
+        hashes : numpy.ndarray
+            Хэши uint64
+        """
+        registers = _hll_registers(hashes, np.zeros(len(hashes), dtype=np.int64), 1, self.precision)[0]
+        np.maximum(self.registers, registers, out=self.registers)
+
+    def estimate(self):
+        """
+        Функция оценки кол-ва уникальных значений
+        Returns
+        -------
+        estimate : float
+            Приближенное кол-во уникальных значений.
+        """
+        return float(_hll_estimate(self.registers))
+
+    def merge(self, other):
+        """
+        Функция объединения с другим скетчем той же точности
+        Parameters
+        ----------
+        other : HyperLogLog
+            Скетч, который нужно добавить
+
+        Returns
+        -------
+        self : HyperLogLog
+            Объединенный скетч.
+        """
+        if other.precision != self.precision:
+            raise ValueError('Нельзя объединить скетчи с разной точностью')
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+        return self
+
+    def to_bytes(self):
+        """
+        Функция сериализации скетча
+        Returns
+        -------
+        data : bytes
+            Точность (1 байт) и регистры скетча.
+        """
+        return bytes([self.precision]) + self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Функция восстановления скетча, сериализованного через to_bytes
+        Parameters
+        ----------
+        data : bytes
+            Результат to_bytes
+
+        Returns
+        -------
+        sketch : HyperLogLog
+            Объект HyperLogLog.
+        """
+        sketch = cls.from_registers(np.frombuffer(data, dtype=np.uint8, offset=1))
+        if sketch.precision != data[0]:
+            raise ValueError('Некорректный размер скетча')
+
+        return sketch
+
+    @classmethod
+    def from_registers(cls, registers):
+        """
+        Функция создания скетча из готовых регистров
+        Parameters
+        ----------
+        registers : numpy.ndarray
+            Регистры uint8 длины 2^p
+
+        Returns
+        -------
+        sketch : HyperLogLog
+            Объект HyperLogLog с копией регистров.
+        """
+        sketch = object.__new__(cls)
+        sketch.precision = int(np.log2(len(registers)))
+        sketch.registers = np.array(registers, dtype=np.uint8)
+
+        return sketch
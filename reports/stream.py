@@ -0,0 +1,383 @@
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from . import funnel as funnel
+from . import flow as flow
+from .event_log import as_event_log
+from .sketch import hash_values
+
+"""
+Потоковый расчет воронки и путей клиентов по логу, который не помещается в память.
+События раскладываются по корзинам (bucket) по хэшу id клиента, каждая корзина считается независимо,
+а частичные результаты суммируются в конце.
+"""
+
+COLUMNS = ['id', 'event', 'event_dt']
+
+# Кол-во первых строк источника, по которым оценивается размер строки
+SAMPLE_ROWS = 1024
+
+def _normalize_ids(ids):
+    """
+    Функция приведения id клиентов к строке
+    id из CSV читаются строкой, а из Parquet и pandas df - со своим типом. Чтобы события одного клиента из разных
+    источников попали в одну корзину и считались одним клиентом, все id приводятся к строке, а целые id
+    в float (колонка с пропусками) - к строке без дробной части
+    Parameters
+    ----------
+    ids : pandas.Series
+        id клиентов
+
+    Returns
+    -------
+    ids : pandas.Series
+        id клиентов строкой (object), пропуски остаются пропусками.
+    """
+    known = ids.notna().values
+    values = ids.values[known]
+    if values.dtype.kind == 'f':
+        text = values.astype(str).astype(object)
+        integral = values == np.floor(values)
+        text[integral] = values[integral].astype(np.int64).astype(str)
+    else:
+        text = np.asarray(values).astype(str).astype(object)
+
+    normalized = np.full(len(ids), np.nan, dtype=object)
+    normalized[known] = text
+    return pd.Series(normalized, index=ids.index, name=ids.name)
+
+def _chunk_rows(sample, memory_limit, chunksize=None):
+    """
+    Функция расчета кол-ва строк части лога по бюджету памяти
+    Parameters
+    ----------
+    sample : pandas.DataFrame
+        Первые строки источника после приведения id к строке.\n
+    memory_limit : int
+        Бюджет памяти в байтах. Часть лога занимает не больше восьмой части бюджета\n
+    chunksize : int
+        Максимальное кол-во строк части. None - без ограничения
+
+    Returns
+    -------
+    rows : int
+        Кол-во строк части.
+    """
+    row_bytes = sample.memory_usage(deep=True).sum() / max(len(sample), 1)
+    rows = max(int(memory_limit // 8 // max(row_bytes, 1)), 1)
+
+    return min(rows, chunksize) if chunksize is not None else rows
+
+def _read_csv(path, memory_limit, chunksize):
+    # Первые строки читаются отдельно, по ним считается размер строки и кол-во строк следующих частей
+    # id читаем строкой, чтобы хэш клиента не зависел от того, есть ли в части пропуски
+    with pd.read_csv(path, usecols=COLUMNS, dtype={'id': str}, parse_dates=['event_dt'],
+                     chunksize=SAMPLE_ROWS) as reader:
+        try:
+            chunk = reader.get_chunk(SAMPLE_ROWS)
+        except StopIteration:
+            return
+        rows = _chunk_rows(chunk.assign(id=_normalize_ids(chunk['id'])), memory_limit, chunksize)
+        while True:
+            yield chunk
+            del chunk
+            try:
+                chunk = reader.get_chunk(rows)
+            except StopIteration:
+                return
+
+def _read_parquet(path, memory_limit, chunksize):
+    # Parquet читается пакетами строк, а не партициями или группами строк целиком: их размер задает тот,
+    # кто записал файл. Первые строки читаются отдельно, затем файл читается пакетами по бюджету с их пропуском
+    import pyarrow.parquet as pq
+
+    file = pq.ParquetFile(path)
+    sample = next(file.iter_batches(batch_size=SAMPLE_ROWS, columns=COLUMNS), None)
+    if sample is None:
+        return
+    chunk = sample.to_pandas()
+    rows = _chunk_rows(chunk.assign(id=_normalize_ids(chunk['id'])), memory_limit, chunksize)
+    yield chunk
+
+    skip = sample.num_rows
+    for batch in file.iter_batches(batch_size=rows, columns=COLUMNS):
+        if skip >= batch.num_rows:
+            skip -= batch.num_rows
+            continue
+        yield batch.slice(skip).to_pandas()
+        skip = 0
+
+def _read_source(source, memory_limit, chunksize=None):
+    """
+    Функция чтения лога событий по частям, размер которых зависит от бюджета памяти
+    Parameters
+    ----------
+    source : str, list или iterable
+        Путь к CSV/Parquet файлу, список путей или итератор pandas df.\n
+    memory_limit : int
+        Бюджет памяти в байтах. Часть лога занимает не больше восьмой части бюджета\n
+    chunksize : int
+        Максимальное кол-во строк части. None - только по бюджету
+
+    Returns
+    -------
+    chunk : pandas.DataFrame
+        Генератор частей лога с колонками id, event, event_dt.
+    """
+    if isinstance(source, (str, os.PathLike, pd.DataFrame)):
+        source = [source]
+
+    for item in source:
+        if isinstance(item, pd.DataFrame):
+            # pandas df уже в памяти, но делится на части, чтобы копии при раскладывании по корзинам были небольшими
+            frame = item[COLUMNS]
+            sample = frame.iloc[:SAMPLE_ROWS]
+            rows = _chunk_rows(sample.assign(id=_normalize_ids(sample['id'])), memory_limit, chunksize)
+            chunks = (frame.iloc[i:i + rows] for i in range(0, len(frame), rows))
+        else:
+            path = os.fspath(item)
+            if path.endswith(('.parquet', '.pq')):
+                chunks = _read_parquet(path, memory_limit, chunksize)
+            else:
+                chunks = _read_csv(path, memory_limit, chunksize)
+
+        for chunk in chunks:
+            yield chunk.assign(id=_normalize_ids(chunk['id']))
+            del chunk
+
+def _hash_ids(ids, level):
+    """
+    Функция хэширования id клиентов с солью, зависящей от уровня разбиения
+    Parameters
+    ----------
+    ids : numpy.ndarray
+        Массив id клиентов.\n
+    level : int
+        Уровень разбиения
+
+    Returns
+    -------
+    h : numpy.ndarray
+        Хэш id (uint64).
+    """
+    # Корзины разных уровней независимы, так как соль зависит от уровня
+    return hash_values(ids, level)
+
+def _read_bucket(path):
+    """
+    Функция чтения частей корзины, записанных на диск
+    Parameters
+    ----------
+    path : str
+        Путь к файлу корзины
+
+    Returns
+    -------
+    chunk : pandas.DataFrame
+        Генератор частей корзины.
+    """
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                break
+
+def _spill(chunks, paths, level, memory_limit):
+    """
+    Функция раскладывания событий по корзинам на диске по хэшу id клиента
+    Parameters
+    ----------
+    chunks : iterable
+        Итератор частей лога.\n
+    paths : list
+        Пути к файлам корзин.\n
+    level : int
+        Уровень разбиения - от него зависит соль хэша, чтобы повторное разбиение корзины было равномерным.\n
+    memory_limit : int
+        Бюджет памяти в байтах. Буфер корзин сбрасывается на диск при достижении четверти бюджета
+
+    Returns
+    -------
+    sizes : numpy.ndarray
+        Размер каждой корзины в памяти в байтах.
+    """
+    n_buckets = len(paths)
+    buffers = [[] for _ in range(n_buckets)]
+    sizes = np.zeros(n_buckets, dtype=np.int64)
+    buffered = 0
+
+    def flush():
+        for path, buffer in zip(paths, buffers):
+            if buffer:
+                with open(path, 'ab') as f:
+                    pickle.dump(pd.concat(buffer), f, protocol=pickle.HIGHEST_PROTOCOL)
+                del buffer[:]
+
+    for chunk in chunks:
+        buckets = _hash_ids(chunk['id'], level) % np.uint64(n_buckets)
+        for bucket, part in chunk.groupby(buckets):
+            size = part.memory_usage(deep=True).sum()
+            buffers[bucket].append(part)
+            sizes[bucket] += size
+            buffered += size
+        if buffered > memory_limit // 4:
+            flush()
+            buffered = 0
+    flush()
+
+    return sizes
+
+def iter_buckets(source, memory_limit=2 ** 30, n_buckets=16, chunksize=None, event_filter=None, max_level=3):
+    """
+    Функция, возвращающая лог событий корзинами, каждая из которых содержит все события своих клиентов
+    Parameters
+    ----------
+    source : str, list или iterable
+        Путь к CSV/Parquet файлу, список путей или итератор pandas df с колонками id, event, event_dt.\n
+    memory_limit : int
+        Бюджет памяти в байтах на чтение и раскладывание лога: часть лога занимает до 1/8 бюджета (кол-во строк
+        считается по размеру первых строк каждого источника), буфер корзин - до 1/4, а корзина больше 1/8 бюджета
+        разбивается повторно. Пиковая память остается в пределах бюджета, кроме постоянных расходов чтения
+        CSV/Parquet (около 1 МБ, заметны только при бюджете в несколько МБ) и корзин, которые не удалось разбить
+        (см. max_level). Обработка корзины вызывающим кодом требует памяти пропорционально размеру корзины\n
+    n_buckets : int
+        Начальное кол-во корзин\n
+    chunksize : int
+        Максимальное кол-во строк части лога. None - кол-во строк определяется только бюджетом памяти\n
+    event_filter : list
+        Список событий, которые нужно оставить. Фильтр применяется до записи на диск\n
+    max_level : int
+        Максимальная глубина повторного разбиения корзин. Один клиент никогда не делится между корзинами,
+        поэтому корзина с очень активным клиентом может остаться больше бюджета
+
+    Returns
+    -------
+    bucket : pandas.DataFrame
+        Генератор корзин.
+    """
+    directory = tempfile.mkdtemp(prefix='abo_tools_')
+    bucket_limit = max(memory_limit // 8, 1)
+    chunks = _read_source(source, memory_limit, chunksize)
+    if event_filter is not None:
+        chunks = (chunk[chunk['event'].isin(event_filter)] for chunk in chunks)
+
+    try:
+        paths = [os.path.join(directory, str(i)) for i in range(n_buckets)]
+        stack = [(path, size, 0) for path, size in zip(paths, _spill(chunks, paths, 0, memory_limit)) if size > 0]
+        while stack:
+            path, size, level = stack.pop()
+            if size > bucket_limit and level < max_level:
+                # Корзина больше бюджета - разбиваем ее с другой солью хэша
+                sub_paths = ['{}.{}'.format(path, i) for i in range(int(np.ceil(size / bucket_limit)) + 1)]
+                sub_sizes = _spill(_read_bucket(path), sub_paths, level + 1, memory_limit)
+                os.remove(path)
+                stack.extend((p, s, level + 1) for p, s in zip(sub_paths, sub_sizes) if s > 0)
+                continue
+
+            bucket = pd.concat(list(_read_bucket(path)), ignore_index=True)
+            os.remove(path)
+            yield bucket
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def stream_funnel_df(source, steps, memory_limit=2 ** 30, n_buckets=16, chunksize=None):
+    """
+    Функция расчета воронки по логу, который не помещается в память
+    Parameters
+    ---------
+    source : str, list или iterable
+        Путь к CSV/Parquet файлу, список путей или итератор pandas df с колонками id, event, event_dt.\n
+    steps : list
+        Список исследуемых событий. Список необходимо формировать в порядке воронки, от стартового события, до завершающего.\n
+    memory_limit : int
+        Бюджет памяти в байтах, как в iter_buckets. Расчет по корзине не больше 1/8 бюджета помещается
+        в оставшуюся часть бюджета\n
+    n_buckets : int
+        Начальное кол-во корзин\n
+    chunksize : int
+        Максимальное кол-во строк части лога. None - кол-во строк определяется только бюджетом памяти
+
+    Returns
+    -------
+    funnel_df : pandas.DataFrame
+        Объект pandas df с посчитанным кол-вом клиентов на каждом из этапов воронки, как в create_funnel_df.
+    """
+    values = np.zeros(len(steps), dtype=np.int64)
+    # Воронка считается по клиентам, поэтому результаты корзин просто суммируются
+    for bucket in iter_buckets(source, memory_limit, n_buckets, chunksize, event_filter=steps):
+        values += funnel.create_funnel_df(bucket, steps)['val'].values
+
+    funnel_df = pd.DataFrame({'step':steps, 'val':values})
+
+    return funnel_df
+
+def stream_user_flow(source, start_step, n_steps=5, events_per_step=5, memory_limit=2 ** 30, n_buckets=16, chunksize=None):
+    """
+    Функция расчета путей клиентов по логу, который не помещается в память
+    Parameters
+    ----------
+    source : str, list или iterable
+        Путь к CSV/Parquet файлу, список путей или итератор pandas df с колонками id, event, event_dt.\n
+    start_step : str
+        Название события, с которого начинается путь клиента\n
+    n_steps : int
+        Кол-во возвращаемых событий\n
+    events_per_step : int
+        Кол-во событий, показываемых на каждом из шагов\n
+    memory_limit : int
+        Бюджет памяти в байтах, как в iter_buckets. Расчет по корзине не больше 1/8 бюджета помещается
+        в оставшуюся часть бюджета\n
+    n_buckets : int
+        Начальное кол-во корзин\n
+    chunksize : int
+        Максимальное кол-во строк части лога. None - кол-во строк определяется только бюджетом памяти
+
+    Returns
+    -------
+    flow : pandas.DataFrame
+        Объект pandas df, как в get_user_flow. id всех источников приводятся к строке, поэтому при равной частоте
+        событий шага порядок, как в get_user_flow, сохраняется для числовых и строковых id
+    """
+    steps = list(range(n_steps))
+    counts = None
+    numeric = True
+    for bucket in iter_buckets(source, memory_limit, n_buckets, chunksize):
+        # В корзине считаем кол-во полных путей, без замены редких событий
+        log = as_event_log(bucket)
+        n_events = log.offsets[len(log.ids)]
+        paths, path_users = flow._path_codes(log.users[:n_events], log.events[:n_events], log.offsets,
+                                             log.names.get_indexer([start_step])[0], n_steps)
+        names = np.asarray(log.names, dtype=object)
+        # Коды событий у каждой корзины свои, поэтому для объединения переводим их в названия
+        part = pd.DataFrame(flow._decode_paths(flow._encode_special(paths, names), names), columns=steps)
+
+        # Наименьший id клиента пути - порядок первого появления пути, как в get_user_flow. id - строки,
+        # поэтому для числовых id он считается и по числовому значению
+        ids = pd.Series(np.asarray(log.ids, dtype=object)[path_users])
+        part['first'] = ids.values
+        part['first_number'] = pd.to_numeric(ids, errors='coerce').values
+        numeric = numeric and not np.isnan(part['first_number'].values).any()
+        part = part.groupby(steps).agg(count=('first', 'size'), first=('first', 'min'),
+                                       first_number=('first_number', 'min')).reset_index()
+        if counts is not None:
+            part = pd.concat([counts, part], ignore_index=True).groupby(steps) \
+                .agg({'count': 'sum', 'first': 'min', 'first_number': 'min'}).reset_index()
+        counts = part
+
+    if counts is None:
+        counts = pd.DataFrame(columns=steps + ['count', 'first', 'first_number'])
+
+    # Самые частые события шага определяются по всем корзинам сразу
+    values = counts[steps].values
+    codes, names = pd.factorize(values.ravel())
+    paths = flow._encode_special(codes.reshape(values.shape), names)
+    weights = counts['count'].values.astype(np.int64)
+    first = pd.factorize(counts['first_number' if numeric else 'first'], sort=True)[0]
+    paths = flow._replace_rare(paths, events_per_step, weights=weights, first=first)
+    ranks, labels = flow._rank_labels(paths, np.asarray(names, dtype=object))
+
+    return flow._label_paths(flow._count_paths(ranks, weights=weights), labels)
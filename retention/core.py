@@ -1,36 +1,416 @@
+import os
 import numpy as np
 import pandas as pd
-import plotly.offline as py
-import plotly.graph_objs as go
-import plotly.figure_factory as ff
+from ..reports.event_log import EventLog
+from ..reports.sketch import HyperLogLog, hash_values, _hll_precision, _hll_registers, _hll_group_estimate
+
+def _export_positions(n_columns, by_percent=True):
+    """
+    Функция выбора колонок выгрузки удержания
+    Parameters
+    ----------
+    n_columns : int
+        Кол-во колонок выгрузки.\n
+    by_percent : bool
+        True - оставить колонки с процентами, False - колонки с кол-вом клиентов
+
+    Returns
+    -------
+    positions : list
+        Номера колонок, которые нужно прочитать.
+    """
+    # В выгрузке колонки идут парами, нужна вторая колонка каждой пары
+    positions = list(range(1, n_columns, 2))
+    if not by_percent:
+        positions = positions[1:]
+
+    return positions
+
+def _export_frame(frame, slice_num=7):
+    """
+    Функция приведения выбранных колонок выгрузки к матрице float32
+    Parameters
+    ----------
+    frame : pandas.DataFrame
+        Выбранные колонки выгрузки без служебной строки.\n
+    slice_num : int
+        Кол-во символов, до которого обрезаются названия периодов
+
+    Returns
+    -------
+    retention_df : pandas.DataFrame
+        Объект pandas df с одним блоком float32.
+    """
+    if len(frame.columns) and (frame.dtypes == np.float32).all():
+        values = frame.to_numpy()
+    else:
+        # Колонки, прочитанные как текст (например, '12.5%'), переводим в числа по одной, без копии всей таблицы
+        values = np.empty(frame.shape, dtype=np.float32, order='F')
+        for i in range(frame.shape[1]):
+            col = frame.iloc[:, i]
+            if not pd.api.types.is_numeric_dtype(col):
+                col = pd.to_numeric(col.astype(str).str.rstrip('%').str.replace(',', '.'), errors='coerce')
+            values[:, i] = col
+
+    return pd.DataFrame(values, index=frame.index, columns=[str(col)[0:slice_num] for col in frame.columns], copy=False)
 
 def rete_prepare(df, by_percent=True, slice_num=7):
-    if by_percent:
-        m = df.columns.tolist()
-        del(m[1::2])
-        df.drop(m,axis=1, inplace=True)
+    """
+    Функция подготовки загруженной выгрузки удержания
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Выгрузка удержания: колонки идут парами, первая строка - служебная.\n
+    by_percent : bool
+        True - оставить колонки с процентами, False - колонки с кол-вом клиентов\n
+    slice_num : int
+        Кол-во символов, до которого обрезаются названия периодов
+
+    Returns
+    -------
+    retention_df : pandas.DataFrame
+        Объект pandas df с матрицей удержания float32. Исходный df не меняется.
+    """
+    return _export_frame(df.iloc[1:, _export_positions(df.shape[1], by_percent)], slice_num)
+
+def rete_read(path, by_percent=True, slice_num=7, sheet_name=0):
+    """
+    Функция чтения выгрузки удержания из файла, результат совпадает с rete_prepare для загруженной выгрузки
+    Читаются только нужные колонки, числа CSV и Excel сразу разбираются во float32
+    Parameters
+    ----------
+    path : str
+        Путь к CSV, Excel (.xls, .xlsx) или Parquet (.parquet, .pq) файлу.\n
+    by_percent : bool
+        True - оставить колонки с процентами, False - колонки с кол-вом клиентов\n
+    slice_num : int
+        Кол-во символов, до которого обрезаются названия периодов\n
+    sheet_name : str или int
+        Лист Excel файла
+
+    Returns
+    -------
+    retention_df : pandas.DataFrame
+        Объект pandas df с матрицей удержания float32.
+    """
+    path = os.fspath(path)
+    if path.endswith(('.parquet', '.pq')):
+        import pyarrow.parquet as pq
+        names = [name for name in pq.read_schema(path).names if not name.startswith('__index_level_')]
+        names = [names[i] for i in _export_positions(len(names), by_percent)]
+        frame = pd.read_parquet(path, columns=names).iloc[1:]
+    else:
+        if path.endswith(('.xls', '.xlsx')):
+            def read(**kwargs):
+                return pd.read_excel(path, sheet_name=sheet_name, **kwargs)
+        else:
+            def read(**kwargs):
+                return pd.read_csv(path, **kwargs)
 
-        df.drop(df.index[[0]], inplace=True)
+        positions = _export_positions(len(read(nrows=0).columns), by_percent)
+        # Служебную строку пропускаем при чтении, чтобы колонки сразу разбирались как числа
+        try:
+            frame = read(usecols=positions, skiprows=[1], dtype=np.float32)
+        except ValueError:
+            frame = read(usecols=positions, skiprows=[1])
+        frame.index = frame.index + 1
 
-        templist = df.columns.tolist()
-        sec_templist = []
-        for element in templist:
-            sec_templist.append(element[0:slice_num])
-        
-        df = df.set_axis(sec_templist, axis=1, inplace=True)
+    return _export_frame(frame, slice_num)
 
+def _period_numbers(values, period):
+    """
+    Функция перевода дат в целые номера периодов
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Массив datetime64 без пропусков.\n
+    period : str
+        'D' - день, 'W' - неделя (с понедельника), 'M' - месяц
 
+    Returns
+    -------
+    numbers : numpy.ndarray
+        Номера периодов (int64) от начала эпохи.
+    """
+    if period == 'M':
+        return values.astype('datetime64[M]').astype(np.int64)
+
+    days = values.astype('datetime64[D]').astype(np.int64)
+    if period == 'W':
+        # 1970-01-01 - четверг, поэтому сдвигаем на 3 дня, чтобы неделя начиналась с понедельника
+        return (days + 3) // 7
+    if period == 'D':
+        return days
+
+    raise ValueError("period должен быть 'D', 'W' или 'M'")
+
+def _period_labels(numbers, period):
+    """
+    Функция перевода номеров периодов в подписи когорт
+    Parameters
+    ----------
+    numbers : numpy.ndarray
+        Номера периодов.\n
+    period : str
+        'D', 'W' или 'M'
+
+    Returns
+    -------
+    labels : list
+        Подписи вида 'YYYY-MM-DD' (начало дня или недели) или 'YYYY-MM'.
+    """
+    if period == 'M':
+        return np.asarray(numbers, dtype='datetime64[M]').astype(str).tolist()
+    if period == 'W':
+        numbers = np.asarray(numbers) * 7 - 3
+
+    return np.asarray(numbers, dtype='datetime64[D]').astype(str).tolist()
+
+def _log_periods(df, period):
+    """
+    Функция, возвращающая коды клиентов и номера периодов событий
+    Parameters
+    ----------
+    df : pandas.DataFrame или EventLog
+        Лог событий с колонками id и event_dt.\n
+    period : str
+        'D', 'W' или 'M'
+
+    Returns
+    -------
+    users : numpy.ndarray
+        Коды клиентов (int64) от 0.\n
+    periods : numpy.ndarray
+        Номер периода каждого события. События без id или event_dt не учитываются.\n
+    ids : numpy.ndarray
+        id клиентов, позиция соответствует коду клиента.
+    """
+    if isinstance(df, EventLog):
+        # Периоды считаются только для уникальных значений времени
+        keep = (df.users < len(df.ids)) & df.valid
+        # Лог отсортирован по клиентам, поэтому коды клиентов делаем непрерывными через границы блоков
+        users = df.users[keep]
+        new_user = np.concatenate([[len(users) > 0], users[1:] != users[:-1]])
+        ids = np.asarray(df.ids)[users[new_user]]
+        users = np.cumsum(new_user).astype(np.int64) - 1
+        periods = _period_numbers(np.asarray(df.times, dtype='datetime64[ns]'), period)[df.ts[keep]]
     else:
-        m = df.columns.tolist()
-        del(m[1::2])
-        df.drop(m,axis=1, inplace=True)
-
-        df.drop(df.columns[[0]], axis='columns', inplace=True)
-        df.drop(df.index[[0]], inplace=True)
-
-        templist = df.columns.tolist()
-        sec_templist = []
-        for element in templist:
-            sec_templist.append(element[0:slice_num])
-        
-        df = df.set_axis(sec_templist, axis=1, inplace=True)
\ No newline at end of file
+        keep = (df['id'].notna() & df['event_dt'].notna()).values
+        users, ids = pd.factorize(df['id'].values[keep])
+        users = users.astype(np.int64)
+        ids = np.asarray(ids)
+        periods = _period_numbers(pd.to_datetime(df['event_dt'].values[keep]).values.astype('datetime64[ns]'), period)
+
+    return users, periods, ids
+
+def cohort_retention(df, period='M', by_percent=True, max_periods=None, approx=False):
+    """
+    Функция расчета матрицы удержания когорт по сырому логу событий
+    Parameters
+    ----------
+    df : pandas.DataFrame или EventLog
+        Лог событий с колонками id и event_dt.\n
+    period : str
+        Период когорты и удержания: 'D' - день, 'W' - неделя, 'M' - месяц\n
+    by_percent : bool
+        True - доля активных клиентов когорты в процентах, False - кол-во активных клиентов\n
+    max_periods : int
+        Максимальное кол-во периодов удержания. None - все периоды\n
+    approx : bool или float
+        Приближенный подсчет клиентов через HyperLogLog (см. cohort_sketches) вместо поиска уникальных пар
+        (клиент, период). Относительная стандартная ошибка ячейки - около 2% или не больше числа, заданного вместо True
+
+    Returns
+    -------
+    retention_df : pandas.DataFrame
+        Объект pandas df: строки - когорты (период первой активности клиента), колонки - номер периода от когорты.
+        Периоды, которые еще не наступили, заполнены NaN. Подходит для plot.core.get_int_heatmap и get_static_heatmap.
+    """
+    if approx:
+        # Регистры ячеек не заполняются: оценка считается по непустым регистрам, как и без скетчей
+        hashes, cell, first, n_periods = _cohort_cells(df, period)
+        counts = np.round(_hll_group_estimate(hashes, cell, n_periods * n_periods,
+                                              _hll_precision(0.02 if approx is True else approx))).astype(np.int64)
+        return _retention_frame(counts.reshape(n_periods, n_periods), first, period, by_percent, max_periods)
+
+    users, periods, _ = _log_periods(df, period)
+    first, n_periods, cohort = _user_cohorts(users, periods)
+    periods = periods - first
+
+    # Уникальные пары (клиент, период) - клиент считается активным в периоде один раз.
+    # Если матрица клиент x период небольшая, используем битовую маску вместо хэширования
+    keys = users * n_periods + periods
+    if len(cohort) * n_periods <= 2 ** 28:
+        seen = np.zeros(len(cohort) * n_periods, dtype=bool)
+        seen[keys] = True
+        pairs = np.flatnonzero(seen)
+    else:
+        pairs = pd.unique(keys)
+    pair_cohort = cohort[pairs // n_periods]
+    pair_offset = pairs % n_periods - pair_cohort
+
+    # Один сгруппированный подсчет по (когорта, период от когорты)
+    counts = np.bincount(pair_cohort * n_periods + pair_offset, minlength=n_periods * n_periods) \
+        .reshape(n_periods, n_periods)
+
+    return _retention_frame(counts, first, period, by_percent, max_periods)
+
+def _user_cohorts(users, periods):
+    """
+    Функция расчета когорты каждого клиента
+    Parameters
+    ----------
+    users : numpy.ndarray
+        Коды клиентов от 0.\n
+    periods : numpy.ndarray
+        Номер периода каждого события
+
+    Returns
+    -------
+    first : int
+        Номер первого периода лога.\n
+    n_periods : int
+        Кол-во периодов лога\n
+    cohort : numpy.ndarray
+        Номер периода когорты каждого клиента от first.
+    """
+    # Когорта клиента - период первой активности, считается один раз на клиента
+    first, last = (periods.min(), periods.max()) if len(periods) else (0, -1)
+    n_periods = last - first + 1
+    cohort = np.full(users.max() + 1 if len(users) else 0, n_periods, dtype=np.int64)
+    np.minimum.at(cohort, users, periods - first)
+
+    return first, n_periods, cohort
+
+def _cohort_cells(df, period):
+    """
+    Функция расчета ячейки (когорта, период от когорты) каждой строки лога
+    Parameters
+    ----------
+    df : pandas.DataFrame или EventLog
+        Лог событий с колонками id и event_dt.\n
+    period : str
+        'D', 'W' или 'M'
+
+    Returns
+    -------
+    hashes : numpy.ndarray
+        Хэш id клиента каждой строки.\n
+    cell : numpy.ndarray
+        Номер ячейки в матрице n_periods x n_periods каждой строки.\n
+    first : int
+        Номер первого периода лога.\n
+    n_periods : int
+        Кол-во периодов лога
+    """
+    users, periods, ids = _log_periods(df, period)
+    first, n_periods, cohort = _user_cohorts(users, periods)
+
+    # Повторные события клиента в периоде не меняют регистры, поэтому уникальные пары не ищем
+    user_cohort = cohort[users]
+    cell = user_cohort * n_periods + (periods - first - user_cohort)
+
+    return hash_values(ids)[users], cell, first, n_periods
+
+def _cohort_registers(df, period, precision):
+    """
+    Функция расчета регистров HyperLogLog для каждой ячейки (когорта, период от когорты)
+    Parameters
+    ----------
+    df : pandas.DataFrame или EventLog
+        Лог событий с колонками id и event_dt.\n
+    period : str
+        'D', 'W' или 'M'\n
+    precision : int
+        Точность HyperLogLog
+
+    Returns
+    -------
+    registers : numpy.ndarray
+        Регистры непустых ячеек.\n
+    cells : numpy.ndarray
+        Номер ячейки в матрице n_periods x n_periods для каждой строки registers.\n
+    first : int
+        Номер первого периода лога.\n
+    n_periods : int
+        Кол-во периодов лога
+    """
+    hashes, cell, first, n_periods = _cohort_cells(df, period)
+    present = np.bincount(cell, minlength=n_periods * n_periods) > 0
+    cells = np.flatnonzero(present)
+    cell_index = np.cumsum(present) - 1
+    registers = _hll_registers(hashes, cell_index[cell], len(cells), precision)
+
+    return registers, cells, first, n_periods
+
+def cohort_sketches(df, period='M', relative_error=0.02):
+    """
+    Функция расчета скетчей HyperLogLog клиентов для каждой ячейки матрицы удержания
+    Скетчи, посчитанные по разным клиентам (например, по шардам или по выгрузкам разных платформ), объединяются
+    через merge ячеек с одинаковой когортой и периодом и сохраняются через to_bytes.
+    Parameters
+    ----------
+    df : pandas.DataFrame или EventLog
+        Лог событий с колонками id и event_dt.\n
+    period : str
+        Период когорты и удержания: 'D' - день, 'W' - неделя, 'M' - месяц\n
+    relative_error : float
+        Относительная стандартная ошибка оценки ячейки. Память - 2^p байт на непустую ячейку (4 КБ при 0.02)
+
+    Returns
+    -------
+    sketches_df : pandas.DataFrame
+        Объект pandas df с той же разметкой, что и cohort_retention, и скетчами HyperLogLog в ячейках.
+        Пустые ячейки - None.
+    """
+    registers, cells, first, n_periods = _cohort_registers(df, period, _hll_precision(relative_error))
+    sketches = np.full(n_periods * n_periods, None, dtype=object)
+    sketches[cells] = [HyperLogLog.from_registers(row) for row in registers]
+    sketches = sketches.reshape(n_periods, n_periods)
+
+    # Строки - когорты с клиентами, как в _retention_frame
+    has_cohort = np.array([sketch is not None for sketch in sketches[:, 0]], dtype=bool) if n_periods else np.zeros(0, dtype=bool)
+
+    return pd.DataFrame(sketches[has_cohort],
+                        index=pd.Index(_period_labels(np.flatnonzero(has_cohort) + first, period), name='cohort'),
+                        columns=range(n_periods))
+
+def _retention_frame(counts, first, period, by_percent=True, max_periods=None):
+    """
+    Функция преобразования матрицы (когорта x период от когорты) в pandas df
+    Parameters
+    ----------
+    counts : numpy.ndarray
+        Квадратная матрица кол-ва активных клиентов, строка i - когорта first + i.\n
+    first : int
+        Номер периода первой когорты\n
+    period : str
+        'D', 'W' или 'M'\n
+    by_percent : bool
+        True - доля активных клиентов когорты в процентах, False - кол-во активных клиентов\n
+    max_periods : int
+        Максимальное кол-во периодов удержания. None - все периоды
+
+    Returns
+    -------
+    retention_df : pandas.DataFrame
+        Объект pandas df, как в cohort_retention.
+    """
+    n_periods = len(counts)
+    counts = np.array(counts, dtype=np.float64)
+
+    # Периоды после последнего периода лога еще не наступили
+    counts[np.arange(n_periods)[:, None] + np.arange(n_periods) > n_periods - 1] = np.nan
+    # Каждый клиент когорты активен в нулевом периоде, поэтому пустые когорты - это строки с нулем в первой колонке
+    has_cohort = counts[:, 0] > 0 if n_periods else np.zeros(0, dtype=bool)
+    counts = counts[has_cohort]
+    if by_percent:
+        counts = counts / counts[:, :1] * 100
+
+    retention_df = pd.DataFrame(counts,
+                                index=pd.Index(_period_labels(np.flatnonzero(has_cohort) + first, period), name='cohort'),
+                                columns=range(n_periods))
+    if max_periods is not None:
+        retention_df = retention_df.iloc[:, :max_periods]
+
+    return retention_df
@@ -0,0 +1,240 @@
+import os
+import json
+import numpy as np
+from .core import _log_periods, _retention_frame
+
+class RetentionState(object):
+    """
+    Накопленное состояние удержания когорт
+
+    Для каждого клиента хранится период первой активности (когорта) и последний период активности, а для
+    каждой пары (когорта, период от когорты) - кол-во активных клиентов. Новые события добавляются через update,
+    при этом меняются только ячейки затронутых клиентов, а история повторно не читается. Новые клиенты
+    добавляются в хвост отсортированными сегментами, которые время от времени сливаются с основной частью,
+    поэтому время update зависит от размера пачки, а не от кол-ва клиентов в состоянии. Клиент засчитывается
+    в периоде, если период позже его последнего периода активности, поэтому события должны приходить в
+    хронологическом порядке: события из периодов раньше последнего периода клиента не учитываются.
+
+    Состояние сохраняется в папку из .npy файлов, которые можно открыть через np.load(mmap_mode='r'):
+    дашборду достаточно RetentionState.load(path, mmap_mode='r').to_retention_df() без пересчета, а для
+    обновлений подходит mmap_mode='c': в память попадают только измененные страницы.
+
+    Parameters
+    ----------
+    period : str
+        Период когорты и удержания: 'D' - день, 'W' - неделя, 'M' - месяц
+
+    Attributes
+    ----------
+    ids : numpy.ndarray
+        Отсортированные id клиентов основной части. id с типом object хранятся строками.\n
+    cohort : numpy.ndarray
+        Номер периода когорты каждого клиента основной части.\n
+    last : numpy.ndarray
+        Номер последнего периода активности каждого клиента основной части.\n
+    tail : list
+        Сегменты новых клиентов (ids, cohort, last), каждый отсортирован по id. save сливает их с основной частью.\n
+    counts : numpy.ndarray
+        Кол-во активных клиентов: строка - когорта first + i, колонка - номер периода от когорты.\n
+    first : int
+        Номер периода первой когорты.
+    """
+    FILES = ('ids', 'cohort', 'last', 'counts')
+
+    def __init__(self, period='M'):
+        self.period = period
+        self.ids = None
+        self.cohort = np.zeros(0, dtype=np.int32)
+        self.last = np.zeros(0, dtype=np.int32)
+        self.counts = np.zeros((0, 0), dtype=np.int64)
+        self.first = 0
+        self.tail = []
+
+    def update(self, df):
+        """
+        Функция добавления новых событий в состояние
+        Parameters
+        ----------
+        df : pandas.DataFrame или EventLog
+            Новые события с колонками id и event_dt
+
+        Returns
+        -------
+        retention_df : pandas.DataFrame
+            Объект pandas df с обновленной матрицей удержания в процентах.
+        """
+        users, periods, ids = _log_periods(df, self.period)
+        if not len(users):
+            return self.to_retention_df()
+        if ids.dtype == object:
+            ids = ids.astype(str)
+        if self.ids is None or not len(self.ids):
+            self.ids = ids[:0]
+
+        # Уникальные пары (клиент, период) пачки, отсортированные по клиенту и периоду
+        low = periods.min()
+        span = periods.max() - low + 1
+        # Сортировка с удалением соседних повторов быстрее np.unique, который для целых считает хэш-таблицу
+        pairs = np.sort(users * span + (periods - low))
+        pairs = pairs[np.append(True, pairs[1:] != pairs[:-1])]
+        pair_users = pairs // span
+        pair_periods = pairs % span + low
+        batch_users, user_start = np.unique(pair_users, return_index=True)
+        user_last = np.append(user_start[1:], len(pairs)) - 1
+
+        # Ищем клиентов пачки в основной части и в хвосте, каждый клиент есть только в одном сегменте.
+        # id пачки сортируются один раз: поиск отсортированных id в больших массивах идет подряд по памяти
+        batch_ids = ids[batch_users]
+        order = np.argsort(batch_ids, kind='mergesort')
+        sorted_ids = batch_ids[order]
+        found = np.zeros(len(batch_ids), dtype=bool)
+        # Когорта новых клиентов - их первый период в пачке
+        cohort = pair_periods[user_start].astype(np.int64)
+        last = np.full(len(batch_ids), np.iinfo(np.int32).min, dtype=np.int64)
+        if not self.last.flags.writeable:
+            # Состояние открыто через mmap_mode='r': в памяти нужна только изменяемая копия last
+            self.last = np.array(self.last)
+        segments = [(self.ids, self.cohort, self.last)] + self.tail
+        located = []
+        for segment_ids, segment_cohort, segment_last in segments:
+            pos = np.searchsorted(segment_ids, sorted_ids)
+            hit = pos < len(segment_ids)
+            hit[hit] = segment_ids[pos[hit]] == sorted_ids[hit]
+            pos, hit = pos[hit], order[hit]
+            cohort[hit] = segment_cohort[pos]
+            last[hit] = segment_last[pos]
+            found[hit] = True
+            located.append((hit, pos))
+
+        # Засчитываем только периоды после последнего периода активности клиента
+        user_index = np.searchsorted(batch_users, pair_users)
+        pair_cohort = cohort[user_index]
+        count = (pair_periods > last[user_index]) & (pair_periods >= pair_cohort)
+        self._add_counts(pair_cohort[count], pair_periods[count] - pair_cohort[count])
+
+        # Последний период известных клиентов меняется на месте, новые клиенты добавляются в хвост отдельным
+        # отсортированным сегментом, поэтому обновление не переписывает массивы всего состояния
+        new_last = np.maximum(last, pair_periods[user_last]).astype(np.int32)
+        for (_, _, segment_last), (hit, pos) in zip(segments, located):
+            segment_last[pos] = new_last[hit]
+        new = order[~found[order]]
+        if len(new):
+            self.tail.append((batch_ids[new], cohort[new].astype(np.int32), new_last[new]))
+            self._merge_tail()
+
+        return self.to_retention_df()
+
+    def _merge_tail(self, full=False):
+        """
+        Функция слияния сегментов хвоста
+        Последний сегмент сливается с предыдущим, пока предыдущий не больше чем в 2 раза длиннее, поэтому размеры
+        сегментов убывают геометрически: сегментов O(log n), а каждый клиент переписывается O(log n) раз
+        Parameters
+        ----------
+        full : bool
+            True - слить весь хвост с основной частью
+        """
+        segments = [(self.ids, self.cohort, self.last)] + self.tail
+        while len(segments) > 1 and (full or len(segments[-2][0]) <= 2 * len(segments[-1][0])):
+            (ids, cohort, last), (new_ids, new_cohort, new_last) = segments[-2:]
+            # np.concatenate приводит строковые id к самому длинному id
+            ids = np.concatenate([ids, new_ids])
+            # Оба сегмента отсортированы, устойчивая сортировка сливает их за линейное время
+            order = np.argsort(ids, kind='mergesort')
+            segments[-2:] = [(ids[order], np.concatenate([cohort, new_cohort])[order],
+                              np.concatenate([last, new_last])[order])]
+        (self.ids, self.cohort, self.last), self.tail = segments[0], segments[1:]
+
+    def _add_counts(self, cohort, offset):
+        """
+        Функция добавления активных клиентов в ячейки (когорта, период от когорты)
+        Parameters
+        ----------
+        cohort : numpy.ndarray
+            Номер периода когорты.\n
+        offset : numpy.ndarray
+            Номер периода от когорты
+        """
+        if not len(cohort):
+            return
+
+        counts = self.counts
+        # Матрица расширяется, чтобы покрывать все периоды от первой когорты до последнего периода
+        first = min(cohort.min(), self.first) if len(counts) else cohort.min()
+        end = max((cohort + offset).max() + 1, self.first + len(counts))
+        if first != self.first or end - first != len(counts):
+            grown = np.zeros((end - first, end - first), dtype=np.int64)
+            shift = self.first - first
+            grown[shift:shift + len(counts), :len(counts)] = counts
+            counts, self.first = grown, first
+        elif not counts.flags.writeable:
+            counts = np.array(counts)
+
+        # Иначе ячейки меняются на месте
+        cells, n = np.unique((cohort - self.first) * len(counts) + offset, return_counts=True)
+        counts[cells // len(counts), cells % len(counts)] += n
+        self.counts = counts
+
+    def to_retention_df(self, by_percent=True, max_periods=None):
+        """
+        Функция расчета матрицы удержания по состоянию
+        Parameters
+        ----------
+        by_percent : bool
+            True - доля активных клиентов когорты в процентах, False - кол-во активных клиентов\n
+        max_periods : int
+            Максимальное кол-во периодов удержания. None - все периоды
+
+        Returns
+        -------
+        retention_df : pandas.DataFrame
+            Объект pandas df, как в cohort_retention.
+        """
+        return _retention_frame(self.counts, self.first, self.period, by_percent, max_periods)
+
+    def save(self, path):
+        """
+        Функция сохранения состояния в папку .npy файлов
+        Parameters
+        ----------
+        path : str
+            Путь к папке
+        """
+        os.makedirs(path, exist_ok=True)
+        self._merge_tail(full=True)
+        ids = self.ids if self.ids is not None else np.zeros(0, dtype=str)
+        for name, array in zip(self.FILES, (ids, self.cohort, self.last, self.counts)):
+            # Массивы могут быть открыты через mmap из этих же файлов, поэтому файл пишется рядом и подменяется
+            file = os.path.join(path, name + '.npy')
+            with open(file + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(file + '.tmp', file)
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'period': self.period, 'first': int(self.first)}, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """
+        Функция загрузки состояния, сохраненного через save
+        Parameters
+        ----------
+        path : str
+            Путь к папке\n
+        mmap_mode : str
+            Режим np.load. 'r' - массивы не читаются в память целиком, подходит для дашбордов. 'c' - то же, но
+            update меняет копии страниц в памяти, не читая состояние целиком
+
+        Returns
+        -------
+        state : RetentionState
+            Объект RetentionState.
+        """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        state = cls(meta['period'])
+        state.first = meta['first']
+        for name in cls.FILES:
+            setattr(state, name, np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode, allow_pickle=False))
+
+        return state
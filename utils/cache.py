@@ -0,0 +1,319 @@
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from .. import reports as reports
+from .fingerprint import frame_fingerprint, code_fingerprint, package_fingerprint
+
+"""
+Кэш результатов отчетов (воронки, пути клиентов) в памяти и на диске.
+Ключ - отпечаток данных, название и код функции и модулей reports, аргументы и версия формата кэша, поэтому
+при изменении данных, аргументов или кода отчетов используется новый ключ и старый результат не возвращается,
+а старые записи вытесняются по LRU. По умолчанию отпечаток данных считается по всем строкам, быстрый отпечаток
+по блокам строк (fingerprint='sample') включается явно, если данные не меняются точечно.
+"""
+
+# Версия формата кэша: увеличивается, если меняется формат результатов
+CACHE_VERSION = 2
+
+def _function_fingerprint(func):
+    """
+    Функция отпечатка кода функции расчета, ее модуля и всех модулей пакета reports
+    Функции отчетов вызывают вспомогательные функции своего модуля и других модулей reports (event_log, sketch,
+    sample, parallel), поэтому изменение любой из них тоже меняет ключ
+    Parameters
+    ----------
+    func : callable
+        Функция расчета
+
+    Returns
+    -------
+    fingerprint : str
+        Хэш sha1 в виде hex строки.
+    """
+    func = getattr(func, '__wrapped__', func)
+    module = sys.modules.get(getattr(func, '__module__', None))
+    packages = [reports] + ([module] if module is not None else [])
+
+    return frame_fingerprint(None, code_fingerprint(func), package_fingerprint(*packages))
+
+def sample_fingerprint(data, n_blocks=16, block_size=4096):
+    """
+    Функция быстрого отпечатка данных по кол-ву строк, колонкам и хэшам блоков строк
+    Хэшируются n_blocks блоков по block_size строк, равномерно расположенных по данным (первый и последний блок
+    включаются всегда), поэтому время расчета не зависит от кол-ва строк. Изменение строки вне блоков
+    отпечаток не меняет: для данных, которые меняются точечно, нужен полный отпечаток frame_fingerprint
+    Parameters
+    ----------
+    data : pandas.DataFrame или EventLog
+        Данные\n
+    n_blocks : int
+        Кол-во блоков\n
+    block_size : int
+        Кол-во строк в блоке
+
+    Returns
+    -------
+    fingerprint : str
+        Хэш sha1 в виде hex строки.
+    """
+    n_rows = len(data.users) if hasattr(data, 'offsets') else len(data)
+    starts = np.unique(np.linspace(0, max(n_rows - block_size, 0), n_blocks).astype(np.int64))
+    index = np.unique((starts[:, None] + np.arange(block_size)).ravel())
+    index = index[index < n_rows]
+
+    if hasattr(data, 'offsets'):
+        # EventLog: блоки кодов событий и уникальные значения
+        ids = np.asarray(data.ids)
+        parts = [data.users[index], data.events[index], data.ts[index],
+                 pd.util.hash_array(ids[np.linspace(0, len(ids) - 1, min(len(ids), block_size)).astype(np.int64)]
+                                    if len(ids) else ids)]
+        parts += [data.columns[col][0][index] for col in sorted(data.columns)]
+        return frame_fingerprint(None, n_rows, len(ids), list(data.names), sorted(data.columns),
+                                 [frame_fingerprint(part) for part in parts])
+
+    return frame_fingerprint(data.iloc[index], n_rows)
+
+class ResultCache(object):
+    """
+    Кэш результатов с LRU вытеснением в памяти и на диске
+
+    Результаты хранятся сериализованными через pickle: из кэша всегда возвращается новая копия, поэтому изменение
+    результата не портит кэш. При промахе в памяти результат ищется на диске и поднимается в память. Кэш на диске
+    общий для всех сессий, которые используют одну папку.
+
+    Использование: cache = ResultCache(directory='~/.abo_cache'); create_funnel_df(df, steps, cache=cache)
+
+    Parameters
+    ----------
+    max_memory_bytes : int
+        Максимальный размер результатов в памяти\n
+    directory : str
+        Папка кэша на диске. None - только память\n
+    max_disk_bytes : int
+        Максимальный размер файлов кэша на диске\n
+    fingerprint : str или callable
+        Отпечаток данных: 'full' - хэш всех строк (frame_fingerprint), замечает любое изменение данных; 'sample' -
+        хэш кол-ва строк и блоков строк (sample_fingerprint), время не зависит от размера данных, но изменение
+        строки вне блоков не замечается и возвращается старый результат; или функция data -> str, возвращающая
+        версию датасета, например lambda data: dataset_version
+    """
+    def __init__(self, max_memory_bytes=2 ** 28, directory=None, max_disk_bytes=2 ** 31, fingerprint='full'):
+        if fingerprint not in ('full', 'sample') and not callable(fingerprint):
+            raise ValueError('Неизвестный отпечаток {}'.format(fingerprint))
+        self.max_memory_bytes = max_memory_bytes
+        self.directory = os.path.expanduser(directory) if directory is not None else None
+        self.max_disk_bytes = max_disk_bytes
+        self.fingerprint = fingerprint
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def __repr__(self):
+        # Кэш не меняет результат, поэтому repr не зависит от содержимого: отпечатки аргументов с кэшем стабильны
+        return 'ResultCache(directory={!r})'.format(self.directory)
+
+    def __getstate__(self):
+        # В другой процесс передаются только настройки и кэш на диске
+        state = dict(self.__dict__, _memory=OrderedDict(), _memory_bytes=0)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def data_fingerprint(self, data):
+        """
+        Функция отпечатка данных в соответствии с настройкой fingerprint
+        Parameters
+        ----------
+        data : pandas.DataFrame или EventLog
+            Данные
+
+        Returns
+        -------
+        fingerprint : str
+            Отпечаток данных.
+        """
+        if callable(self.fingerprint):
+            return str(self.fingerprint(data))
+        if self.fingerprint == 'sample':
+            return sample_fingerprint(data)
+
+        return frame_fingerprint(data)
+
+    def key(self, func, data, *args, **kwargs):
+        """
+        Функция ключа кэша. n_jobs в ключ не входит: результат от него не зависит
+        Returns
+        -------
+        key : str
+            Отпечаток данных, функции и ее кода, аргументов и версии формата кэша.
+        """
+        kwargs.pop('n_jobs', None)
+        return frame_fingerprint(None, self.data_fingerprint(data), func.__module__, func.__qualname__,
+                                 _function_fingerprint(func), args, CACHE_VERSION, **kwargs)
+
+    def call(self, func, data, *args, **kwargs):
+        """
+        Функция получения результата func(data, *args, **kwargs) из кэша или его расчета
+        Parameters
+        ----------
+        func : callable
+            Функция расчета\n
+        data : pandas.DataFrame или EventLog
+            Данные, первый аргумент func\n
+        args, kwargs
+            Остальные аргументы func
+
+        Returns
+        -------
+        result
+            Результат func.
+        """
+        key = self.key(func, data, *args, **kwargs)
+        found, result = self.get(key)
+        if found:
+            return result
+
+        # Функции отчетов вызывают кэш из-под декоратора instrument.traced: расчет запускается без декоратора,
+        # чтобы этап функции не замерялся дважды
+        result = getattr(func, '__wrapped__', func)(data, *args, **kwargs)
+        self.put(key, result)
+        return result
+
+    def get(self, key):
+        """
+        Функция поиска результата по ключу
+        Returns
+        -------
+        found : bool
+            Найден ли результат.\n
+        result
+            Копия результата или None.
+        """
+        with self._lock:
+            blob = self._memory.get(key)
+            if blob is not None:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return True, pickle.loads(blob)
+
+            blob = self._read_disk(key)
+            if blob is None:
+                self._stats['misses'] += 1
+                return False, None
+            self._stats['disk_hits'] += 1
+            self._put_memory(key, blob)
+
+        return True, pickle.loads(blob)
+
+    def put(self, key, result):
+        """
+        Функция сохранения результата в память и на диск
+        Parameters
+        ----------
+        key : str
+            Ключ\n
+        result
+            Результат, который можно сериализовать через pickle
+        """
+        blob = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._put_memory(key, blob)
+            self._write_disk(key, blob)
+
+    def _put_memory(self, key, blob):
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        if len(blob) > self.max_memory_bytes:
+            return
+        self._memory[key] = blob
+        self._memory_bytes += len(blob)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, old = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old)
+            self._stats['evictions'] += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def _read_disk(self, key):
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                blob = f.read()
+            # Время изменения файла - время последнего обращения для LRU
+            os.utime(path)
+        except OSError:
+            return None
+
+        return blob
+
+    def _write_disk(self, key, blob):
+        if self.directory is None or len(blob) > self.max_disk_bytes:
+            return
+        # Запись через временный файл: другая сессия не прочитает неполный файл
+        tmp = '{}.{}.tmp'.format(self._path(key), os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp, self._path(key))
+
+        files = []
+        for file in os.listdir(self.directory):
+            # Только что записанный файл не вытесняется, даже если время изменения совпадает с другими
+            if file.endswith('.pkl') and file != key + '.pkl':
+                try:
+                    stat = os.stat(os.path.join(self.directory, file))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, file))
+        total = len(blob) + sum(size for _, size, _ in files)
+        for _, size, file in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, file))
+            except OSError:
+                pass
+            total -= size
+            self._stats['evictions'] += 1
+
+    def stats(self):
+        """
+        Функция статистики кэша
+        Returns
+        -------
+        stats : dict
+            Кол-во попаданий в память (memory_hits) и на диск (disk_hits), промахов (misses), вытеснений (evictions),
+            доля попаданий (hit_rate), кол-во и размер результатов в памяти (memory_items, memory_bytes).
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_items'] = len(self._memory)
+            stats['memory_bytes'] = self._memory_bytes
+        calls = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / calls if calls else 0.0
+
+        return stats
+
+    def clear(self):
+        """
+        Функция очистки кэша в памяти и на диске
+        """
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            if self.directory is not None:
+                for file in os.listdir(self.directory):
+                    if file.endswith('.pkl'):
+                        os.remove(os.path.join(self.directory, file))
@@ -1,5 +1,15 @@
 import smtplib                                              # Импортируем библиотеку по работе с SMTP
 import os                                                   # Функции для работы с операционной системой, не зависящие от используемой операционной системы
+import time                                                 # Паузы между повторными попытками
+import queue                                                # Очередь свободных соединений
+import threading                                            # Блокировка пула соединений
+from collections import OrderedDict                         # LRU кэш вложений
+from concurrent.futures import ThreadPoolExecutor           # Параллельная отправка пачки сообщений
+import base64                                               # Потоковое кодирование вложений
+import gzip                                                 # Сжатие вложений в .gz
+import shutil                                               # Потоковое копирование файлов
+import tempfile                                             # Временные файлы для сжатых вложений
+import zipfile                                              # Сжатие папок и файлов в .zip
 
 # Добавляем необходимые подклассы - MIME-типы
 import mimetypes                                            # Импорт класса для обработки неизвестных MIME-типов, базирующихся на расширении файла
@@ -10,29 +20,610 @@ from email.mime.image import MIMEImage                      # Изображен
 from email.mime.audio import MIMEAudio                      # Аудио
 from email.mime.multipart import MIMEMultipart              # Многокомпонентный объект
 
+# Запас на заголовки письма (From, To, Subject, Date, MIME-границы) и на заголовки каждого вложения
+MESSAGE_HEADER_BYTES = 2048
+PART_HEADER_BYTES = 512
 
-def send_email(recipients, msg_subj, files, html):
-    addr_from = "anastasevdenis@gmail.com"                  # Отправитель
-    password  = "imvaze012"                                 # Пароль
+def _base64_size(size):
+    # Размер в base64: 4 символа на 3 байта и перевод строки на каждые 76 символов
+    encoded = (size + 2) // 3 * 4
+    return encoded + (encoded + 75) // 76
 
+def build_message(addr_from, recipients, msg_subj, files, html, attachments=None):
+    """
+    Функция сборки письма с HTML текстом и вложениями
+    Parameters
+    ----------
+    addr_from : str
+        Отправитель\n
+    recipients : list
+        Список получателей\n
+    msg_subj : str
+        Тема письма\n
+    files : list
+        Список файлов и папок, которые нужно вложить\n
+    html : str
+        Текст письма в HTML\n
+    attachments : list
+        Готовые вложения Attachment вместо files
+
+    Returns
+    -------
+    msg : email.mime.multipart.MIMEMultipart
+        Письмо.
+    """
     msg = MIMEMultipart()                                   # Создаем сообщение
     msg['From']    = addr_from                              # Адресат
     msg['To'] = ", ".join(recipients)                       # Получатель
     msg['Subject'] = msg_subj                               # Тема сообщения
-    
-    msg.attach(MIMEText(html, 'html', 'utf-8'))             # Добавляем в сообщение текст 
-
-    process_attachement(msg, files)
-
-    #======== Блок настройки SMTP GMAIL ======================================================================================
-    server = smtplib.SMTP_SSL('smtp.gmail.com', 465)        # Создаем объект SMTP
-    #server.starttls()                                      # Начинаем шифрованный обмен по TLS
-    #server.set_debuglevel(True)                            # Включаем режим отладки, если не нужен - можно закомментировать
-    server.connect('smtp.gmail.com', 465)
-    server.login(addr_from, password)                       # Получаем доступ
-    server.send_message(msg)                                # Отправляем сообщение
-    server.quit()                                           # Выходим
-    #==========================================================================================================================
+
+    msg.attach(MIMEText(html, 'html', 'utf-8'))             # Добавляем в сообщение текст
+
+    if attachments is None:
+        process_attachement(msg, files)
+    else:
+        for attachment in attachments:
+            msg.attach(attachment.to_mime())
+    return msg
+
+def build_messages(addr_from, recipients, msg_subj, files, html, cache=None, max_bytes=None):
+    """
+    Функция сборки писем с вложениями, разбитыми по лимиту размера письма
+    Parameters
+    ----------
+    addr_from : str
+        Отправитель\n
+    recipients : list
+        Список получателей\n
+    msg_subj : str
+        Тема письма. Если писем несколько, к теме добавляется номер письма (1/3)\n
+    files : list
+        Список файлов и папок, которые нужно вложить\n
+    html : str
+        Текст письма в HTML, повторяется в каждом письме\n
+    cache : AttachmentCache
+        Кэш закодированных вложений. None - новый кэш без сжатия\n
+    max_bytes : int
+        Лимит размера одного письма вместе с текстом и заголовками. None - без лимита
+
+    Returns
+    -------
+    messages : list
+        Список писем.
+    """
+    cache = cache if cache is not None else AttachmentCache(compress=None)
+    budget = None
+    if max_bytes is not None:
+        # Текст письма повторяется в каждом письме и кодируется в base64 (MIMEText с utf-8), поэтому на вложения
+        # остается лимит за вычетом текста, темы, получателей и запаса на заголовки
+        overhead = _base64_size(len(html.encode('utf-8'))) + 2 * len(msg_subj.encode('utf-8')) \
+            + len(', '.join(recipients).encode('utf-8')) + MESSAGE_HEADER_BYTES
+        budget = max_bytes - overhead
+        if budget < 2 * PART_HEADER_BYTES:
+            raise ValueError('Текст и заголовки письма не помещаются в лимит max_bytes={}'.format(max_bytes))
+    groups = pack_attachments(cache.attachments(files, budget - PART_HEADER_BYTES if budget is not None else None), budget)
+
+    messages = []
+    for i, group in enumerate(groups):
+        subject = msg_subj if len(groups) == 1 else '{} ({}/{})'.format(msg_subj, i + 1, len(groups))
+        messages.append(build_message(addr_from, recipients, subject, [], html, attachments=group))
+    return messages
+
+class Attachment(object):
+    """
+    Вложение, уже закодированное в base64, или текстовое вложение
+
+    Parameters
+    ----------
+    filename : str
+        Имя файла во вложении\n
+    ctype : str
+        MIME-тип\n
+    payload : str
+        Содержимое в base64 или текст, если text=True\n
+    text : bool
+        Текстовое вложение: вкладывается как MIMEText, как в attach_file
+    """
+    def __init__(self, filename, ctype, payload, text=False):
+        self.filename = filename
+        self.ctype = ctype
+        self.payload = payload
+        self.text = text
+
+    @property
+    def size(self):
+        """Размер закодированного содержимого в байтах."""
+        if not self.text:
+            return len(self.payload)
+        # MIMEText оставляет ASCII текст как есть, а остальной текст кодирует в utf-8 и base64
+        encoded = len(self.payload.encode('utf-8'))
+        return encoded if self.payload.isascii() else _base64_size(encoded)
+
+    def to_mime(self):
+        """
+        Функция создания MIME части письма без повторного кодирования
+        Returns
+        -------
+        part : email.mime.base.MIMEBase
+            MIME часть с заголовками вложения.
+        """
+        maintype, subtype = self.ctype.split('/', 1)
+        if self.text:
+            part = MIMEText(self.payload, _subtype=subtype)
+        else:
+            part = MIMEBase(maintype, subtype)
+            part.set_payload(self.payload)
+            part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', 'attachment', filename=self.filename)
+        return part
+
+def _encode_stream(fp, start, stop, chunk_size=57 * 16384):
+    """
+    Функция кодирования части файла в base64 по частям
+    Parameters
+    ----------
+    fp : file
+        Файл, открытый на чтение в бинарном режиме.\n
+    start, stop : int
+        Диапазон байт\n
+    chunk_size : int
+        Размер читаемой части, кратен 57 байтам - одной строке base64
+
+    Returns
+    -------
+    payload : str
+        Содержимое в base64 со строками по 76 символов.
+    """
+    fp.seek(start)
+    lines = []
+    remaining = stop - start
+    while remaining > 0:
+        chunk = fp.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        lines.append(base64.encodebytes(chunk).decode('ascii'))
+    return ''.join(lines)
+
+def pack_attachments(attachments, max_bytes=None):
+    """
+    Функция распределения вложений по письмам с сохранением порядка
+    Parameters
+    ----------
+    attachments : list
+        Список вложений Attachment.\n
+    max_bytes : int
+        Лимит размера закодированных вложений одного письма вместе с заголовками вложений (PART_HEADER_BYTES
+        на вложение). None - все вложения в одном письме
+
+    Returns
+    -------
+    groups : list
+        Список списков вложений для каждого письма, хотя бы одно письмо.
+    """
+    groups = [[]]
+    size = 0
+    for attachment in attachments:
+        attachment_size = attachment.size + PART_HEADER_BYTES
+        if max_bytes is not None and groups[-1] and size + attachment_size > max_bytes:
+            groups.append([])
+            size = 0
+        groups[-1].append(attachment)
+        size += attachment_size
+    return groups
+
+class AttachmentCache(object):
+    """
+    Кэш закодированных вложений со сжатием
+
+    Файлы сжимаются и кодируются в base64 по частям через временный файл, поэтому в памяти находится только
+    закодированный результат, а не файл целиком в нескольких копиях. Результат кэшируется по пути, размеру и времени
+    изменения файлов: один и тот же отчет, отправленный многим получателям, кодируется один раз. Вложение больше
+    лимита письма делится на части name.001, name.002, ... (собираются обратно через cat или copy /b).
+    Несжатые текстовые файлы, которые помещаются в одно вложение, вкладываются как MIMEText, как в attach_file.
+    Размер кэша ограничен: давно не использованные вложения вытесняются (LRU), а вложения измененного файла
+    удаляются при кодировании новой версии.
+
+    Parameters
+    ----------
+    compress : str
+        'zip' - папки и большие файлы сжимаются в .zip, 'gzip' - большие файлы сжимаются в .gz, папки - в .zip,
+        None - без сжатия, файлы папки вкладываются по одному\n
+    min_size : int
+        Минимальный размер файла в байтах, который сжимается\n
+    max_memory_bytes : int
+        Максимальный размер закодированных вложений в кэше. Вложения больше лимита не кэшируются
+    """
+    def __init__(self, compress='zip', min_size=2 ** 20, max_memory_bytes=2 ** 28):
+        self.compress = compress
+        self.min_size = min_size
+        self.max_memory_bytes = max_memory_bytes
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+
+    def attachments(self, files, max_bytes=None):
+        """
+        Функция получения закодированных вложений для списка файлов и папок
+        Parameters
+        ----------
+        files : list
+            Список файлов и папок. Несуществующие пути пропускаются, как в process_attachement\n
+        max_bytes : int
+            Лимит размера одного вложения, большие вложения делятся на части. None - без лимита
+
+        Returns
+        -------
+        attachments : list
+            Список вложений Attachment.
+        """
+        result = []
+        for path in files:
+            if os.path.isfile(path):
+                result.extend(self._cached(path, max_bytes))
+            elif os.path.exists(path):
+                if self.compress is None:
+                    for file in sorted(os.listdir(path)):
+                        if os.path.isfile(os.path.join(path, file)):
+                            result.extend(self._cached(os.path.join(path, file), max_bytes))
+                else:
+                    result.extend(self._cached(path, max_bytes))
+        return result
+
+    def _key(self, path, max_bytes):
+        # Ключ кэша меняется при изменении любого файла папки
+        if os.path.isdir(path):
+            stats = []
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    stat = os.stat(os.path.join(root, name))
+                    stats.append((os.path.relpath(os.path.join(root, name), path), stat.st_size, stat.st_mtime_ns))
+            stats = tuple(sorted(stats))
+        else:
+            stat = os.stat(path)
+            stats = (stat.st_size, stat.st_mtime_ns)
+        return os.path.abspath(path), stats, self.compress, self.min_size, max_bytes
+
+    def _cached(self, path, max_bytes):
+        key = self._key(path, max_bytes)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        attachments = self._encode(path, max_bytes)
+        size = sum(attachment.size for attachment in attachments)
+        with self._lock:
+            # Вложения прежних версий файла больше не понадобятся
+            for old in [k for k in self._cache if k[0] == key[0] and k[1] != key[1]]:
+                self._cache_bytes -= sum(attachment.size for attachment in self._cache.pop(old))
+            if key not in self._cache and size <= self.max_memory_bytes:
+                self._cache[key] = attachments
+                self._cache_bytes += size
+                while self._cache_bytes > self.max_memory_bytes:
+                    _, old = self._cache.popitem(last=False)
+                    self._cache_bytes -= sum(attachment.size for attachment in old)
+        return attachments
+
+    def _encode(self, path, max_bytes):
+        """
+        Функция сжатия и кодирования файла или папки
+        Parameters
+        ----------
+        path : str
+            Путь к файлу или папке.\n
+        max_bytes : int
+            Лимит размера одного вложения
+
+        Returns
+        -------
+        attachments : list
+            Одно вложение или части большого вложения.
+        """
+        name = os.path.basename(os.path.normpath(path))
+        with tempfile.TemporaryFile() as tmp:
+            if os.path.isdir(path):
+                # Папка сжимается в один архив, файлы пишутся в архив по частям
+                with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as archive:
+                    for root, _, names in os.walk(path):
+                        for file in sorted(names):
+                            full = os.path.join(root, file)
+                            archive.write(full, os.path.relpath(full, path))
+                name, ctype, fp = name + '.zip', 'application/zip', tmp
+            elif self.compress == 'zip' and os.path.getsize(path) >= self.min_size:
+                with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as archive:
+                    archive.write(path, name)
+                name, ctype, fp = name + '.zip', 'application/zip', tmp
+            elif self.compress == 'gzip' and os.path.getsize(path) >= self.min_size:
+                with open(path, 'rb') as src, gzip.GzipFile(filename=name, mode='wb', fileobj=tmp) as dst:
+                    shutil.copyfileobj(src, dst)
+                name, ctype, fp = name + '.gz', 'application/gzip', tmp
+            else:
+                ctype, encoding = mimetypes.guess_type(path)
+                if ctype is None or encoding is not None:
+                    ctype = 'application/octet-stream'
+                if ctype.startswith('text/') and (max_bytes is None or _base64_size(os.path.getsize(path)) <= max_bytes):
+                    # Несжатый текстовый файл, который помещается в одно вложение, вкладывается как MIMEText,
+                    # как в attach_file
+                    with open(path) as text_file:
+                        return [Attachment(name, ctype, text_file.read(), text=True)]
+                fp = open(path, 'rb')
+
+            try:
+                fp.seek(0, os.SEEK_END)
+                size = fp.tell()
+                # base64 увеличивает размер в 4/3 раза плюс перевод строки на каждые 76 символов
+                part_size = size if max_bytes is None else max(max_bytes * 57 // 78 // 57 * 57, 57)
+                if size <= part_size:
+                    return [Attachment(name, ctype, _encode_stream(fp, 0, size))]
+                return [Attachment('{}.{:03d}'.format(name, i + 1), 'application/octet-stream',
+                                   _encode_stream(fp, start, min(start + part_size, size)))
+                        for i, start in enumerate(range(0, size, part_size))]
+            finally:
+                if fp is not tmp:
+                    fp.close()
+
+def _is_transient(error):
+    """
+    Функция проверки, что ошибку отправки можно исправить повторной попыткой
+    Parameters
+    ----------
+    error : Exception
+        Ошибка отправки
+
+    Returns
+    -------
+    transient : bool
+        True для разрыва соединения, сетевых ошибок и временных (4xx) ответов сервера.
+    """
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPException):
+        # Отказ в получателях, неподдерживаемые команды и т.п. не исправляются повтором
+        return False
+    return isinstance(error, OSError)
+
+class EmailSender(object):
+    """
+    Отправка писем через пул SMTP соединений
+
+    Соединения открываются при первой необходимости (не больше max_connections), после отправки возвращаются в пул
+    и используются повторно, поэтому TLS и авторизация выполняются один раз на соединение, а не на каждое письмо.
+    Разорванное соединение открывается заново. Временные ошибки (разрыв, сетевые ошибки, ответы 4xx) повторяются
+    до retries раз с паузой backoff * 2^попытка секунд. Пачка писем отправляется параллельно по всем соединениям.
+
+    Parameters
+    ----------
+    host : str
+        SMTP сервер. None - переменная окружения ABO_SMTP_HOST или smtp.gmail.com\n
+    port : int
+        Порт. None - ABO_SMTP_PORT или 465\n
+    user : str
+        Логин. None - ABO_SMTP_USER. Пустой логин - без авторизации\n
+    password : str
+        Пароль. None - ABO_SMTP_PASSWORD\n
+    addr_from : str
+        Отправитель писем send_email. None - ABO_SMTP_FROM или user\n
+    use_ssl : bool
+        True - SMTP_SSL, False - обычное соединение (с starttls или без)\n
+    starttls : bool
+        Начинать шифрование через STARTTLS для use_ssl=False\n
+    max_connections : int
+        Максимальное кол-во одновременных соединений\n
+    retries : int
+        Кол-во повторных попыток отправки письма\n
+    backoff : float
+        Пауза перед первой повторной попыткой в секундах\n
+    timeout : float
+        Таймаут сетевых операций в секундах\n
+    idle_check : float
+        Соединение, которое не использовалось дольше idle_check секунд, проверяется командой NOOP перед отправкой\n
+    cache : AttachmentCache
+        Кэш вложений send_email: одни и те же файлы кодируются один раз для всех писем. None - кэш без сжатия\n
+    max_message_bytes : int
+        Лимит размера одного письма send_email вместе с текстом и заголовками, вложения сверх лимита отправляются следующими письмами\n
+    pool_timeout : float
+        Максимальное время ожидания свободного соединения в секундах, если открыто max_connections соединений
+        и все заняты. По истечении - RuntimeError без повторных попыток
+    """
+    def __init__(self, host=None, port=None, user=None, password=None, addr_from=None, use_ssl=True, starttls=False,
+                 max_connections=4, retries=3, backoff=1.0, timeout=60, idle_check=30, cache=None, max_message_bytes=None,
+                 pool_timeout=300):
+        self.host = host or os.environ.get('ABO_SMTP_HOST', 'smtp.gmail.com')
+        self.port = int(port or os.environ.get('ABO_SMTP_PORT', 465))
+        self.user = user if user is not None else os.environ.get('ABO_SMTP_USER')
+        self.password = password if password is not None else os.environ.get('ABO_SMTP_PASSWORD')
+        self.addr_from = addr_from or os.environ.get('ABO_SMTP_FROM') or self.user
+        self.use_ssl = use_ssl
+        self.starttls = starttls
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self.cache = cache if cache is not None else AttachmentCache(compress=None)
+        self.max_message_bytes = max_message_bytes
+        self.pool_timeout = pool_timeout
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    def _connect(self):
+        # Новое соединение: TLS и авторизация выполняются один раз на соединение
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                server.starttls()
+        if self.user:
+            server.login(self.user, self.password)
+        return server
+
+    def _acquire(self):
+        # Свободное соединение из пула, новое соединение, если лимит не достигнут, или ожидание свободного
+        try:
+            server, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.max_connections
+                if can_open:
+                    self._opened += 1
+            if not can_open:
+                try:
+                    server, last_used = self._idle.get(timeout=self.pool_timeout)
+                except queue.Empty:
+                    raise RuntimeError('Нет свободного SMTP соединения за {} с: все {} соединений заняты'.format(
+                        self.pool_timeout, self.max_connections)) from None
+            else:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+
+        if time.time() - last_used > self.idle_check:
+            try:
+                server.noop()
+            except (smtplib.SMTPException, OSError):
+                self._discard(server)
+                return self._acquire()
+        return server
+
+    def _release(self, server):
+        self._idle.put((server, time.time()))
+
+    def _discard(self, server):
+        # Закрываем сломанное соединение, его место в пуле освобождается
+        try:
+            server.close()
+        finally:
+            with self._lock:
+                self._opened -= 1
+
+    def send(self, msg):
+        """
+        Функция отправки одного письма с повторными попытками
+        Parameters
+        ----------
+        msg : email.message.Message
+            Письмо с заполненными From и To
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                server = self._acquire()
+            except Exception as error:
+                if attempt == self.retries or not _is_transient(error):
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+                continue
+
+            try:
+                server.send_message(msg)
+            except Exception as error:
+                if isinstance(error, smtplib.SMTPServerDisconnected) or not isinstance(error, smtplib.SMTPException):
+                    self._discard(server)
+                else:
+                    # Сервер ответил ошибкой, но соединение рабочее
+                    self._release(server)
+                if attempt == self.retries or not _is_transient(error):
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+            else:
+                self._release(server)
+                return
+
+    def send_batch(self, messages):
+        """
+        Функция параллельной отправки пачки писем по соединениям пула
+        Parameters
+        ----------
+        messages : list
+            Список писем
+
+        Returns
+        -------
+        errors : list
+            Для каждого письма None, если оно отправлено, иначе ошибка последней попытки. Ошибка одного письма
+            не останавливает отправку остальных.
+        """
+        def send(msg):
+            try:
+                self.send(msg)
+            except Exception as error:
+                return error
+
+        with ThreadPoolExecutor(max_workers=self.max_connections) as pool:
+            return list(pool.map(send, messages))
+
+    def send_email(self, recipients, msg_subj, files, html):
+        """
+        Функция сборки и отправки письма от addr_from. Вложения берутся из кэша и делятся по max_message_bytes
+        Parameters
+        ----------
+        recipients : list
+            Список получателей\n
+        msg_subj : str
+            Тема письма\n
+        files : list
+            Список файлов и папок, которые нужно вложить\n
+        html : str
+            Текст письма в HTML
+        """
+        if not self.addr_from:
+            raise ValueError('Не задан отправитель: addr_from или user')
+        for msg in build_messages(self.addr_from, recipients, msg_subj, files, html, self.cache, self.max_message_bytes):
+            self.send(msg)
+
+    def close(self):
+        """
+        Функция закрытия всех свободных соединений пула
+        """
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                server.close()
+            with self._lock:
+                self._opened -= 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def send_email(recipients, msg_subj, files, html, sender=None):
+    """
+    Функция отправки одного письма
+    Parameters
+    ----------
+    recipients : list
+        Список получателей\n
+    msg_subj : str
+        Тема письма\n
+    files : list
+        Список файлов и папок, которые нужно вложить\n
+    html : str
+        Текст письма в HTML\n
+    sender : EmailSender
+        Отправитель с пулом соединений. None - новый EmailSender с настройками из переменных окружения
+        ABO_SMTP_HOST, ABO_SMTP_PORT, ABO_SMTP_USER, ABO_SMTP_PASSWORD, ABO_SMTP_FROM, соединение закрывается
+        после отправки
+    """
+    if sender is not None:
+        sender.send_email(recipients, msg_subj, files, html)
+        return
+
+    with EmailSender(max_connections=1) as sender:
+        sender.send_email(recipients, msg_subj, files, html)
 
 def process_attachement(msg, files):                        # Функция по обработке списка, добавляемых к сообщению файлов
     for f in files:
@@ -0,0 +1,220 @@
+import functools
+import hashlib
+import importlib
+import pkgutil
+import types
+import numpy as np
+import pandas as pd
+
+"""
+Отпечатки данных, параметров и кода для ключей кэша результатов (utils.cache) и кэша графиков (plot.pipeline).
+Одинаковые данные, параметры и код дают одинаковый отпечаток, изменение любого из них - новый отпечаток.
+"""
+
+def _update_fingerprint(digest, values):
+    """
+    Функция добавления колонки в хэш отпечатка
+    Числа и даты добавляются байтами без хэширования, остальные значения - кодами pd.factorize и хэшами
+    уникальных значений: хэшировать каждую строку колонки в несколько раз дольше
+    Parameters
+    ----------
+    digest : hashlib.sha1
+        Хэш отпечатка\n
+    values : array-like
+        Значения колонки или индекса
+    """
+    dtype = getattr(values, 'dtype', None)
+    if isinstance(dtype, np.dtype) and dtype.kind in 'biufcmM':
+        digest.update(dtype.str.encode() + np.ascontiguousarray(values).tobytes())
+    else:
+        codes, uniques = pd.factorize(values)
+        digest.update(str(dtype).encode() + codes.tobytes())
+        digest.update(pd.util.hash_array(np.asarray(uniques, dtype=object)).tobytes())
+
+def _update_params(digest, value):
+    """
+    Функция добавления параметра в хэш отпечатка
+    Списки, кортежи, словари и множества обходятся рекурсивно, данные (pandas df, numpy.ndarray, EventLog)
+    добавляются отпечатком frame_fingerprint, функции - code_fingerprint, остальные значения - через repr.
+    repr больших массивов сокращается до '...', поэтому данные в параметрах не могут хэшироваться через repr
+    Parameters
+    ----------
+    digest : hashlib.sha1
+        Хэш отпечатка\n
+    value
+        Параметр
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index, np.ndarray)) or hasattr(value, 'offsets'):
+        data = value.to_series() if isinstance(value, pd.Index) else value
+        digest.update('{}:{}|'.format(type(value).__name__, frame_fingerprint(data)).encode())
+    elif isinstance(value, (list, tuple)):
+        digest.update('{}:{}['.format(type(value).__name__, len(value)).encode())
+        for item in value:
+            _update_params(digest, item)
+        digest.update(b']')
+    elif isinstance(value, dict):
+        digest.update('{}:{}{{'.format(type(value).__name__, len(value)).encode())
+        for key, item in sorted(value.items(), key=lambda kv: repr(kv[0])):
+            _update_params(digest, key)
+            _update_params(digest, item)
+        digest.update(b'}')
+    elif isinstance(value, (set, frozenset)):
+        digest.update('{}:{}('.format(type(value).__name__, len(value)).encode())
+        for item in sorted(value, key=repr):
+            _update_params(digest, item)
+        digest.update(b')')
+    elif isinstance(value, (types.FunctionType, types.MethodType, functools.partial)):
+        digest.update('function:{}|'.format(code_fingerprint(value)).encode())
+    else:
+        digest.update('{}|'.format(repr(value)).encode())
+
+def _update_code(digest, code):
+    # Байткод, константы (вложенные функции - рекурсивно) и используемые имена
+    digest.update(code.co_code)
+    digest.update(repr((code.co_name, code.co_names, code.co_varnames, code.co_freevars)).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _update_code(digest, const)
+        else:
+            digest.update('{}|'.format(repr(const)).encode())
+
+def code_fingerprint(func):
+    """
+    Функция расчета отпечатка функции: меняется при изменении ее кода, значений по умолчанию и замыкания
+    Лямбды и вложенные функции с одинаковым названием, но разным кодом, получают разные отпечатки
+    Parameters
+    ----------
+    func : callable
+        Функция, метод, functools.partial или объект с методом __call__
+
+    Returns
+    -------
+    fingerprint : str
+        Хэш sha1 в виде hex строки.
+    """
+    digest = hashlib.sha1()
+    if isinstance(func, functools.partial):
+        digest.update(code_fingerprint(func.func).encode())
+        _update_params(digest, func.args)
+        _update_params(digest, func.keywords)
+        return digest.hexdigest()
+    if isinstance(func, types.MethodType):
+        digest.update(code_fingerprint(func.__func__).encode())
+        _update_params(digest, func.__self__)
+        return digest.hexdigest()
+
+    digest.update('{}.{}'.format(getattr(func, '__module__', None),
+                                 getattr(func, '__qualname__', type(func).__qualname__)).encode())
+    code = getattr(func, '__code__', None)
+    if code is None:
+        # Встроенные функции меняются только с версией python, у объекта учитывается код __call__ и repr
+        call = getattr(type(func), '__call__', None)
+        if isinstance(call, types.FunctionType) and not isinstance(func, type):
+            digest.update(code_fingerprint(call).encode())
+            _update_params(digest, func)
+        return digest.hexdigest()
+
+    _update_code(digest, code)
+    _update_params(digest, func.__defaults__)
+    _update_params(digest, func.__kwdefaults__)
+    for cell in func.__closure__ or ():
+        try:
+            contents = cell.cell_contents
+        except ValueError:  # пустая ячейка
+            contents = None
+        # Рекурсивная функция держит в замыкании саму себя
+        _update_params(digest, func.__qualname__ if contents is func else contents)
+
+    return digest.hexdigest()
+
+def frame_fingerprint(data, *params, **kwparams):
+    """
+    Функция расчета отпечатка данных и параметров: одинаковые данные и параметры дают одинаковый отпечаток
+    Parameters
+    ----------
+    data : pandas.DataFrame, pandas.Series, numpy.ndarray, EventLog или None
+        Данные. Учитываются значения, индекс, названия и типы колонок\n
+    params, kwparams
+        Параметры расчета: числа, строки, списки, словари и т.п. Вложенные данные и функции учитываются
+        по содержимому (frame_fingerprint, code_fingerprint), остальные значения - через repr
+
+    Returns
+    -------
+    fingerprint : str
+        Хэш sha1 в виде hex строки.
+    """
+    digest = hashlib.sha1()
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        frame = data.to_frame() if isinstance(data, pd.Series) else data
+        if isinstance(frame.index, pd.RangeIndex):
+            digest.update(repr(frame.index).encode())
+        else:
+            _update_fingerprint(digest, frame.index.values)
+        digest.update(repr([str(c) for c in frame.columns]).encode())
+        for i in range(frame.shape[1]):
+            _update_fingerprint(digest, frame.iloc[:, i].values)
+    elif isinstance(data, np.ndarray):
+        digest.update(repr(data.shape).encode())
+        _update_fingerprint(digest, data.ravel())
+    elif data is not None and hasattr(data, 'offsets'):
+        # EventLog: коды и их уникальные значения
+        for array in (data.users, data.events, data.ts):
+            digest.update(array.tobytes())
+        for uniques in (data.ids, data.names, data.times):
+            _update_fingerprint(digest, np.asarray(uniques))
+        for col, (codes, uniques) in sorted(data.columns.items()):
+            digest.update(str(col).encode() + codes.tobytes())
+            _update_fingerprint(digest, np.asarray(uniques))
+    elif data is not None:
+        digest.update(repr(data).encode())
+
+    _update_params(digest, params)
+    _update_params(digest, kwparams)
+    return digest.hexdigest()
+
+_function_fingerprints = {}
+
+def _module_functions_of(module):
+    # Функции и методы классов, объявленные в модуле (не импортированные из других модулей)
+    functions = []
+    for name, value in vars(module).items():
+        if isinstance(value, types.FunctionType) and value.__module__ == module.__name__:
+            functions.append((name, value))
+        elif isinstance(value, type) and value.__module__ == module.__name__:
+            for attr, member in vars(value).items():
+                member = getattr(member, 'fget', None) or getattr(member, '__func__', member)
+                if isinstance(member, types.FunctionType):
+                    functions.append(('{}.{}'.format(name, attr), member))
+
+    return sorted(functions, key=lambda item: item[0])
+
+def package_fingerprint(*packages):
+    """
+    Функция расчета отпечатка кода всех функций и методов классов пакетов
+    Учитываются все модули пакета, а не только уже импортированные, поэтому отпечаток не зависит от того,
+    какие модули успела загрузить сессия. Отпечатки функций запоминаются, пока функция не переопределена
+    (например, importlib.reload)
+    Parameters
+    ----------
+    packages : module
+        Пакеты или отдельные модули, например abo_tools.reports
+
+    Returns
+    -------
+    fingerprint : str
+        Хэш sha1 в виде hex строки.
+    """
+    parts = []
+    for package in packages:
+        modules = [package]
+        if hasattr(package, '__path__'):
+            modules += [importlib.import_module(info.name)
+                        for info in pkgutil.iter_modules(package.__path__, package.__name__ + '.')]
+        for module in modules:
+            for name, func in _module_functions_of(module):
+                fingerprint = _function_fingerprints.get(func)
+                if fingerprint is None:
+                    fingerprint = _function_fingerprints[func] = code_fingerprint(func)
+                parts.append((module.__name__, name, fingerprint))
+
+    return frame_fingerprint(None, parts)
@@ -0,0 +1,461 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+"""
+Замеры этапов расчета отчетов: время, память и кол-во строк на входе и выходе каждого этапа.
+По умолчанию замеры выключены и span() возвращает пустой объект без замеров. Включаются на время блока
+через collect() - только для текущего потока (контекста), или глобально для всех потоков через enable(),
+например, для регламентных расчетов с выгрузкой в лог:
+
+    with instrument.collect(memory=True) as report:
+        funnel.create_funnel_df(df, steps)
+    print(report.to_json())
+
+    instrument.enable(callback=instrument.log_callback())
+"""
+
+# Сборщики блоков collect() - свои у каждого потока и контекста asyncio, сборщики enable() - общие.
+# Этапы записываются в последний включенный сборщик контекста, а если их нет - в последний общий
+_context = contextvars.ContextVar('abo_tools_instrument', default=())
+_global = ()
+_lock = threading.Lock()
+
+def _active():
+    collectors = _context.get() or _global
+    return collectors[-1] if collectors else None
+
+def _rss_mb():
+    # Текущий RSS процесса: /proc есть только в Linux, в остальных ОС - None
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss в Linux - в КБ, в macOS - в байтах
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+def rows(data):
+    """
+    Функция кол-ва строк результата этапа
+    Parameters
+    ----------
+    data : pandas.DataFrame, numpy.ndarray, EventLog, dict или tuple
+        Данные. Для словаря - сумма по значениям, для кортежа - последний элемент (например, df в get_flow_df)
+
+    Returns
+    -------
+    rows : int
+        Кол-во строк или None, если его нельзя определить.
+    """
+    if hasattr(data, 'offsets'):
+        return len(data.users)
+    if isinstance(data, dict):
+        counts = [rows(value) for value in data.values()]
+        return sum(c for c in counts if c is not None)
+    if isinstance(data, tuple):
+        return rows(data[-1]) if data else None
+    try:
+        return len(data)
+    except TypeError:
+        return None
+
+class _NullSpan(object):
+    """Пустой этап: замеры выключены."""
+    rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+    def set(self, **fields):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Span(object):
+    """
+    Замер одного этапа расчета
+
+    Parameters
+    ----------
+    collector : Collector
+        Объект, в который записывается замер\n
+    name : str
+        Название этапа, например 'funnel.encode'\n
+    rows_in : int
+        Кол-во строк на входе этапа\n
+    fields
+        Дополнительные поля замера, например n_jobs
+
+    Attributes
+    ----------
+    rows_out : int
+        Кол-во строк на выходе этапа, задается внутри блока with.\n
+    seconds : float
+        Время этапа.\n
+    children : list
+        Вложенные этапы.
+    """
+    def __init__(self, collector, name, rows_in=None, **fields):
+        self.collector = collector
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.fields = fields
+        self.children = []
+        self.parent = None
+        self.seconds = None
+        self.memory_peak_mb = None
+        self.memory_delta_mb = None
+        self.rss_mb = None
+        self.rss_delta_mb = None
+        self.rss_peak_mb = None
+        self._peak = 0
+
+    def set(self, **fields):
+        """
+        Функция добавления полей замера
+        """
+        self.fields.update(fields)
+
+    def __enter__(self):
+        stack = self.collector._stack()
+        self.parent = stack[-1] if stack else None
+        stack.append(self)
+        if self.collector.memory and tracemalloc.is_tracing():
+            # Пик tracemalloc общий для процесса: перед сбросом пик родителя запоминается в родителе
+            current, peak = tracemalloc.get_traced_memory()
+            if self.parent is not None:
+                self.parent._peak = max(self.parent._peak, peak)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self._memory_start = current
+        self._rss_start = _rss_mb()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._start
+        if self.collector.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            self._peak = max(self._peak, peak)
+            self.memory_peak_mb = (self._peak - self._memory_start) / 2 ** 20
+            self.memory_delta_mb = (current - self._memory_start) / 2 ** 20
+            if self.parent is not None:
+                self.parent._peak = max(self.parent._peak, self._peak)
+        self.rss_mb = _rss_mb()
+        if self.rss_mb is not None and self._rss_start is not None:
+            self.rss_delta_mb = self.rss_mb - self._rss_start
+        self.rss_peak_mb = _peak_rss_mb()
+        if exc_type is not None:
+            self.fields['error'] = exc_type.__name__
+
+        stack = self.collector._stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        if self.parent is not None:
+            self.parent.children.append(self)
+        else:
+            self.collector._finish(self)
+        return False
+
+    def to_dict(self):
+        """
+        Функция преобразования замера в словарь
+        Returns
+        -------
+        span : dict
+            Словарь с ключами name, seconds, rows_in, rows_out, memory_peak_mb, memory_delta_mb (tracemalloc,
+            только при memory=True), rss_mb, rss_delta_mb, rss_peak_mb, дополнительными полями и children.
+        """
+        span = {
+            'name': self.name,
+            'seconds': self.seconds,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'memory_peak_mb': self.memory_peak_mb,
+            'memory_delta_mb': self.memory_delta_mb,
+            'rss_mb': self.rss_mb,
+            'rss_delta_mb': self.rss_delta_mb,
+            'rss_peak_mb': self.rss_peak_mb,
+        }
+        span.update(self.fields)
+        span['children'] = [child.to_dict() for child in self.children]
+
+        return span
+
+class Collector(object):
+    """
+    Сборщик замеров этапов
+
+    Parameters
+    ----------
+    memory : bool
+        Замерять память через tracemalloc. Замедляет расчет в несколько раз, поэтому по умолчанию выключено,
+        RSS замеряется всегда\n
+    callback : callable
+        Функция, которая вызывается со словарем (Span.to_dict) после завершения каждого этапа верхнего уровня,
+        например log_callback()\n
+    keep : bool
+        Сохранять завершенные этапы в spans. Для глобального включения с callback можно выключить,
+        чтобы замеры не накапливались
+
+    Attributes
+    ----------
+    spans : list
+        Завершенные этапы верхнего уровня.
+    """
+    def __init__(self, memory=False, callback=None, keep=True):
+        self.memory = memory
+        self.callback = callback
+        self.keep = keep
+        self.spans = []
+        self._local = threading.local()
+        self._started_tracing = False
+        self._all_threads = None
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _finish(self, span):
+        if self.keep:
+            self.spans.append(span)
+        if self.callback is not None:
+            self.callback(span.to_dict())
+
+    def start(self, all_threads=False):
+        """
+        Функция включения сборщика
+        Parameters
+        ----------
+        all_threads : bool
+            False - этапы записываются в этот сборщик только в текущем потоке (контексте), True - во всех потоках
+        """
+        global _global
+        if self._all_threads is not None:
+            raise RuntimeError('Сборщик уже включен')
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._all_threads = all_threads
+        if all_threads:
+            with _lock:
+                _global = _global + (self,)
+        else:
+            _context.set(_context.get() + (self,))
+
+    def stop(self):
+        """
+        Функция выключения сборщика. Остальные включенные сборщики не меняются, даже если они включены позже
+        """
+        global _global
+        if self._all_threads:
+            with _lock:
+                _global = tuple(c for c in _global if c is not self)
+        elif self._all_threads is not None:
+            _context.set(tuple(c for c in _context.get() if c is not self))
+        self._all_threads = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def to_dict(self):
+        """
+        Функция выгрузки замеров
+        Returns
+        -------
+        spans : list
+            Список словарей Span.to_dict этапов верхнего уровня.
+        """
+        return [span.to_dict() for span in self.spans]
+
+    def to_json(self, **kwargs):
+        """
+        Функция выгрузки замеров в JSON
+        Parameters
+        ----------
+        kwargs
+            Аргументы json.dumps, например indent=2
+
+        Returns
+        -------
+        spans : str
+            JSON список этапов верхнего уровня.
+        """
+        return json.dumps(self.to_dict(), default=str, **kwargs)
+
+    def flat(self):
+        """
+        Функция выгрузки замеров в плоский список
+        Returns
+        -------
+        spans : list
+            Словари всех этапов без children, name - путь этапа через '/', например 'create_funnel_df/funnel.encode'.
+        """
+        result = []
+
+        def walk(span, prefix):
+            record = span.to_dict()
+            del record['children']
+            record['name'] = prefix + span.name
+            result.append(record)
+            for child in span.children:
+                walk(child, record['name'] + '/')
+
+        for span in self.spans:
+            walk(span, '')
+        return result
+
+def span(name, rows_in=None, **fields):
+    """
+    Функция замера этапа: with span('funnel.encode', rows_in=len(df)) as s: ...; s.rows_out = len(result)
+    Parameters
+    ----------
+    name : str
+        Название этапа\n
+    rows_in : int
+        Кол-во строк на входе этапа\n
+    fields
+        Дополнительные поля замера
+
+    Returns
+    -------
+    span : Span
+        Контекстный менеджер замера. Если замеры выключены - пустой объект без замеров.
+    """
+    collectors = _context.get() or _global
+    if not collectors:
+        return _NULL_SPAN
+
+    return Span(collectors[-1], name, rows_in, **fields)
+
+def traced(name):
+    """
+    Декоратор замера функции целиком: rows_in - строки первого аргумента, rows_out - строки результата
+    Parameters
+    ----------
+    name : str
+        Название этапа
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not (_global or _context.get()):
+                return func(*args, **kwargs)
+            with span(name, rows(args[0]) if args else None) as s:
+                result = func(*args, **kwargs)
+                s.rows_out = rows(result)
+            return result
+        return wrapper
+    return decorator
+
+def enabled():
+    """
+    Функция проверки, включены ли замеры
+    Returns
+    -------
+    enabled : bool
+        True, если в текущем потоке есть включенный сборщик.
+    """
+    return _active() is not None
+
+def collect(memory=False, callback=None):
+    """
+    Функция создания сборщика для блока with: with collect() as report: ...
+    Сборщик записывает этапы только текущего потока (контекста), поэтому параллельные блоки collect()
+    в разных потоках не смешивают замеры
+    Parameters
+    ----------
+    memory : bool
+        Замерять память через tracemalloc\n
+    callback : callable
+        Функция, которая вызывается со словарем каждого завершенного этапа верхнего уровня
+
+    Returns
+    -------
+    collector : Collector
+        Сборщик, который включается при входе в блок with.
+    """
+    return Collector(memory, callback)
+
+def enable(memory=False, callback=None, keep=False):
+    """
+    Функция глобального включения замеров во всех потоках
+    Parameters
+    ----------
+    memory : bool
+        Замерять память через tracemalloc\n
+    callback : callable
+        Функция, которая вызывается со словарем каждого завершенного этапа верхнего уровня\n
+    keep : bool
+        Сохранять этапы в collector.spans
+
+    Returns
+    -------
+    collector : Collector
+        Включенный сборщик.
+    """
+    collector = Collector(memory, callback, keep)
+    collector.start(all_threads=True)
+    return collector
+
+def disable():
+    """
+    Функция выключения глобальных замеров и замеров текущего потока
+    """
+    for collector in _global + _context.get():
+        collector.stop()
+
+def log_callback(logger=None, level=logging.INFO):
+    """
+    Функция создания callback, который пишет каждый этап в лог одной JSON строкой
+    Parameters
+    ----------
+    logger : logging.Logger
+        Логгер. None - логгер 'abo_tools.instrument'\n
+    level : int
+        Уровень записи
+
+    Returns
+    -------
+    callback : callable
+        Функция для Collector(callback=...).
+    """
+    logger = logger or logging.getLogger('abo_tools.instrument')
+
+    def callback(span):
+        logger.log(level, json.dumps(span, default=str))
+    return callback
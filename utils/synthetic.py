@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+
+"""
+Генерация синтетических логов событий для бенчмарков и проверок.
+Лог похож на реальный: активность клиентов распределена по степенному закону, события идут сессиями,
+внутри сессии часть событий проходит воронку по порядку словаря, а подгруппы (например, ОС) постоянны для клиента.
+При одинаковом seed лог одинаков.
+"""
+
+def _segment_values(values):
+    # Подгруппа задается списком значений (равные доли) или словарем значение -> доля
+    if isinstance(values, dict):
+        p = np.asarray(list(values.values()), dtype=np.float64)
+        return np.array(list(values.keys()), dtype=object), p / p.sum()
+    return np.array(list(values), dtype=object), None
+
+def make_event_log(n_rows, n_users=None, n_events=30, alpha=1.5, event_alpha=1.0, session_events=6, event_gap=60,
+                   funnel_share=0.5, segments=None, days=90, start='2020-01-01', seed=0, sort=True):
+    """
+    Функция генерации синтетического лога событий
+    Parameters
+    ----------
+    n_rows : int
+        Кол-во событий\n
+    n_users : int
+        Кол-во клиентов. None - n_rows / 20. Клиенты без событий в лог не попадают\n
+    n_events : int или list
+        Кол-во разных событий (event_0, event_1, ...) или список названий событий\n
+    alpha : float
+        Показатель степенного закона активности клиентов: чем меньше, тем больше событий у самых активных клиентов\n
+    event_alpha : float
+        Показатель закона Ципфа для популярности событий вне воронки\n
+    session_events : float
+        Среднее кол-во событий в сессии\n
+    event_gap : float
+        Средний интервал между событиями сессии в секундах\n
+    funnel_share : float
+        Доля событий, которые идут по воронке: i-е событие сессии - i-е событие словаря\n
+    segments : dict
+        Подгруппы клиентов: название колонки -> список значений или словарь значение -> доля,
+        например {'os': {'ios': 0.4, 'android': 0.6}}\n
+    days : int
+        Кол-во дней, в которые равномерно попадают начала сессий\n
+    start : str
+        Дата начала лога\n
+    seed : int
+        Зерно генератора\n
+    sort : bool
+        True - лог отсортирован по event_dt, как выгрузка из хранилища, False - по клиентам
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        Объект pandas df с колонками id, event, event_dt и колонками подгрупп.
+    """
+    rs = np.random.RandomState(seed)
+    if n_users is None:
+        n_users = max(n_rows // 20, 1)
+    names = np.array(['event_{}'.format(i) for i in range(n_events)] if np.isscalar(n_events) else list(n_events),
+                     dtype=object)
+
+    # Активность клиентов - распределение Парето, события раскладываются по клиентам пропорционально активности
+    weights = rs.pareto(alpha, n_users) + 1
+    counts = rs.multinomial(n_rows, weights / weights.sum())
+    users = np.repeat(np.arange(n_users), counts)
+    user_start = np.concatenate([[0], np.cumsum(counts)[:-1]])[counts > 0]
+
+    # Сессии: первое событие клиента всегда начинает сессию, остальные - с вероятностью 1 / session_events
+    new_session = rs.rand(n_rows) < 1.0 / session_events
+    new_session[user_start] = True
+    session = np.cumsum(new_session) - 1
+    session_first = np.flatnonzero(new_session)
+    position = np.arange(n_rows) - session_first[session]
+
+    # Время события - начало сессии плюс накопленные интервалы внутри сессии
+    gaps = rs.exponential(event_gap, n_rows)
+    gaps[new_session] = 0
+    elapsed = np.cumsum(gaps)
+    elapsed -= elapsed[session_first][session]
+    seconds = rs.randint(0, days * 86400, len(session_first))[session] + elapsed.astype(np.int64)
+
+    # События: часть идет по воронке в порядке словаря, остальные выбираются по популярности
+    popularity = 1.0 / np.arange(1, len(names) + 1) ** event_alpha
+    events = rs.choice(len(names), n_rows, p=popularity / popularity.sum())
+    funnel = rs.rand(n_rows) < funnel_share
+    events[funnel] = np.minimum(position[funnel], len(names) - 1)
+
+    # id не связаны с активностью клиента
+    ids = rs.permutation(n_users)
+    columns = {
+        'id': ids[users],
+        'event': names[events],
+        'event_dt': np.datetime64(pd.Timestamp(start).to_datetime64(), 's') + seconds.astype('timedelta64[s]'),
+    }
+    for col, values in (segments or {}).items():
+        values, p = _segment_values(values)
+        columns[col] = values[rs.choice(len(values), n_users, p=p)][users]
+
+    df = pd.DataFrame(columns)
+    if sort:
+        df = df.iloc[np.argsort(seconds, kind='stable')].reset_index(drop=True)
+
+    return df
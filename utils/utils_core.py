@@ -1,33 +1,76 @@
 import numpy as np
 import pandas as pd
-import plotly.offline as py
-import plotly.graph_objs as go
-import plotly.figure_factory as ff
-import matplotlib.pyplot as plt
-import seaborn as sns
 
 """
 List of help function. If you need some help, call various method from this module and be HAPPY!
 """
 
+def _as_list(col):
+    # Функции модуля принимают одну колонку или список колонок
+    return list(col) if isinstance(col, (list, tuple, pd.Index)) else [col]
+
 def categoriсal_dict(df, col):
-    categoryValue = df[col].unique()
-    categoryValueCount = len(categoryValue)
-    category_dict = {}
-    for i in range(0, categoryValueCount):
-        category_dict[categoryValue[i]] = i
-    df[col] = df[col].map(category_dict).astype(int)
+    """
+    Функция замены значений колонок на коды 0, 1, ... в порядке появления значений. Пропуск - отдельное значение
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Объект pandas df, изменяется на месте.\n
+    col : str или list
+        Колонка или список колонок
+    """
+    for c in _as_list(col):
+        codes, _ = pd.factorize(df[c])
+        na = codes < 0
+        if na.any():
+            # factorize дает пропускам код -1, а пропуск должен получить код по месту первого появления:
+            # сдвигаем коды значений, которые появились после первого пропуска
+            first_na = na.argmax()
+            position = codes[:first_na].max() + 1 if first_na else 0
+            codes += codes >= position
+            codes[na] = position
+        df[c] = codes.astype(int)
 
 def remove_outlier(df, col):
-    q1 = df[col].quantile(0.25)
-    q3 = df[col].quantile(0.75)
+    """
+    Функция удаления строк с выбросами: значениями за пределами [q1 - 1.5 * iqr, q3 + 1.5 * iqr]
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Объект pandas df, изменяется на месте.\n
+    col : str или list
+        Колонка или список колонок. Квантили всех колонок считаются одним вызовом по одним и тем же строкам,
+        строка удаляется, если выброс хотя бы в одной колонке
+    """
+    cols = _as_list(col)
+    q = df[cols].quantile([0.25, 0.75])
+    q1, q3 = q.iloc[0], q.iloc[1]
     iqr = q3 - q1
     fence_low = q1 - 1.5*iqr
     fence_high = q3 + 1.5*iqr
-    df.drop(df[(df[col] < fence_low) | (df[col] > fence_high)].index, inplace=True)
+
+    # Одна общая маска по всем колонкам и одно удаление строк
+    outlier = np.zeros(len(df), dtype=bool)
+    for c in cols:
+        values = df[c].values
+        outlier |= (values < fence_low[c]) | (values > fence_high[c])
+    df.drop(df.index[outlier], inplace=True)
 
 def nan_dict(map_var):
-    if map_var is np.nan:
+    if pd.isna(map_var):
         return 0
     else:
-        return 1
\ No newline at end of file
+        return 1
+
+def nan_flag(df, col):
+    """
+    Функция замены значений колонок на 0 (пропуск) и 1 (заполнено), векторный аналог map(nan_dict)
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Объект pandas df, изменяется на месте.\n
+    col : str или list
+        Колонка или список колонок
+    """
+    for c in _as_list(col):
+        df[c] = df[c].notna().values.astype(np.int8)